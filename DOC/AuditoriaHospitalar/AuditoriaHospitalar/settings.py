@@ -91,6 +91,29 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Memória local por padrão; AUDITORIA_CACHE_DIR usa arquivos (compartilhado entre processos)
+
+if os.environ.get("AUDITORIA_CACHE_DIR"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+            "LOCATION": os.environ["AUDITORIA_CACHE_DIR"],
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "auditoria-hospitalar",
+        }
+    }
+
+# Validade (s) das consultas em cache do dashboard, monitoramento e contas
+AUDITORIA_CACHE_TTL = int(os.environ.get("AUDITORIA_CACHE_TTL", 300))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
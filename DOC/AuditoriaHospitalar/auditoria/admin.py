@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Internacao, ItemConta, Auditoria
+from .models import CensoDiario, Internacao, ItemConta, Auditoria
 
 @admin.register(Internacao)
 class InternacaoAdmin(admin.ModelAdmin):
@@ -20,3 +20,10 @@ class AuditoriaAdmin(admin.ModelAdmin):
     list_filter = ['tipo', 'data_auditoria']
     search_fields = ['internacao__paciente__nome', 'auditor__username']
     date_hierarchy = 'data_auditoria'
+
+@admin.register(CensoDiario)
+class CensoDiarioAdmin(admin.ModelAdmin):
+    list_display = ['data', 'setor', 'patologia', 'ativas', 'alertas', 'atualizado_em']
+    list_filter = ['setor', 'data']
+    date_hierarchy = 'data'
+    readonly_fields = ['data', 'setor', 'patologia', 'ativas', 'alertas', 'atualizado_em']
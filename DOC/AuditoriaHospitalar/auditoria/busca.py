@@ -0,0 +1,173 @@
+"""
+Busca textual do histórico de auditorias
+
+SQLite: tabela virtual FTS5 (auditoria_busca_fts, modelo não gerenciado
+AuditoriaBusca) com o nome do paciente e as observações, rowid = id da
+auditoria, mantida pelos signals de signals.py.
+PostgreSQL: tsvector 'portuguese' sobre f_unaccent(), com índices GIN
+criados na migração 0003. Outros bancos usam icontains.
+
+Nos três casos a busca ignora acentos e maiúsculas, casa prefixos de
+palavras ("Jos" encontra "José") e anota `relevancia` (maior = melhor).
+"""
+import re
+import unicodedata
+from typing import List
+
+from django.db import connections
+from django.db.models import ExpressionWrapper, F, FloatField, Func, Lookup, Q, TextField, Value
+
+TABELA_FTS = 'auditoria_busca_fts'
+_tabela_existe = {}
+
+
+def extrair_termos(termo: str) -> List[str]:
+    """Palavras do termo de busca, sem acentos e em minúsculas"""
+    sem_acento = unicodedata.normalize('NFKD', termo).encode('ascii', 'ignore').decode('ascii')
+    return re.findall(r'\w+', sem_acento.lower())
+
+
+def indice_fts_disponivel(using: str = 'default') -> bool:
+    """True se o banco é SQLite e a tabela FTS5 foi criada pela migração"""
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return False
+    chave = (using, connection.settings_dict['NAME'])
+    if chave not in _tabela_existe:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [TABELA_FTS])
+            _tabela_existe[chave] = cursor.fetchone() is not None
+    return _tabela_existe[chave]
+
+
+def _select_documentos(filtro: str) -> str:
+    """SELECT (id, nome do paciente, observações) das auditorias que atendem `filtro`"""
+    from core.models import Paciente
+    from .models import Auditoria, Internacao
+
+    return (
+        f"SELECT a.id, p.nome, a.observacoes "
+        f"FROM {Auditoria._meta.db_table} a "
+        f"JOIN {Internacao._meta.db_table} i ON i.id = a.internacao_id "
+        f"JOIN {Paciente._meta.db_table} p ON p.id = i.paciente_id "
+        f"WHERE {filtro}"
+    )
+
+
+def _regravar(filtro_fts: str, filtro_documentos: str, parametros: list, using: str):
+    connection = connections[using]
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELA_FTS} WHERE {filtro_fts}", parametros)
+        cursor.execute(
+            f"INSERT INTO {TABELA_FTS} (rowid, nome_paciente, observacoes) "
+            + _select_documentos(filtro_documentos),
+            parametros
+        )
+
+
+def indexar_auditoria(auditoria_id: int, using: str = 'default'):
+    """(Re)grava o documento de uma auditoria no índice"""
+    if indice_fts_disponivel(using):
+        _regravar('rowid = %s', 'a.id = %s', [auditoria_id], using)
+
+
+def indexar_paciente(paciente_id: int, using: str = 'default'):
+    """Atualiza os documentos de todas as auditorias do paciente (ex.: nome corrigido)"""
+    if not indice_fts_disponivel(using):
+        return
+    from .models import Auditoria
+
+    ids = list(Auditoria.objects.using(using).filter(
+        internacao__paciente_id=paciente_id).values_list('id', flat=True))
+    if ids:
+        marcadores = ', '.join(['%s'] * len(ids))
+        _regravar(f'rowid IN ({marcadores})', f'a.id IN ({marcadores})', ids, using)
+
+
+def remover_auditoria(auditoria_id: int, using: str = 'default'):
+    if indice_fts_disponivel(using):
+        with connections[using].cursor() as cursor:
+            cursor.execute(f"DELETE FROM {TABELA_FTS} WHERE rowid = %s", [auditoria_id])
+
+
+def reconstruir_indice(using: str = 'default') -> int:
+    """Recria o índice inteiro a partir das tabelas (após cargas com bulk_create)"""
+    if not indice_fts_disponivel(using):
+        return 0
+    with connections[using].cursor() as cursor:
+        cursor.execute(f"DELETE FROM {TABELA_FTS}")
+        cursor.execute(
+            f"INSERT INTO {TABELA_FTS} (rowid, nome_paciente, observacoes) " + _select_documentos('1 = 1')
+        )
+        cursor.execute(f"INSERT INTO {TABELA_FTS} ({TABELA_FTS}) VALUES ('optimize')")
+        cursor.execute(f"SELECT COUNT(*) FROM {TABELA_FTS}")
+        return cursor.fetchone()[0]
+
+
+class Unaccent(Func):
+    """f_unaccent(texto): wrapper IMMUTABLE de unaccent criado na migração (PostgreSQL)"""
+    function = 'f_unaccent'
+    output_field = TextField()
+
+
+class DocumentoFTS(TextField):
+    """Coluna oculta de uma tabela FTS5 (mesmo nome da tabela); só serve para __match"""
+
+
+@DocumentoFTS.register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+
+def _buscar_fts(queryset, termos: List[str]):
+    consulta = ' '.join(f'"{t}"*' for t in termos)
+    # JOIN com a tabela FTS5: o MATCH escolhe as linhas e o rank (bm25 com os
+    # pesos configurados na migração) sai do mesmo cursor, sem subconsulta por linha.
+    # rank é negativo e menor = melhor; invertido para maior = melhor
+    return queryset.filter(busca__documento__match=consulta).annotate(
+        relevancia=ExpressionWrapper(-F('busca__rank'), output_field=FloatField())
+    )
+
+
+def _buscar_postgres(queryset, termos: List[str]):
+    from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+
+    consulta = SearchQuery(' & '.join(f'{t}:*' for t in termos), search_type='raw', config='portuguese')
+    # Mesmas expressões dos índices GIN da migração 0003
+    vetor_nome = SearchVector(Unaccent('internacao__paciente__nome'), config='portuguese')
+    vetor_observacoes = SearchVector(Unaccent('observacoes'), config='portuguese')
+    return queryset.annotate(
+        vetor_nome=vetor_nome, vetor_observacoes=vetor_observacoes
+    ).filter(
+        Q(vetor_nome=consulta) | Q(vetor_observacoes=consulta)
+    ).annotate(
+        relevancia=SearchRank(
+            SearchVector(Unaccent('internacao__paciente__nome'), config='portuguese', weight='A')
+            + SearchVector(Unaccent('observacoes'), config='portuguese', weight='B'),
+            consulta
+        )
+    )
+
+
+def buscar_auditorias(queryset, termo: str):
+    """
+    Filtra as auditorias pelo termo (nome do paciente ou observações) e
+    anota `relevancia`. Ordenar por '-relevancia' fica a cargo de quem chama.
+    """
+    termos = extrair_termos(termo)
+    using = queryset.db
+    vendor = connections[using].vendor
+
+    if termos and indice_fts_disponivel(using):
+        return _buscar_fts(queryset, termos)
+    if termos and vendor == 'postgresql':
+        return _buscar_postgres(queryset, termos)
+
+    return queryset.filter(
+        Q(internacao__paciente__nome__icontains=termo) | Q(observacoes__icontains=termo)
+    ).annotate(relevancia=Value(0.0, output_field=FloatField()))
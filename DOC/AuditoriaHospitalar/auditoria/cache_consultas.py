@@ -0,0 +1,118 @@
+"""
+Cache das consultas das views (dashboard, monitoramento, resumo de contas)
+
+Usa o framework de cache do Django (CACHES em settings.py). Em vez de apagar
+chaves, cada grupo de dados ('internacoes', 'contas', 'auditorias') tem um
+contador de geração que entra na chave; os signals incrementam o contador
+quando um modelo do grupo muda, e as entradas antigas simplesmente deixam de
+ser lidas (expiram pelo TTL).
+
+O incremento só acontece depois do commit: se fosse antes, outra requisição
+poderia reler os dados antigos (ainda não confirmados) e gravá-los em cache
+sob a geração nova, que ficaria valendo até o TTL.
+"""
+import hashlib
+import json
+import threading
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+GRUPOS = ('internacoes', 'contas', 'auditorias')
+PREFIXO = 'auditoria'
+
+
+class CacheConsultas:
+    """Resultados de consultas por nome + parâmetros, invalidados por geração"""
+
+    def __init__(self, alias: str = 'default'):
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._contadores: Dict[str, Dict[str, int]] = {}
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def ttl(self) -> int:
+        return getattr(settings, 'AUDITORIA_CACHE_TTL', 300)
+
+    @staticmethod
+    def _chave_geracao(grupo: str) -> str:
+        return f'{PREFIXO}:geracao:{grupo}'
+
+    def geracoes(self, grupos: Iterable[str]) -> Dict[str, int]:
+        grupos = list(grupos)
+        chaves = {self._chave_geracao(g): g for g in grupos}
+        valores = self.cache.get_many(list(chaves))
+        return {grupo: valores.get(chave, 0) for chave, grupo in chaves.items()}
+
+    def invalidar(self, *grupos: str):
+        """Incrementa a geração dos grupos (todos, se nenhum for informado)"""
+        for grupo in grupos or GRUPOS:
+            chave = self._chave_geracao(grupo)
+            # add() não sobrescreve; incr() falha se a chave expirou entre as duas chamadas
+            self.cache.add(chave, 0, timeout=None)
+            try:
+                self.cache.incr(chave)
+            except ValueError:
+                self.cache.set(chave, 1, timeout=None)
+
+    def invalidar_apos_commit(self, *grupos: str, using: Optional[str] = None):
+        """invalidar() quando a transação atual for confirmada (na hora, fora de uma transação)"""
+        transaction.on_commit(lambda: self.invalidar(*grupos), using=using)
+
+    def _chave(self, nome: str, grupos: Iterable[str], parametros: Optional[Dict[str, Any]]) -> str:
+        geracoes = self.geracoes(grupos)
+        conteudo = json.dumps({'g': geracoes, 'p': parametros or {}}, sort_keys=True, default=str)
+        resumo = hashlib.sha256(conteudo.encode('utf-8')).hexdigest()[:32]
+        return f'{PREFIXO}:{nome}:{resumo}'
+
+    def _contar(self, nome: str, evento: str):
+        with self._lock:
+            contadores = self._contadores.setdefault(nome, {'hits': 0, 'misses': 0})
+            contadores[evento] += 1
+
+    def obter_ou_calcular(self, nome: str, grupos: Iterable[str], fabrica: Callable[[], Any],
+                          parametros: Optional[Dict[str, Any]] = None) -> Any:
+        """Valor em cache para (nome, parâmetros, gerações dos grupos) ou o resultado de `fabrica`"""
+        chave = self._chave(nome, grupos, parametros)
+        valor = self.cache.get(chave)
+        if valor is not None:
+            self._contar(nome, 'hits')
+            return valor
+
+        self._contar(nome, 'misses')
+        valor = fabrica()
+        self.cache.set(chave, valor, self.ttl)
+        return valor
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Acertos/erros por consulta desde o início do processo"""
+        with self._lock:
+            por_consulta = {nome: dict(c) for nome, c in self._contadores.items()}
+        for contadores in por_consulta.values():
+            total = contadores['hits'] + contadores['misses']
+            contadores['taxa_acerto'] = round(contadores['hits'] / total, 3) if total else 0.0
+        hits = sum(c['hits'] for c in por_consulta.values())
+        misses = sum(c['misses'] for c in por_consulta.values())
+        return {
+            'backend': settings.CACHES[self.alias]['BACKEND'],
+            'ttl': self.ttl,
+            'hits': hits,
+            'misses': misses,
+            'taxa_acerto': round(hits / (hits + misses), 3) if hits + misses else 0.0,
+            'geracoes': self.geracoes(GRUPOS),
+            'consultas': por_consulta,
+        }
+
+    def zerar_contadores(self):
+        with self._lock:
+            self._contadores.clear()
+
+
+# Instância global para uso
+cache_consultas = CacheConsultas()
@@ -0,0 +1,139 @@
+"""
+Censo diário materializado (CensoDiario) para o dashboard
+
+Cada save/exclusão de Internacao aplica o delta (ativas/alertas) na linha do
+dia com F(), em vez de o dashboard recontar a tabela de internações.
+O primeiro evento do dia (ou a primeira leitura) recalcula o censo inteiro a
+partir das internações; o comando recalcular_censo faz o mesmo de forma
+periódica, já que alertas de permanência surgem só com a passagem do tempo.
+
+Por isso o alerta de uma internação que sai de uma linha (alta, transferência,
+exclusão) pode ainda não estar contado nela: subtrair o alerta atual faria
+`alertas` derivar para baixo. A linha de origem é recontada (uma agregação
+filtrada por setor e patologia) em vez de receber o delta.
+"""
+import logging
+from datetime import date
+from typing import Any, Dict, Optional
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils import timezone
+
+from .models import CensoDiario, Internacao
+
+logger = logging.getLogger(__name__)
+
+
+def estado_censo(internacao_id: int, using: str = 'default') -> Optional[Dict[str, Any]]:
+    """Setor, patologia e alerta da internação se ela conta no censo (ativa); senão None"""
+    return (
+        Internacao.objects.using(using).ativas().com_permanencia()
+        .filter(pk=internacao_id)
+        .values('setor', 'patologia_id', 'tem_alerta')
+        .first()
+    )
+
+
+def recalcular_censo(data: Optional[date] = None, using: str = 'default') -> Dict[str, int]:
+    """Recria as linhas do censo de `data` (hoje por padrão) a partir das internações ativas"""
+    data = data or timezone.localdate()
+    linhas = (
+        Internacao.objects.using(using).ativas().com_permanencia()
+        .values('setor', 'patologia_id')
+        .annotate(ativas=Count('id'), alertas=Count('id', filter=Q(tem_alerta=True)))
+        .order_by()
+    )
+    agora = timezone.now()
+    censos = [
+        CensoDiario(data=data, setor=linha['setor'], patologia_id=linha['patologia_id'],
+                    ativas=linha['ativas'], alertas=linha['alertas'], atualizado_em=agora)
+        for linha in linhas
+    ]
+    with transaction.atomic(using=using):
+        CensoDiario.objects.using(using).filter(data=data).delete()
+        CensoDiario.objects.using(using).bulk_create(censos)
+
+    return {
+        'linhas': len(censos),
+        'ativas': sum(c.ativas for c in censos),
+        'alertas': sum(c.alertas for c in censos),
+    }
+
+
+def _aplicar_delta(data: date, setor: str, patologia_id: int, ativas: int, alertas: int, using: str):
+    atualizadas = CensoDiario.objects.using(using).filter(
+        data=data, setor=setor, patologia_id=patologia_id
+    ).update(ativas=F('ativas') + ativas, alertas=F('alertas') + alertas, atualizado_em=timezone.now())
+    if atualizadas:
+        return
+
+    # Primeira internação do dia nesse setor/patologia
+    try:
+        with transaction.atomic(using=using):
+            CensoDiario.objects.using(using).create(
+                data=data, setor=setor, patologia_id=patologia_id,
+                ativas=max(ativas, 0), alertas=max(alertas, 0)
+            )
+    except IntegrityError:
+        # Outra requisição criou a linha entre o update e o create
+        _aplicar_delta(data, setor, patologia_id, ativas, alertas, using)
+
+
+def _recontar_linha(data: date, setor: str, patologia_id: int, using: str):
+    """Recalcula só a linha (setor, patologia) do censo a partir das internações ativas"""
+    totais = (
+        Internacao.objects.using(using).ativas().com_permanencia()
+        .filter(setor=setor, patologia_id=patologia_id)
+        .aggregate(ativas=Count('id'), alertas=Count('id', filter=Q(tem_alerta=True)))
+    )
+    CensoDiario.objects.using(using).update_or_create(
+        data=data, setor=setor, patologia_id=patologia_id,
+        defaults={'ativas': totais['ativas'], 'alertas': totais['alertas'], 'atualizado_em': timezone.now()},
+    )
+
+
+def registrar_mudanca(anterior: Optional[Dict[str, Any]], atual: Optional[Dict[str, Any]],
+                      using: str = 'default'):
+    """
+    Atualiza o censo de hoje com a diferença entre o estado anterior e o atual
+    de uma internação (dicts de estado_censo(); None = não conta no censo)
+    """
+    if anterior == atual:
+        return
+
+    hoje = timezone.localdate()
+    if not CensoDiario.objects.using(using).filter(data=hoje).exists():
+        # Virada do dia: o recálculo já enxerga o estado atual
+        recalcular_censo(hoje, using)
+        return
+
+    origem = (anterior['setor'], anterior['patologia_id']) if anterior else None
+    if atual and (atual['setor'], atual['patologia_id']) != origem:
+        # Alerta calculado agora: o +1 é exato
+        _aplicar_delta(hoje, atual['setor'], atual['patologia_id'],
+                       1, int(atual['tem_alerta']), using)
+    if origem:
+        # Chamado após o save/delete: a recontagem já enxerga o estado atual
+        _recontar_linha(hoje, *origem, using)
+
+
+def resumo_censo(data: Optional[date] = None) -> Dict[str, Any]:
+    """Totais e distribuição por setor do censo do dia, recalculado se ainda não existir"""
+    data = data or timezone.localdate()
+    censo = CensoDiario.objects.filter(data=data)
+    totais = censo.aggregate(ativas=Sum('ativas', default=0), alertas=Sum('alertas', default=0))
+    if not totais['ativas'] and not censo.exists():
+        recalcular_censo(data)
+        totais = censo.aggregate(ativas=Sum('ativas', default=0), alertas=Sum('alertas', default=0))
+
+    por_setor = list(
+        censo.filter(ativas__gt=0).values('setor')
+        .annotate(total=Sum('ativas'), alertas=Sum('alertas'))
+        .order_by('setor')
+    )
+    return {
+        'total_internacoes': totais['ativas'],
+        'total_alertas': totais['alertas'],
+        'por_setor': por_setor,
+    }
@@ -0,0 +1,56 @@
+import csv
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from auditoria.models import Internacao
+from auditoria.regras_glosa import MotorRegrasGlosa, resumir
+
+
+class Command(BaseCommand):
+    help = ('Avalia os itens pendentes das contas contra os procedimentos padrão (RF017/RF020). '
+            'Só relatório: nenhum item é alterado.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--desde', help='Data de saída inicial (AAAA-MM-DD)')
+        parser.add_argument('--ate', help='Data de saída final (AAAA-MM-DD)')
+        parser.add_argument('--lote', type=int, default=1000, help='Internações por lote')
+        parser.add_argument('--tolerancia', type=Decimal, default=Decimal('0.10'),
+                            help='Desvio aceito do valor padrão (0.10 = 10%%)')
+        parser.add_argument('--saida', help='Arquivo CSV com as inconsistências encontradas')
+
+    def _data(self, valor):
+        data = parse_date(valor)
+        if data is None:
+            raise CommandError(f'Data inválida: {valor}')
+        return data
+
+    def handle(self, *args, **kwargs):
+        internacoes = Internacao.objects.filter(status='ALTA')
+        if kwargs['desde']:
+            internacoes = internacoes.filter(data_saida__date__gte=self._data(kwargs['desde']))
+        if kwargs['ate']:
+            internacoes = internacoes.filter(data_saida__date__lte=self._data(kwargs['ate']))
+
+        inicio = time.perf_counter()
+        motor = MotorRegrasGlosa(tolerancia_preco=kwargs['tolerancia'], tamanho_lote=kwargs['lote'])
+        inconsistencias = list(motor.avaliar(internacoes))
+        tempo = time.perf_counter() - inicio
+
+        if kwargs['saida']:
+            with open(kwargs['saida'], 'w', newline='', encoding='utf-8') as arquivo:
+                escritor = csv.DictWriter(arquivo, fieldnames=[
+                    'regra', 'internacao_id', 'item_id', 'procedimento_id', 'valor_glosa_sugerido', 'mensagem'
+                ])
+                escritor.writeheader()
+                escritor.writerows(inconsistencias)
+
+        resumo = resumir(inconsistencias)
+        self.stdout.write(f"Inconsistências em {resumo['contas_com_inconsistencia']} contas ({tempo:.2f}s):")
+        for regra, dados in resumo['por_regra'].items():
+            self.stdout.write(f"   • {regra:<20} {dados['quantidade']:>6}   "
+                              f"glosa sugerida R$ {dados['valor_glosa_sugerido']:.2f}")
+        if kwargs['saida']:
+            self.stdout.write(self.style.SUCCESS(f"✓ Detalhes em {kwargs['saida']}"))
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from auditoria.cache_consultas import cache_consultas
+from auditoria.censo import recalcular_censo
+
+
+class Command(BaseCommand):
+    help = ('Recalcula o censo de hoje (ativas e alertas de permanência). '
+            'Agende periodicamente (ex.: de hora em hora): alertas surgem com a passagem do tempo.')
+
+    def handle(self, *args, **kwargs):
+        hoje = timezone.localdate()
+        resultado = recalcular_censo(hoje)
+        # Alertas mudaram sem save de Internacao: descarta o dashboard em cache
+        cache_consultas.invalidar('internacoes')
+        self.stdout.write(self.style.SUCCESS(
+            f"✓ Censo de {hoje:%d/%m/%Y}: {resultado['ativas']} internações ativas, "
+            f"{resultado['alertas']} alertas ({resultado['linhas']} setores/patologias)"
+        ))
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from auditoria.busca import indice_fts_disponivel, reconstruir_indice
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice FTS5 da busca do histórico (após cargas com bulk_create)'
+
+    def handle(self, *args, **kwargs):
+        if not indice_fts_disponivel():
+            self.stdout.write(self.style.WARNING('Índice FTS5 indisponível neste banco; nada a fazer.'))
+            return
+
+        inicio = time.perf_counter()
+        total = reconstruir_indice()
+        self.stdout.write(self.style.SUCCESS(
+            f'✓ {total} auditorias indexadas em {time.perf_counter() - inicio:.2f}s'
+        ))
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:17
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auditoria', '0001_initial'),
+        ('core', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='auditoria',
+            index=models.Index(fields=['-data_auditoria'], name='auditoria_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='internacao',
+            index=models.Index(fields=['status', 'setor'], name='internacao_status_setor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='internacao',
+            index=models.Index(fields=['status', 'data_saida'], name='internacao_status_saida_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='itemconta',
+            index=models.Index(fields=['internacao', 'status'], name='itemconta_intern_status_idx'),
+        ),
+    ]
@@ -0,0 +1,95 @@
+"""
+Índice de busca textual do histórico de auditorias (ver auditoria/busca.py)
+
+SQLite: tabela virtual FTS5 sem acentos (unicode61 remove_diacritics 2),
+populada com as auditorias existentes e com o rank bm25 pesando o nome do
+paciente 2x as observações.
+PostgreSQL: extensão unaccent, wrapper IMMUTABLE f_unaccent e índices GIN
+nas mesmas expressões tsvector usadas pela busca.
+"""
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.utils import OperationalError
+
+import auditoria.busca
+
+SQL_POPULAR_FTS = """
+    INSERT INTO auditoria_busca_fts (rowid, nome_paciente, observacoes)
+    SELECT a.id, p.nome, a.observacoes
+    FROM auditoria_auditoria a
+    JOIN auditoria_internacao i ON i.id = a.internacao_id
+    JOIN core_paciente p ON p.id = i.paciente_id
+"""
+
+SQL_POSTGRES = [
+    "CREATE EXTENSION IF NOT EXISTS unaccent",
+    """
+    CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+    AS $$ SELECT public.unaccent('public.unaccent', $1) $$
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS auditoria_observacoes_fts_idx ON auditoria_auditoria
+    USING GIN (to_tsvector('portuguese'::regconfig, COALESCE(f_unaccent(observacoes), '')))
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS paciente_nome_fts_idx ON core_paciente
+    USING GIN (to_tsvector('portuguese'::regconfig, COALESCE(f_unaccent(nome), '')))
+    """,
+]
+
+
+def criar_indice_busca(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        try:
+            schema_editor.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS auditoria_busca_fts USING fts5("
+                "nome_paciente, observacoes, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except OperationalError:
+            # SQLite compilado sem FTS5: a busca continua com icontains
+            return
+        schema_editor.execute(
+            "INSERT INTO auditoria_busca_fts (auditoria_busca_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')"
+        )
+        schema_editor.execute(SQL_POPULAR_FTS)
+    elif vendor == 'postgresql':
+        for sql in SQL_POSTGRES:
+            schema_editor.execute(sql)
+
+
+def remover_indice_busca(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute("DROP TABLE IF EXISTS auditoria_busca_fts")
+    elif vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS auditoria_observacoes_fts_idx")
+        schema_editor.execute("DROP INDEX IF EXISTS paciente_nome_fts_idx")
+        schema_editor.execute("DROP FUNCTION IF EXISTS f_unaccent(text)")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auditoria', '0002_indices_consultas'),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(criar_indice_busca, remover_indice_busca),
+        migrations.CreateModel(
+            name='AuditoriaBusca',
+            fields=[
+                ('auditoria', models.OneToOneField(db_column='rowid', db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='busca', serialize=False, to='auditoria.auditoria')),
+                ('nome_paciente', models.TextField()),
+                ('observacoes', models.TextField()),
+                ('documento', auditoria.busca.DocumentoFTS(db_column='auditoria_busca_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'auditoria_busca_fts',
+                'managed': False,
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-18 08:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auditoria', '0003_busca_textual'),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CensoDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.DateField()),
+                ('setor', models.CharField(choices=[('UTI', 'UTI'), ('ENFERMARIA', 'Enfermaria'), ('APARTAMENTO', 'Apartamento')], max_length=20)),
+                ('ativas', models.IntegerField(default=0)),
+                ('alertas', models.IntegerField(default=0)),
+                ('atualizado_em', models.DateTimeField(auto_now=True)),
+                ('patologia', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='censos', to='core.patologia')),
+            ],
+            options={
+                'verbose_name': 'Censo Diário',
+                'verbose_name_plural': 'Censos Diários',
+                'constraints': [models.UniqueConstraint(fields=('data', 'setor', 'patologia'), name='censo_dia_setor_patologia_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.7 on 2026-10-18 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auditoria', '0004_censo_diario'),
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='internacao',
+            name='internacao_status_setor_idx',
+        ),
+        migrations.AddIndex(
+            model_name='internacao',
+            index=models.Index(fields=['status', 'setor', 'data_entrada'], name='internacao_status_setor_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='internacao',
+            index=models.Index(fields=['status', 'data_entrada'], name='internacao_status_entrada_idx'),
+        ),
+    ]
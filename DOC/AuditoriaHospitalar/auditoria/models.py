@@ -1,6 +1,86 @@
 from django.db import models
+from django.db.models import F, Q, Value, ExpressionWrapper
+from django.db.models.functions import Coalesce, Greatest, Now
 from django.utils import timezone
 from core.models import Paciente, Patologia, Procedimento
+from .busca import DocumentoFTS
+
+
+class DiasEntre(models.Func):
+    """
+    Dias inteiros entre duas datas/horas (fim - inicio), calculado no banco.
+    Arredonda para baixo como timedelta.days: -6h dá -1, não 0.
+    """
+    # PostgreSQL (e padrão): segundos do intervalo / 86400, com FLOOR
+    # (EXTRACT(DAY ...) pegaria só o componente de dias, truncado)
+    template = "CAST(FLOOR(EXTRACT(EPOCH FROM (%(expressions)s)) / 86400) AS INTEGER)"
+    arg_joiner = " - "
+    output_field = models.IntegerField()
+
+    def __init__(self, fim, inicio, **extra):
+        super().__init__(fim, inicio, **extra)
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        # julianday devolve dias fracionários e CAST trunca em direção a zero; sem
+        # floor() (só com SQLITE_ENABLE_MATH_FUNCTIONS), desconta 1 dos negativos
+        # não inteiros (a comparação vale 0 ou 1)
+        diferenca, params = self.as_sql(
+            compiler, connection,
+            template="(julianday(%(expressions)s))",
+            arg_joiner=") - julianday(",
+            **extra_context
+        )
+        truncado = f"CAST({diferenca} AS INTEGER)"
+        return f"({truncado} - ({diferenca} < {truncado}))", (*params, *params, *params)
+
+
+class DiaJuliano(models.Func):
+    """Data/hora como número de dias (fracionário), para somar dias e ordenar no banco"""
+    # PostgreSQL (e padrão): segundos desde a época / 86400
+    template = "(EXTRACT(EPOCH FROM %(expressions)s) / 86400.0)"
+    output_field = models.FloatField()
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(compiler, connection, template="julianday(%(expressions)s)", **extra_context)
+
+
+class InternacaoQuerySet(models.QuerySet):
+    """Permanência, excesso e alerta calculados em SQL para filtrar, contar e ordenar no banco"""
+
+    def ativas(self):
+        return self.filter(status='ATIVA')
+
+    def com_permanencia(self):
+        """
+        Anota dias_permanencia, excesso_dias e tem_alerta (mesma regra de
+        tempo_permanencia(), dias_excesso() e excedeu_tempo_ideal())
+        """
+        fim = Coalesce('data_saida', Now(), output_field=models.DateTimeField())
+        tempo_ideal = F('patologia__tempo_internacao_ideal')
+        return self.annotate(
+            dias_permanencia=DiasEntre(fim, 'data_entrada'),
+        ).annotate(
+            excesso_dias=Greatest(F('dias_permanencia') - tempo_ideal, Value(0)),
+            tem_alerta=ExpressionWrapper(Q(dias_permanencia__gt=tempo_ideal), output_field=models.BooleanField()),
+        )
+
+    def com_limite_alerta(self):
+        """
+        Anota limite_alerta: dia (DiaJuliano) em que a internação passa do tempo
+        ideal. Não depende de Now(), então serve de chave estável de paginação;
+        ordem crescente = maior excesso_dias primeiro.
+        """
+        return self.annotate(
+            limite_alerta=ExpressionWrapper(
+                DiaJuliano('data_entrada') + F('patologia__tempo_internacao_ideal'),
+                output_field=models.FloatField()
+            )
+        )
+
+    def com_alerta(self):
+        """Internações que excederam o tempo ideal da patologia"""
+        return self.com_permanencia().filter(dias_permanencia__gt=F('patologia__tempo_internacao_ideal'))
+
 
 class Internacao(models.Model):
     STATUS_CHOICES = [
@@ -18,9 +98,19 @@ class Internacao(models.Model):
     observacoes = models.TextField(blank=True)
     alerta_tempo = models.BooleanField(default=False)
     
+    objects = InternacaoQuerySet.as_manager()
+    
     class Meta:
         verbose_name = "Internação"
         verbose_name_plural = "Internações"
+        indexes = [
+            # Monitoramento/dashboard: ativas por setor, mais antigas primeiro
+            # (a ordem da paginação keyset vem do índice, sem ordenar em memória)
+            models.Index(fields=['status', 'setor', 'data_entrada'], name='internacao_status_setor_idx'),
+            models.Index(fields=['status', 'data_entrada'], name='internacao_status_entrada_idx'),
+            # Análise de contas: finalizadas ordenadas por data de saída
+            models.Index(fields=['status', 'data_saida'], name='internacao_status_saida_idx'),
+        ]
     
     def __str__(self):
         return f"{self.paciente.nome} - {self.data_entrada.strftime('%d/%m/%Y')}"
@@ -43,6 +133,30 @@ class Internacao(models.Model):
         return excesso if excesso > 0 else 0
 
 
+class CensoDiario(models.Model):
+    """
+    Censo de internações ativas e alertas de permanência por dia, setor e
+    patologia. Mantido por signals (ver censo.py) e recalculado pelo comando
+    recalcular_censo quando os dias viram.
+    """
+    data = models.DateField()
+    setor = models.CharField(max_length=20, choices=Paciente.SETOR_CHOICES)
+    patologia = models.ForeignKey(Patologia, on_delete=models.CASCADE, related_name='censos')
+    ativas = models.IntegerField(default=0)
+    alertas = models.IntegerField(default=0)
+    atualizado_em = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Censo Diário"
+        verbose_name_plural = "Censos Diários"
+        constraints = [
+            models.UniqueConstraint(fields=['data', 'setor', 'patologia'], name='censo_dia_setor_patologia_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.data:%d/%m/%Y} - {self.setor} - {self.patologia.nome}: {self.ativas}"
+
+
 class ItemConta(models.Model):
     STATUS_CHOICES = [
         ('PENDENTE', 'Pendente'),
@@ -62,6 +176,10 @@ class ItemConta(models.Model):
     class Meta:
         verbose_name = "Item da Conta"
         verbose_name_plural = "Itens da Conta"
+        indexes = [
+            # Detalhe da conta: itens da internação por status, somando valor_total
+            models.Index(fields=['internacao', 'status'], name='itemconta_intern_status_idx'),
+        ]
     
     def save(self, *args, **kwargs):
         self.valor_total = self.quantidade * self.valor_unitario
@@ -88,7 +206,29 @@ class Auditoria(models.Model):
     class Meta:
         verbose_name = "Auditoria"
         verbose_name_plural = "Auditorias"
+        indexes = [
+            # Histórico: mais recentes primeiro
+            models.Index(fields=['-data_auditoria'], name='auditoria_data_idx'),
+        ]
     
     def __str__(self):
         return f"{self.tipo} - {self.internacao.paciente.nome} - {self.data_auditoria.strftime('%d/%m/%Y')}"
 
+
+
+class AuditoriaBusca(models.Model):
+    """
+    Tabela virtual FTS5 da busca do histórico (só SQLite; ver busca.py).
+    Criada pela migração 0003 e escrita apenas por busca.py/signals.py.
+    """
+    auditoria = models.OneToOneField(Auditoria, primary_key=True, db_column='rowid',
+                                     on_delete=models.DO_NOTHING, db_constraint=False,
+                                     related_name='busca')
+    nome_paciente = models.TextField()
+    observacoes = models.TextField()
+    documento = DocumentoFTS(db_column='auditoria_busca_fts')
+    rank = models.FloatField()
+
+    class Meta:
+        managed = False
+        db_table = 'auditoria_busca_fts'
@@ -0,0 +1,226 @@
+"""
+Paginação por keyset (seek) para as listas da auditoria
+
+Em vez de OFFSET, cada página guarda no cursor os valores das chaves de
+ordenação da última linha e a próxima página filtra "depois desses valores".
+O custo de cada página é o mesmo na primeira ou na milésima. A página
+anterior usa o cursor da primeira linha (?antes=) com a ordenação invertida.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional
+
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import F, Q
+from django.utils.dateparse import parse_date, parse_datetime
+
+TAMANHO_PAGINA_PADRAO = 50
+TAMANHO_PAGINA_MAXIMO = 200
+
+
+class PaginaKeyset:
+    """Uma página de resultados e os cursores para a seguinte e a anterior"""
+
+    def __init__(self, itens: List[Any], tamanho: int, proximo_cursor: Optional[str],
+                 query_proxima: str = '', query_primeira: str = '', eh_primeira: bool = True,
+                 cursor_anterior: Optional[str] = None, query_anterior: str = ''):
+        self.itens = itens
+        self.tamanho = tamanho
+        self.proximo_cursor = proximo_cursor
+        self.query_proxima = query_proxima
+        self.query_primeira = query_primeira
+        self.eh_primeira = eh_primeira
+        self.cursor_anterior = cursor_anterior
+        self.query_anterior = query_anterior
+
+    @property
+    def tem_proxima(self) -> bool:
+        return self.proximo_cursor is not None
+
+    @property
+    def tem_anterior(self) -> bool:
+        return self.cursor_anterior is not None
+
+
+def _serializar_valor(valor: Any) -> Any:
+    if isinstance(valor, datetime):
+        return {'dt': valor.isoformat()}
+    if isinstance(valor, date):
+        return {'d': valor.isoformat()}
+    if isinstance(valor, Decimal):
+        return {'dec': str(valor)}
+    return valor
+
+
+def _desserializar_valor(valor: Any) -> Any:
+    if isinstance(valor, dict):
+        if 'dt' in valor:
+            return parse_datetime(valor['dt'])
+        if 'd' in valor:
+            return parse_date(valor['d'])
+        if 'dec' in valor:
+            return Decimal(valor['dec'])
+    return valor
+
+
+def codificar_cursor(valores: List[Any]) -> str:
+    conteudo = json.dumps([_serializar_valor(v) for v in valores], separators=(',', ':'))
+    return base64.urlsafe_b64encode(conteudo.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decodificar_cursor(cursor: str, quantidade: int) -> Optional[List[Any]]:
+    """Valores do cursor, ou None se estiver malformado (volta para a primeira página)"""
+    try:
+        preenchimento = '=' * (-len(cursor) % 4)
+        valores = json.loads(base64.urlsafe_b64decode(cursor + preenchimento).decode('utf-8'))
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        return None
+    if not isinstance(valores, list) or len(valores) != quantidade:
+        return None
+    return [_desserializar_valor(v) for v in valores]
+
+
+def _campo_nulavel(modelo, campo: str) -> bool:
+    """Anotações usadas na ordenação são tratadas como não nulas"""
+    try:
+        return modelo._meta.get_field(campo).null
+    except FieldDoesNotExist:
+        return False
+
+
+def _filtro_apos(modelo, ordenacao: List[str], valores: List[Any], nulos_por_ultimo: bool = True) -> Q:
+    """
+    Linhas depois de `valores` na ordenação (direções mistas):
+    k1 >= v1 E ((k1 > v1) OU (k1 = v1 E k2 > v2) OU ...)
+    Nulos vêm por último, ou primeiro na ordenação invertida da página anterior.
+    """
+    filtro = _limite_primeira_chave(modelo, ordenacao[0], valores[0])
+    filtro &= _disjuncao_apos(modelo, ordenacao, valores, nulos_por_ultimo)
+    return filtro
+
+
+def _limite_primeira_chave(modelo, chave: str, valor: Any) -> Q:
+    """
+    k1 >= v1 (ou <=), redundante com a disjunção: dá ao SQLite um intervalo no
+    índice, que ele percorre já na ordem. Só com OR ele usa MULTI-INDEX OR e
+    ordena o resultado num TEMP B-TREE.
+    """
+    campo = chave.lstrip('-')
+    if valor is None or _campo_nulavel(modelo, campo):
+        return Q()
+    operador = 'lte' if chave.startswith('-') else 'gte'
+    return Q(**{f'{campo}__{operador}': valor})
+
+
+def _disjuncao_apos(modelo, ordenacao: List[str], valores: List[Any], nulos_por_ultimo: bool) -> Q:
+    filtro = Q(pk__in=[])  # falso
+    prefixo = Q()
+    for chave, valor in zip(ordenacao, valores):
+        campo = chave.lstrip('-')
+        operador = 'lt' if chave.startswith('-') else 'gt'
+        if valor is not None:
+            depois = Q(**{f'{campo}__{operador}': valor})
+            if nulos_por_ultimo and _campo_nulavel(modelo, campo):
+                # Nulos vêm depois de qualquer valor
+                depois |= Q(**{f'{campo}__isnull': True})
+            filtro |= prefixo & depois
+            prefixo &= Q(**{campo: valor})
+        else:
+            if not nulos_por_ultimo:
+                # Depois de um nulo vem qualquer valor
+                filtro |= prefixo & Q(**{f'{campo}__isnull': False})
+            prefixo &= Q(**{f'{campo}__isnull': True})
+    return filtro
+
+
+def _inverter(chave: str) -> str:
+    return chave[1:] if chave.startswith('-') else f'-{chave}'
+
+
+def _ordem(modelo, chave: str, nulos_por_ultimo: bool = True):
+    campo = chave.lstrip('-')
+    # NULLS FIRST/LAST só em campo nulável: em ASC, o NULLS LAST (fora do padrão
+    # do SQLite) impede o uso do índice e força um TEMP B-TREE na ordenação
+    nulos = {}
+    if _campo_nulavel(modelo, campo):
+        nulos = {'nulls_last': True} if nulos_por_ultimo else {'nulls_first': True}
+    if chave.startswith('-'):
+        return F(campo).desc(**nulos)
+    return F(campo).asc(**nulos)
+
+
+def consulta_keyset(queryset, ordenacao: List[str], valores: Optional[List[Any]] = None,
+                    nulos_por_ultimo: bool = True):
+    """`queryset` na ordem da paginação e, com `valores` (de um cursor), só as linhas depois deles"""
+    queryset = queryset.order_by(*[_ordem(queryset.model, chave, nulos_por_ultimo) for chave in ordenacao])
+    if valores is not None:
+        queryset = queryset.filter(_filtro_apos(queryset.model, ordenacao, valores, nulos_por_ultimo))
+    return queryset
+
+
+def _cursor_da_linha(linha, ordenacao: List[str]) -> str:
+    return codificar_cursor([getattr(linha, chave.lstrip('-')) for chave in ordenacao])
+
+
+def paginar_keyset(queryset, request, ordenacao: List[str],
+                   tamanho_padrao: int = TAMANHO_PAGINA_PADRAO) -> PaginaKeyset:
+    """
+    Pagina `queryset` pela `ordenacao` (campos ou anotações, '-' = decrescente).
+    A última chave deve ser única (ex.: 'id') para a ordem ser estável.
+    Lê ?cursor= (próxima), ?antes= (anterior) e ?tamanho= da requisição;
+    demais parâmetros (setor, busca) são mantidos nos links.
+    """
+    try:
+        tamanho = int(request.GET.get('tamanho', tamanho_padrao))
+    except (TypeError, ValueError):
+        tamanho = tamanho_padrao
+    tamanho = max(1, min(tamanho, TAMANHO_PAGINA_MAXIMO))
+
+    valores_antes = None
+    if request.GET.get('antes'):
+        valores_antes = decodificar_cursor(request.GET['antes'], len(ordenacao))
+    valores_cursor = None
+    if valores_antes is None and request.GET.get('cursor'):
+        valores_cursor = decodificar_cursor(request.GET['cursor'], len(ordenacao))
+
+    if valores_antes is not None:
+        # Página anterior: as linhas antes da primeira, lidas na ordem invertida
+        invertida = [_inverter(chave) for chave in ordenacao]
+        queryset = consulta_keyset(queryset, invertida, valores_antes, nulos_por_ultimo=False)
+        itens = list(queryset[:tamanho + 1])
+        eh_primeira = len(itens) <= tamanho
+        itens = itens[:tamanho][::-1]
+        tem_proxima = True
+    else:
+        queryset = consulta_keyset(queryset, ordenacao, valores_cursor)
+        # Uma linha a mais só para saber se existe próxima página
+        itens = list(queryset[:tamanho + 1])
+        tem_proxima = len(itens) > tamanho
+        itens = itens[:tamanho]
+        eh_primeira = valores_cursor is None
+
+    proximo_cursor = _cursor_da_linha(itens[-1], ordenacao) if tem_proxima and itens else None
+    cursor_anterior = _cursor_da_linha(itens[0], ordenacao) if not eh_primeira and itens else None
+
+    parametros = request.GET.copy()
+    parametros.pop('cursor', None)
+    parametros.pop('antes', None)
+    query_primeira = parametros.urlencode()
+    query_proxima = query_anterior = ''
+    if proximo_cursor:
+        query_proxima = _query_com(parametros, 'cursor', proximo_cursor)
+    if cursor_anterior:
+        query_anterior = _query_com(parametros, 'antes', cursor_anterior)
+
+    return PaginaKeyset(itens, tamanho, proximo_cursor, query_proxima, query_primeira,
+                        eh_primeira=eh_primeira, cursor_anterior=cursor_anterior,
+                        query_anterior=query_anterior)
+
+
+def _query_com(parametros, chave: str, cursor: str) -> str:
+    parametros = parametros.copy()
+    parametros[chave] = cursor
+    return parametros.urlencode()
@@ -0,0 +1,193 @@
+"""
+Motor de regras de glosa (RF017/RF020): ItemConta x ProcedimentoPadrao
+
+Os padrões por patologia e os valores de referência dos procedimentos são
+carregados uma única vez em dicionários; as contas são avaliadas em lotes de
+internações, com duas consultas por lote (internações e itens), sem acessar
+o banco item a item.
+
+Regras:
+    QUANTIDADE_EXCEDIDA   soma das quantidades do procedimento na conta acima
+                          de quantidade_maxima (o excesso cai nos itens mais novos)
+    FORA_DO_PADRAO        procedimento que não está no padrão da patologia
+    OBRIGATORIO_AUSENTE   procedimento obrigatório da patologia sem item na conta
+    PRECO_DIVERGENTE      valor_unitario fora da tolerância de Procedimento.valor_padrao
+"""
+import logging
+from collections import defaultdict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from core.models import Procedimento, ProcedimentoPadrao
+from .models import Internacao, ItemConta
+
+logger = logging.getLogger(__name__)
+
+QUANTIDADE_EXCEDIDA = 'QUANTIDADE_EXCEDIDA'
+FORA_DO_PADRAO = 'FORA_DO_PADRAO'
+OBRIGATORIO_AUSENTE = 'OBRIGATORIO_AUSENTE'
+PRECO_DIVERGENTE = 'PRECO_DIVERGENTE'
+REGRAS = (QUANTIDADE_EXCEDIDA, FORA_DO_PADRAO, OBRIGATORIO_AUSENTE, PRECO_DIVERGENTE)
+
+ZERO = Decimal('0.00')
+
+
+def _inconsistencia(regra: str, internacao_id: int, procedimento_id: int, mensagem: str,
+                    item_id: Optional[int] = None, valor_glosa: Decimal = ZERO) -> Dict[str, Any]:
+    return {
+        'regra': regra,
+        'internacao_id': internacao_id,
+        'item_id': item_id,
+        'procedimento_id': procedimento_id,
+        'mensagem': mensagem,
+        'valor_glosa_sugerido': valor_glosa.quantize(ZERO),
+    }
+
+
+class MotorRegrasGlosa:
+    """Avalia os itens pendentes das contas contra a base de procedimentos padrão"""
+
+    def __init__(self, tolerancia_preco: Decimal = Decimal('0.10'), tamanho_lote: int = 1000):
+        self.tolerancia_preco = Decimal(tolerancia_preco)
+        self.tamanho_lote = tamanho_lote
+        # patologia_id -> {procedimento_id: quantidade_maxima}
+        self.padroes: Dict[int, Dict[int, int]] = {}
+        # patologia_id -> procedimentos obrigatórios
+        self.obrigatorios: Dict[int, Set[int]] = {}
+        # procedimento_id -> (código, valor_padrao)
+        self.procedimentos: Dict[int, Tuple[str, Decimal]] = {}
+        self.carregado = False
+
+    def carregar(self):
+        """Índice em memória dos padrões (uma consulta por tabela)"""
+        padroes = defaultdict(dict)
+        obrigatorios = defaultdict(set)
+        for patologia_id, procedimento_id, quantidade_maxima, obrigatorio in ProcedimentoPadrao.objects.values_list(
+                'patologia_id', 'procedimento_id', 'quantidade_maxima', 'obrigatorio'):
+            padroes[patologia_id][procedimento_id] = quantidade_maxima
+            if obrigatorio:
+                obrigatorios[patologia_id].add(procedimento_id)
+
+        self.padroes = dict(padroes)
+        self.obrigatorios = dict(obrigatorios)
+        self.procedimentos = {
+            procedimento_id: (codigo, valor_padrao)
+            for procedimento_id, codigo, valor_padrao in Procedimento.objects.values_list('id', 'codigo', 'valor_padrao')
+        }
+        self.carregado = True
+        logger.info(f"Motor de glosa: {len(self.padroes)} patologias, {len(self.procedimentos)} procedimentos")
+
+    def _codigo(self, procedimento_id: int) -> str:
+        return self.procedimentos.get(procedimento_id, (str(procedimento_id), None))[0]
+
+    def _lotes(self, internacoes) -> Iterator[List[Tuple[int, int]]]:
+        lote = []
+        for par in internacoes.values_list('id', 'patologia_id').order_by('id').iterator(chunk_size=self.tamanho_lote):
+            lote.append(par)
+            if len(lote) >= self.tamanho_lote:
+                yield lote
+                lote = []
+        if lote:
+            yield lote
+
+    def avaliar(self, internacoes=None) -> Iterator[Dict[str, Any]]:
+        """
+        Inconsistências das contas de `internacoes` (queryset; padrão: todas com
+        alta). Itens glosados não contam; só itens pendentes são apontados.
+        """
+        if not self.carregado:
+            self.carregar()
+        if internacoes is None:
+            internacoes = Internacao.objects.filter(status='ALTA')
+
+        for lote in self._lotes(internacoes):
+            patologia_por_internacao = dict(lote)
+            itens_por_internacao = defaultdict(list)
+            itens = ItemConta.objects.filter(
+                internacao_id__in=patologia_por_internacao
+            ).exclude(status='GLOSADO').values_list(
+                'id', 'internacao_id', 'procedimento_id', 'quantidade', 'valor_unitario', 'status'
+            ).order_by('internacao_id', 'id')
+            for item in itens:
+                itens_por_internacao[item[1]].append(item)
+
+            for internacao_id, patologia_id in lote:
+                yield from self.avaliar_conta(internacao_id, patologia_id, itens_por_internacao.get(internacao_id, []))
+
+    def avaliar_conta(self, internacao_id: int, patologia_id: int,
+                      itens: Iterable[Tuple]) -> Iterator[Dict[str, Any]]:
+        """Regras sobre os itens (id, internacao_id, procedimento_id, quantidade, valor_unitario, status) de uma conta"""
+        padrao = self.padroes.get(patologia_id)
+        por_procedimento = defaultdict(list)
+        for item in itens:
+            por_procedimento[item[2]].append(item)
+
+        for procedimento_id, itens_procedimento in por_procedimento.items():
+            codigo = self._codigo(procedimento_id)
+            pendentes = [item for item in itens_procedimento if item[5] == 'PENDENTE']
+
+            # Patologia sem padrão cadastrado: não há base para as regras de padrão
+            if padrao is not None:
+                if procedimento_id not in padrao:
+                    for item_id, _, _, quantidade, valor_unitario, _ in pendentes:
+                        yield _inconsistencia(
+                            FORA_DO_PADRAO, internacao_id, procedimento_id,
+                            f"{codigo} não faz parte do padrão da patologia",
+                            item_id, quantidade * valor_unitario
+                        )
+                else:
+                    yield from self._quantidade_excedida(
+                        internacao_id, procedimento_id, codigo, padrao[procedimento_id], itens_procedimento
+                    )
+
+            yield from self._preco_divergente(internacao_id, procedimento_id, codigo, pendentes)
+
+        for procedimento_id in sorted(self.obrigatorios.get(patologia_id, set()) - set(por_procedimento)):
+            yield _inconsistencia(
+                OBRIGATORIO_AUSENTE, internacao_id, procedimento_id,
+                f"Procedimento obrigatório {self._codigo(procedimento_id)} não lançado na conta"
+            )
+
+    def _quantidade_excedida(self, internacao_id, procedimento_id, codigo, quantidade_maxima, itens):
+        excesso = sum(item[3] for item in itens) - quantidade_maxima
+        if excesso <= 0:
+            return
+        # O excesso é atribuído aos itens pendentes mais recentes
+        for item_id, _, _, quantidade, valor_unitario, status in reversed(itens):
+            if excesso <= 0:
+                break
+            if status != 'PENDENTE':
+                continue
+            glosado = min(quantidade, excesso)
+            excesso -= glosado
+            yield _inconsistencia(
+                QUANTIDADE_EXCEDIDA, internacao_id, procedimento_id,
+                f"{codigo}: {glosado} unidade(s) acima do máximo de {quantidade_maxima}",
+                item_id, glosado * valor_unitario
+            )
+
+    def _preco_divergente(self, internacao_id, procedimento_id, codigo, pendentes):
+        valor_padrao = self.procedimentos.get(procedimento_id, (None, None))[1]
+        if not valor_padrao:
+            return
+        limite = valor_padrao * self.tolerancia_preco
+        for item_id, _, _, quantidade, valor_unitario, _ in pendentes:
+            diferenca = valor_unitario - valor_padrao
+            if abs(diferenca) > limite:
+                yield _inconsistencia(
+                    PRECO_DIVERGENTE, internacao_id, procedimento_id,
+                    f"{codigo}: valor unitário R$ {valor_unitario} difere do padrão R$ {valor_padrao}",
+                    item_id, max(diferenca, ZERO) * quantidade
+                )
+
+
+def resumir(inconsistencias: Iterable[Dict[str, Any]]) -> Dict[str, Any]:
+    """Quantidade e valor sugerido de glosa por regra"""
+    resumo = {regra: {'quantidade': 0, 'valor_glosa_sugerido': ZERO} for regra in REGRAS}
+    contas = set()
+    for inconsistencia in inconsistencias:
+        regra = resumo[inconsistencia['regra']]
+        regra['quantidade'] += 1
+        regra['valor_glosa_sugerido'] += inconsistencia['valor_glosa_sugerido']
+        contas.add(inconsistencia['internacao_id'])
+    return {'por_regra': resumo, 'contas_com_inconsistencia': len(contas)}
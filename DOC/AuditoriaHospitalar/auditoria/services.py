@@ -0,0 +1,120 @@
+"""
+Serviços de consulta e de decisão reutilizados pelas views HTML e pelos endpoints JSON
+"""
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .cache_consultas import cache_consultas
+from .models import Auditoria, Internacao, ItemConta
+
+# Ação do formulário -> status do item
+ACOES_ITEM = {'aprovar': 'APROVADO', 'glosar': 'GLOSADO'}
+TAMANHO_LOTE_UPDATE = 500
+
+ZERO = Decimal('0.00')
+
+
+def _soma(status: Optional[str] = None) -> Sum:
+    filtro = Q(status=status) if status else None
+    return Sum('valor_total', filter=filtro, default=ZERO)
+
+
+def totais_conta(internacao_id: int) -> Dict[str, Any]:
+    """
+    Totais da conta numa única consulta (agregação condicional):
+    total, glosado, aprovado, pendente e líquido (total - glosado)
+    """
+    totais = ItemConta.objects.filter(internacao_id=internacao_id).aggregate(
+        # Alias diferente do campo: aggregate() não aceita o mesmo nome
+        total=_soma(),
+        total_glosado=_soma('GLOSADO'),
+        total_aprovado=_soma('APROVADO'),
+        total_pendente=_soma('PENDENTE'),
+        quantidade_itens=Count('id'),
+        itens_pendentes=Count('id', filter=Q(status='PENDENTE')),
+    )
+    totais['valor_total'] = totais.pop('total')
+    totais['valor_liquido'] = totais['valor_total'] - totais['total_glosado']
+    # SQLite devolve a soma sem as casas decimais do campo
+    for chave in ('valor_total', 'total_glosado', 'total_aprovado', 'total_pendente', 'valor_liquido'):
+        totais[chave] = Decimal(totais[chave]).quantize(ZERO)
+    return totais
+
+
+def resumo_conta(internacao_id: int) -> Dict[str, Any]:
+    """Itens da conta (com procedimento) + totais de totais_conta()"""
+    itens: List[ItemConta] = list(
+        ItemConta.objects.filter(internacao_id=internacao_id).select_related('procedimento')
+    )
+    resumo = totais_conta(internacao_id)
+    resumo['itens'] = itens
+    return resumo
+
+
+def item_para_dict(item: ItemConta) -> Dict[str, Any]:
+    return {
+        'id': item.id,
+        'procedimento': item.procedimento.nome,
+        'codigo': item.procedimento.codigo,
+        'quantidade': item.quantidade,
+        'valor_unitario': item.valor_unitario,
+        'valor_total': item.valor_total,
+        'status': item.status,
+        'justificativa': item.justificativa,
+    }
+
+
+def validar_itens_em_lote(internacao: Internacao, item_ids: Iterable[int], acao: str,
+                          justificativa: str, auditor) -> Tuple[Optional[Auditoria], int]:
+    """
+    Aprova ou glosa vários itens da conta numa transação: trava as linhas
+    (select_for_update), grava com bulk_update e registra a Auditoria com
+    itens_glosados e valor_glosado da decisão. Itens de outra conta ou que já
+    estão no status da ação são ignorados (uma glosa repetida não soma de novo
+    no valor_glosado). Retorna (auditoria, itens atualizados); (None, 0) se
+    nenhum item da conta mudou de status. Glosa exige justificativa.
+    """
+    if acao not in ACOES_ITEM:
+        raise ValueError(f"Ação inválida: {acao}")
+    status = ACOES_ITEM[acao]
+    justificativa = (justificativa or '').strip()
+    if status == 'GLOSADO' and not justificativa:
+        raise ValueError("Justificativa obrigatória para glosa")
+    ids = {int(item_id) for item_id in item_ids}
+    if not ids:
+        return None, 0
+
+    with transaction.atomic():
+        itens = list(
+            ItemConta.objects.select_for_update()
+            .filter(internacao=internacao, id__in=ids)
+            .exclude(status=status)
+            .only('id', 'status', 'justificativa', 'valor_total')
+        )
+        if not itens:
+            return None, 0
+
+        valor_glosado = ZERO
+        for item in itens:
+            item.status = status
+            item.justificativa = justificativa
+            if status == 'GLOSADO':
+                valor_glosado += item.valor_total
+        ItemConta.objects.bulk_update(itens, ['status', 'justificativa'], batch_size=TAMANHO_LOTE_UPDATE)
+
+        glosados = len(itens) if status == 'GLOSADO' else 0
+        auditoria = Auditoria.objects.create(
+            internacao=internacao,
+            tipo='RETROSPECTIVA' if internacao.status == 'ALTA' else 'CONCORRENTE',
+            auditor=auditor,
+            observacoes=(f"Validação em lote: {len(itens)} itens {status.lower()}s. {justificativa}").strip(),
+            itens_glosados=glosados,
+            valor_glosado=valor_glosado,
+        )
+        # bulk_update não dispara signals
+        cache_consultas.invalidar_apos_commit('contas')
+
+    return auditoria, len(itens)
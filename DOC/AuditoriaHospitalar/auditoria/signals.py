@@ -0,0 +1,81 @@
+"""
+Signals que mantêm em dia o índice de busca do histórico (busca.py), o
+censo diário do dashboard (censo.py) e o cache das views (cache_consultas.py)
+"""
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core.models import Paciente, Patologia, Procedimento
+from .busca import indexar_auditoria, indexar_paciente, remover_auditoria
+from .cache_consultas import cache_consultas
+from .censo import estado_censo, recalcular_censo, registrar_mudanca
+from .models import Auditoria, Internacao, ItemConta
+
+
+@receiver(post_save, sender=Auditoria)
+def indexar_auditoria_salva(sender, instance, using, **kwargs):
+    indexar_auditoria(instance.pk, using)
+
+
+@receiver(post_delete, sender=Auditoria)
+def remover_auditoria_excluida(sender, instance, using, **kwargs):
+    remover_auditoria(instance.pk, using)
+
+
+@receiver(post_save, sender=Paciente)
+def reindexar_auditorias_paciente(sender, instance, created, using, **kwargs):
+    # Paciente novo ainda não tem auditorias
+    if not created:
+        indexar_paciente(instance.pk, using)
+
+
+@receiver(pre_save, sender=Internacao)
+def guardar_estado_censo(sender, instance, raw, using, **kwargs):
+    # Estado antes do save (setor/patologia/alerta) para calcular o delta do censo
+    instance._estado_censo = estado_censo(instance.pk, using) if instance.pk and not raw else None
+
+
+@receiver(post_save, sender=Internacao)
+def atualizar_censo_internacao(sender, instance, raw, using, **kwargs):
+    if not raw:
+        registrar_mudanca(instance._estado_censo, estado_censo(instance.pk, using), using)
+
+
+@receiver(pre_delete, sender=Internacao)
+def guardar_estado_censo_exclusao(sender, instance, using, **kwargs):
+    instance._estado_censo = estado_censo(instance.pk, using)
+
+
+@receiver(post_delete, sender=Internacao)
+def atualizar_censo_exclusao(sender, instance, using, **kwargs):
+    registrar_mudanca(getattr(instance, '_estado_censo', None), None, using)
+
+
+@receiver(post_save, sender=Patologia)
+def recalcular_alertas_patologia(sender, instance, created, raw, using, **kwargs):
+    # Tempo ideal alterado muda os alertas de todas as internações da patologia
+    if not created and not raw:
+        recalcular_censo(using=using)
+
+
+@receiver([post_save, post_delete], sender=Internacao)
+def invalidar_cache_internacoes(sender, using, **kwargs):
+    cache_consultas.invalidar_apos_commit('internacoes', using=using)
+
+
+@receiver([post_save, post_delete], sender=ItemConta)
+def invalidar_cache_contas(sender, using, **kwargs):
+    cache_consultas.invalidar_apos_commit('contas', using=using)
+
+
+@receiver([post_save, post_delete], sender=Auditoria)
+def invalidar_cache_auditorias(sender, using, **kwargs):
+    cache_consultas.invalidar_apos_commit('auditorias', using=using)
+
+
+@receiver([post_save, post_delete], sender=Paciente)
+@receiver([post_save, post_delete], sender=Patologia)
+@receiver([post_save, post_delete], sender=Procedimento)
+def invalidar_cache_cadastros(sender, using, **kwargs):
+    # Nomes e tempos ideais aparecem em todas as telas
+    cache_consultas.invalidar_apos_commit(using=using)
@@ -1,11 +1,31 @@
+import re
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.db.models import Sum
 from django.test import TestCase, Client
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.utils import timezone
 from django.contrib.auth.models import User
-from datetime import timedelta, date
+from datetime import datetime, time as dt_time, timedelta, date
+from decimal import Decimal
 
-from core.models import Paciente, Patologia, Procedimento
-from .models import Internacao, ItemConta, Auditoria
+from core.models import Paciente, Patologia, Procedimento, ProcedimentoPadrao
+from .censo import recalcular_censo
+from .models import CensoDiario, Internacao, ItemConta, Auditoria
+from .busca import buscar_auditorias
+from .cache_consultas import cache_consultas
+from .paginacao import TAMANHO_PAGINA_MAXIMO, TAMANHO_PAGINA_PADRAO, consulta_keyset, decodificar_cursor
+from .regras_glosa import (
+    FORA_DO_PADRAO, OBRIGATORIO_AUSENTE, PRECO_DIVERGENTE, QUANTIDADE_EXCEDIDA, MotorRegrasGlosa, resumir
+)
+from .services import validar_itens_em_lote
+from .views import ORDENACAO_ANALISE_CONTAS, ORDENACAO_HISTORICO, ORDENACAO_MONITORAMENTO
 
 
 class AuditoriaModelTests(TestCase):
@@ -84,6 +104,45 @@ class AuditoriaModelTests(TestCase):
         
         self.assertEqual(item.valor_total, 300.00)
 
+    def test_permanencia_calculada_no_banco_igual_ao_python(self):
+        """
+        Verifica se as anotações de InternacaoQuerySet (SQL) batem com
+        tempo_permanencia(), dias_excesso() e excedeu_tempo_ideal()
+        """
+        agora = timezone.now()
+        Internacao.objects.create(paciente=self.paciente, patologia=self.patologia_rapida,
+                                  data_entrada=agora - timedelta(days=5, hours=20), setor='ENFERMARIA')
+        Internacao.objects.create(paciente=self.paciente, patologia=self.patologia_longa,
+                                  data_entrada=agora - timedelta(days=2), setor='UTI')
+        Internacao.objects.create(paciente=self.paciente, patologia=self.patologia_rapida,
+                                  data_entrada=agora - timedelta(days=20),
+                                  data_saida=agora - timedelta(days=12, hours=1),
+                                  status='ALTA', setor='ENFERMARIA')
+
+        anotadas = Internacao.objects.com_permanencia().select_related('patologia')
+        self.assertEqual(anotadas.count(), 3)
+        for internacao in anotadas:
+            self.assertEqual(internacao.dias_permanencia, internacao.tempo_permanencia())
+            self.assertEqual(internacao.excesso_dias, internacao.dias_excesso())
+            self.assertEqual(internacao.tem_alerta, internacao.excedeu_tempo_ideal())
+
+        self.assertEqual(Internacao.objects.com_alerta().count(), 2)
+        self.assertEqual(Internacao.objects.ativas().com_alerta().count(), 1)
+
+    def test_permanencia_no_banco_arredonda_para_baixo(self):
+        """DiasEntre segue timedelta.days (floor) também em diferenças negativas"""
+        entrada = timezone.now() - timedelta(days=30)
+        for delta in (timedelta(hours=-36), timedelta(hours=-6), timedelta(days=-2), timedelta(hours=6),
+                      timedelta(days=2, hours=1)):
+            Internacao.objects.create(paciente=self.paciente, patologia=self.patologia_rapida,
+                                      data_entrada=entrada, data_saida=entrada + delta,
+                                      status='ALTA', setor='ENFERMARIA')
+
+        anotadas = Internacao.objects.com_permanencia().order_by('id')
+        self.assertEqual([internacao.dias_permanencia for internacao in anotadas], [-2, -1, -2, 0, 2])
+        for internacao in anotadas:
+            self.assertEqual(internacao.dias_permanencia, internacao.tempo_permanencia())
+
 
 class AuditoriaViewTests(TestCase):
 
@@ -156,6 +215,8 @@ class AuditoriaViewTests(TestCase):
         )
 
     def setUp(self):
+        # O cache sobrevive ao rollback entre testes
+        cache.clear()
         self.client = Client()
         self.client.login(username='auditor', password='123')
 
@@ -202,6 +263,23 @@ class AuditoriaViewTests(TestCase):
         self.assertEqual(len(response.context['prontas_alta']), 1)
         self.assertEqual(response.context['prontas_alta'][0].paciente.nome, "Maria Oliveira")
 
+    def test_controle_altas_ordena_por_excesso_no_banco(self):
+        """Testa se 'controle_altas' filtra e ordena pelo excesso sem laço em Python (views.py)"""
+        Internacao.objects.create(
+            paciente=self.paciente_enf,
+            patologia=self.patologia_enf,
+            data_entrada=timezone.now() - timedelta(days=30),
+            status='ATIVA',
+            setor='ENFERMARIA'
+        )
+        # sessão + usuário + 1 consulta para a lista de internações
+        with self.assertNumQueries(3):
+            response = self.client.get(reverse('auditoria:controle_altas'))
+            prontas_alta = list(response.context['prontas_alta'])
+
+        self.assertEqual([i.excesso_dias for i in prontas_alta], [25, 3])
+        self.assertContains(response, '+25 dias')
+
     def test_efetivar_alta_view_POST_RF009(self):
         """Testa a ação POST de 'efetivar_alta' (views.py)"""
         url = reverse('auditoria:efetivar_alta', args=[self.internacao_enf.id])
@@ -234,6 +312,37 @@ class AuditoriaViewTests(TestCase):
         self.assertEqual(response.context['total_glosado'], 0)
         self.assertEqual(len(response.context['itens']), 2)
 
+    def test_detalhe_conta_totais_em_uma_consulta(self):
+        self.item_pendente.status = 'GLOSADO'
+        self.item_pendente.save()
+        url = reverse('auditoria:detalhe_conta', args=[self.internacao_alta.id])
+        # sessão + usuário + internação + itens + totais
+        with self.assertNumQueries(5):
+            response = self.client.get(url)
+
+        self.assertEqual(response.context['valor_total'], 350)
+        self.assertEqual(response.context['total_glosado'], 250)
+        self.assertEqual(response.context['total_aprovado'], 100)
+        self.assertEqual(response.context['total_pendente'], 0)
+        self.assertEqual(response.context['valor_liquido'], 100)
+        self.assertContains(response, 'R$ 100,00')
+
+    def test_resumo_conta_json(self):
+        url = reverse('auditoria:resumo_conta', args=[self.internacao_alta.id])
+        dados = self.client.get(url).json()
+
+        self.assertEqual(dados['internacao'], self.internacao_alta.id)
+        self.assertEqual(dados['valor_total'], '350.00')
+        self.assertEqual(dados['total_pendente'], '250.00')
+        self.assertEqual(dados['valor_liquido'], '350.00')
+        self.assertEqual(dados['quantidade_itens'], 2)
+        self.assertEqual(dados['itens_pendentes'], 1)
+        self.assertEqual({i['status'] for i in dados['itens']}, {'PENDENTE', 'APROVADO'})
+
+        vazia = self.client.get(reverse('auditoria:resumo_conta', args=[self.internacao_uti.id])).json()
+        self.assertEqual(vazia['valor_total'], '0.00')
+        self.assertEqual(vazia['itens'], [])
+
     def test_validar_item_POST_glosar_RF027_RF028(self):
         """Testa a ação POST de 'validar_item' para GLOSAR (views.py)"""
         url = reverse('auditoria:validar_item', args=[self.item_pendente.id])
@@ -291,4 +400,718 @@ class AuditoriaViewTests(TestCase):
 
         url = reverse('auditoria:historico') + '?busca=Inexistente'
         response = self.client.get(url)
-        self.assertEqual(len(response.context['auditorias']), 0)
\ No newline at end of file
+        self.assertEqual(len(response.context['auditorias']), 0)
+
+
+
+class PaginacaoKeysetTests(TestCase):
+    """Paginação por cursor das listas (paginacao.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        cls.patologia = Patologia.objects.create(nome="Fratura", codigo_cid="S72.0", tempo_internacao_ideal=5)
+        cls.paciente = Paciente.objects.create(nome="Carlos Pereira", cpf="333.333.333-33",
+                                               data_nascimento=date(1970, 11, 30))
+        cls.outro = Paciente.objects.create(nome="Maria Oliveira", cpf="222.222.222-22",
+                                            data_nascimento=date(1985, 5, 15))
+        agora = timezone.now()
+        cls.finalizadas = []
+        for i in range(7):
+            internacao = Internacao.objects.create(
+                paciente=cls.paciente if i % 2 else cls.outro, patologia=cls.patologia,
+                data_entrada=agora - timedelta(days=20),
+                # Duas com a mesma data de saída (desempate por id) e uma sem data
+                data_saida=None if i == 6 else agora - timedelta(days=min(i, 4)),
+                status='ALTA', setor='ENFERMARIA'
+            )
+            cls.finalizadas.append(internacao)
+            Auditoria.objects.create(internacao=internacao, tipo='RETROSPECTIVA', auditor=cls.user,
+                                     observacoes='Auditoria', data_auditoria=agora - timedelta(hours=i % 3))
+
+    def setUp(self):
+        # O cache sobrevive ao rollback entre testes
+        cache.clear()
+        self.client = Client()
+        self.client.login(username='auditor', password='123')
+
+    def _percorrer(self, url, chave_contexto):
+        """Segue os links de próxima página e devolve as páginas visitadas"""
+        paginas = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            paginas.append(list(response.context[chave_contexto]))
+            pagina = response.context['pagina']
+            url = f"{response.request['PATH_INFO']}?{pagina.query_proxima}" if pagina.tem_proxima else None
+        return paginas
+
+    def test_analise_contas_percorre_todas_sem_repetir(self):
+        paginas = self._percorrer(reverse('auditoria:analise_contas') + '?tamanho=2', 'internacoes')
+
+        self.assertEqual([len(p) for p in paginas], [2, 2, 2, 1])
+        ids = [i.id for pagina in paginas for i in pagina]
+        esperado = sorted(self.finalizadas[:6], key=lambda i: (i.data_saida, i.id), reverse=True)
+        # Mais recente primeiro, empate por id decrescente e data nula no fim
+        self.assertEqual(ids, [i.id for i in esperado] + [self.finalizadas[6].id])
+
+    def test_pagina_anterior_refaz_o_caminho(self):
+        url = reverse('auditoria:analise_contas') + '?tamanho=2'
+        paginas = self._percorrer(url, 'internacoes')
+
+        # Da última página, "anterior" volta pelas mesmas páginas (inclusive a com data nula)
+        response = self.client.get(url)
+        while response.context['pagina'].tem_proxima:
+            response = self.client.get(f"{url.split('?')[0]}?{response.context['pagina'].query_proxima}")
+        self.assertFalse(response.context['pagina'].eh_primeira)
+        voltando = [list(response.context['internacoes'])]
+        while response.context['pagina'].tem_anterior:
+            response = self.client.get(f"{url.split('?')[0]}?{response.context['pagina'].query_anterior}")
+            voltando.append(list(response.context['internacoes']))
+            self.assertTrue(response.context['pagina'].tem_proxima)
+
+        self.assertEqual(voltando[::-1], paginas)
+        self.assertTrue(response.context['pagina'].eh_primeira)
+        self.assertNotContains(response, 'Página anterior')
+
+    def test_controle_altas_pagina_por_chave_estavel(self):
+        ortopedia = Patologia.objects.create(nome="Artroplastia", codigo_cid="Z96.6", tempo_internacao_ideal=2)
+        agora = timezone.now()
+        for dias, patologia in [(9, self.patologia), (12, self.patologia), (6, ortopedia), (8, ortopedia)]:
+            Internacao.objects.create(paciente=self.paciente, patologia=patologia, status='ATIVA',
+                                      setor='UTI', data_entrada=agora - timedelta(days=dias, hours=1))
+
+        paginas = self._percorrer(reverse('auditoria:controle_altas') + '?tamanho=1', 'prontas_alta')
+
+        self.assertEqual([i.excesso_dias for pagina in paginas for i in pagina], [7, 6, 4, 4])
+        # O cursor guarda limite_alerta e id, não o excesso (que depende de Now())
+        response = self.client.get(reverse('auditoria:controle_altas') + '?tamanho=1')
+        valores = decodificar_cursor(response.context['pagina'].proximo_cursor, 2)
+        primeira = response.context['prontas_alta'][0]
+        self.assertEqual(valores, [primeira.limite_alerta, primeira.id])
+
+    def test_historico_mantem_busca_entre_paginas(self):
+        paginas = self._percorrer(reverse('auditoria:historico') + '?busca=Carlos&tamanho=1', 'auditorias')
+
+        nomes = {a.internacao.paciente.nome for pagina in paginas for a in pagina}
+        self.assertEqual(nomes, {'Carlos Pereira'})
+        self.assertEqual(sum(len(p) for p in paginas), 3)
+        datas = [(a.data_auditoria, a.id) for pagina in paginas for a in pagina]
+        self.assertEqual(datas, sorted(datas, reverse=True))
+
+    def test_cursor_invalido_e_tamanho_limitado(self):
+        response = self.client.get(reverse('auditoria:historico') + '?cursor=lixo&tamanho=99999')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context['pagina'].eh_primeira)
+        self.assertEqual(response.context['pagina'].tamanho, TAMANHO_PAGINA_MAXIMO)
+        self.assertEqual(len(response.context['auditorias']), 7)
+
+    def test_consultas_constantes_por_pagina(self):
+        url = reverse('auditoria:analise_contas') + '?tamanho=2'
+        response = self.client.get(url)
+        proxima = f"{url.split('?')[0]}?{response.context['pagina'].query_proxima}"
+        # sessão + usuário + 1 consulta da página, independente da posição
+        with self.assertNumQueries(3):
+            self.client.get(proxima)
+
+
+class ValidacaoLoteTests(TestCase):
+    """Aprovação/glosa de vários itens num POST (services.validar_itens_em_lote)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        patologia = Patologia.objects.create(nome="Pneumonia", codigo_cid="J18.0", tempo_internacao_ideal=7)
+        paciente = Paciente.objects.create(nome="Maria Oliveira", cpf="222.222.222-22",
+                                           data_nascimento=date(1985, 5, 15))
+        cls.procedimento = Procedimento.objects.create(nome="Antibiótico", codigo="P555", valor_padrao=50)
+        cls.internacao = Internacao.objects.create(
+            paciente=paciente, patologia=patologia, setor='UTI', status='ALTA',
+            data_entrada=timezone.now() - timedelta(days=10), data_saida=timezone.now()
+        )
+        cls.outra = Internacao.objects.create(paciente=paciente, patologia=patologia, setor='UTI')
+        cls.itens = ItemConta.objects.bulk_create([
+            ItemConta(internacao=cls.internacao, procedimento=cls.procedimento, quantidade=1 + i % 3,
+                      valor_unitario=50, valor_total=50 * (1 + i % 3))
+            for i in range(1000)
+        ])
+        cls.item_outra = ItemConta.objects.create(internacao=cls.outra, procedimento=cls.procedimento,
+                                                  quantidade=1, valor_unitario=50)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.login(username='auditor', password='123')
+        self.url = reverse('auditoria:validar_itens_lote', args=[self.internacao.id])
+
+    def test_glosa_em_lote_registra_auditoria(self):
+        ids = [item.id for item in self.itens[:900]]
+        esperado = sum(item.valor_total for item in self.itens[:900])
+        with CaptureQueriesContext(connection) as consultas:
+            response = self.client.post(self.url, {'acao': 'glosar', 'justificativa': 'Sem prescrição',
+                                                   'itens': ids + [self.item_outra.id]})
+        # Nenhuma consulta por item: um SELECT FOR UPDATE e poucos UPDATEs em lote
+        self.assertLess(len(consultas), 20)
+        self.assertRedirects(response, reverse('auditoria:detalhe_conta', args=[self.internacao.id]))
+
+        self.assertEqual(ItemConta.objects.filter(internacao=self.internacao, status='GLOSADO').count(), 900)
+        self.assertEqual(ItemConta.objects.filter(justificativa='Sem prescrição').count(), 900)
+        self.item_outra.refresh_from_db()
+        self.assertEqual(self.item_outra.status, 'PENDENTE')
+
+        auditoria = Auditoria.objects.get(internacao=self.internacao)
+        self.assertEqual(auditoria.tipo, 'RETROSPECTIVA')
+        self.assertEqual(auditoria.auditor, self.user)
+        self.assertEqual(auditoria.itens_glosados, 900)
+        self.assertEqual(auditoria.valor_glosado, esperado)
+
+        # Resumo da conta já reflete a decisão (cache invalidado)
+        detalhe = self.client.get(reverse('auditoria:detalhe_conta', args=[self.internacao.id]))
+        self.assertEqual(detalhe.context['total_glosado'], esperado)
+
+    def test_aprovacao_em_json(self):
+        response = self.client.post(self.url, {'acao': 'aprovar', 'itens': [self.itens[0].id, self.itens[1].id]},
+                                    HTTP_ACCEPT='application/json')
+        dados = response.json()
+        self.assertEqual(dados['itens_atualizados'], 2)
+        self.assertEqual(dados['itens_glosados'], 0)
+        self.assertEqual(dados['valor_glosado'], '0.00')
+
+    def test_falha_desfaz_tudo(self):
+        ids = [item.id for item in self.itens[:10]]
+        with patch('auditoria.services.Auditoria.objects.create', side_effect=IntegrityError):
+            with self.assertRaises(IntegrityError):
+                self.client.post(self.url, {'acao': 'glosar', 'justificativa': 'Duplicado', 'itens': ids})
+        self.assertFalse(ItemConta.objects.filter(status='GLOSADO').exists())
+
+    def test_glosa_sem_justificativa_rejeitada(self):
+        ids = [item.id for item in self.itens[:3]]
+        for justificativa in ('', '   '):
+            response = self.client.post(self.url, {'acao': 'glosar', 'justificativa': justificativa, 'itens': ids})
+            self.assertEqual(response.status_code, 400)
+        self.assertFalse(ItemConta.objects.filter(status='GLOSADO').exists())
+        self.assertFalse(Auditoria.objects.exists())
+        with self.assertRaises(ValueError):
+            validar_itens_em_lote(self.internacao, ids, 'glosar', '', self.user)
+
+    def test_itens_ja_no_status_nao_contam_de_novo(self):
+        ids = [item.id for item in self.itens[:4]]
+        self.client.post(self.url, {'acao': 'glosar', 'justificativa': 'Sem prescrição', 'itens': ids[:2]})
+
+        response = self.client.post(self.url, {'acao': 'glosar', 'justificativa': 'Sem prescrição', 'itens': ids},
+                                    HTTP_ACCEPT='application/json')
+        dados = response.json()
+        self.assertEqual((dados['itens_atualizados'], dados['itens_glosados']), (2, 2))
+        self.assertEqual(Decimal(dados['valor_glosado']), sum(item.valor_total for item in self.itens[2:4]))
+
+        # Nada mudou de status: nenhuma Auditoria nova
+        response = self.client.post(self.url, {'acao': 'glosar', 'justificativa': 'Repetida', 'itens': ids},
+                                    HTTP_ACCEPT='application/json')
+        self.assertEqual(response.json()['itens_atualizados'], 0)
+        self.assertEqual(Auditoria.objects.count(), 2)
+        total = sum(auditoria.valor_glosado for auditoria in Auditoria.objects.all())
+        self.assertEqual(total, sum(item.valor_total for item in self.itens[:4]))
+
+    def test_requisicoes_invalidas(self):
+        self.assertEqual(self.client.get(self.url).status_code, 405)
+        self.assertEqual(self.client.post(self.url, {'acao': 'excluir', 'itens': [1]}).status_code, 400)
+        self.assertEqual(self.client.post(self.url, {'acao': 'glosar', 'itens': ['x']}).status_code, 400)
+        self.client.post(self.url, {'acao': 'glosar'})
+        self.assertFalse(Auditoria.objects.exists())
+
+
+class MotorRegrasGlosaTests(TestCase):
+    """Regras automáticas de glosa (regras_glosa.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patologia = Patologia.objects.create(nome="Pneumonia", codigo_cid="J18.0", tempo_internacao_ideal=7)
+        cls.sem_padrao = Patologia.objects.create(nome="Fratura", codigo_cid="S72.0", tempo_internacao_ideal=5)
+        cls.paciente = Paciente.objects.create(nome="Maria Oliveira", cpf="222.222.222-22",
+                                               data_nascimento=date(1985, 5, 15))
+        cls.antibiotico = Procedimento.objects.create(nome="Antibiótico", codigo="ATB", valor_padrao=50)
+        cls.raio_x = Procedimento.objects.create(nome="Raio-X", codigo="RX", valor_padrao=100)
+        cls.rm = Procedimento.objects.create(nome="Ressonância", codigo="RM", valor_padrao=1000)
+        ProcedimentoPadrao.objects.create(patologia=cls.patologia, procedimento=cls.antibiotico, quantidade_maxima=7)
+        ProcedimentoPadrao.objects.create(patologia=cls.patologia, procedimento=cls.raio_x,
+                                          quantidade_maxima=1, obrigatorio=True)
+
+    def _conta(self, itens, patologia=None):
+        internacao = Internacao.objects.create(
+            paciente=self.paciente, patologia=patologia or self.patologia, setor='ENFERMARIA', status='ALTA',
+            data_entrada=timezone.now() - timedelta(days=5), data_saida=timezone.now()
+        )
+        criados = [
+            ItemConta.objects.create(internacao=internacao, procedimento=procedimento, quantidade=quantidade,
+                                     valor_unitario=valor or procedimento.valor_padrao, status=status)
+            for procedimento, quantidade, valor, status in itens
+        ]
+        return internacao, criados
+
+    def _avaliar(self):
+        return {(i['regra'], i['item_id']): i['valor_glosa_sugerido'] for i in MotorRegrasGlosa().avaliar()}
+
+    def test_regras(self):
+        _, (aprovado, pendente, rm, caro) = self._conta([
+            (self.antibiotico, 5, None, 'APROVADO'),
+            (self.antibiotico, 4, None, 'PENDENTE'),   # 9 de no máximo 7
+            (self.rm, 1, None, 'PENDENTE'),            # fora do padrão
+            (self.raio_x, 1, Decimal('130.00'), 'PENDENTE'),  # 30% acima do padrão
+        ])
+        sem_raio_x, _ = self._conta([(self.antibiotico, 2, None, 'PENDENTE')])
+
+        inconsistencias = self._avaliar()
+        self.assertEqual(inconsistencias, {
+            (QUANTIDADE_EXCEDIDA, pendente.id): Decimal('100.00'),
+            (FORA_DO_PADRAO, rm.id): Decimal('1000.00'),
+            (PRECO_DIVERGENTE, caro.id): Decimal('30.00'),
+            (OBRIGATORIO_AUSENTE, None): Decimal('0.00'),
+        })
+
+    def test_ignora_glosados_e_patologia_sem_padrao(self):
+        self._conta([
+            (self.antibiotico, 9, None, 'GLOSADO'),
+            (self.antibiotico, 2, None, 'PENDENTE'),
+            (self.raio_x, 1, None, 'PENDENTE'),
+        ])
+        self._conta([(self.rm, 1, None, 'PENDENTE')], patologia=self.sem_padrao)
+        self.assertEqual(self._avaliar(), {})
+
+    def test_consultas_por_lote(self):
+        for _ in range(5):
+            self._conta([(self.rm, 1, None, 'PENDENTE'), (self.raio_x, 1, None, 'PENDENTE')])
+        motor = MotorRegrasGlosa(tamanho_lote=2)
+        # padrões + procedimentos, cursor das internações e itens por lote (3 lotes)
+        with self.assertNumQueries(2 + 1 + 3):
+            inconsistencias = list(motor.avaliar())
+        self.assertEqual(len(inconsistencias), 5)
+        self.assertEqual(resumir(inconsistencias)['por_regra'][FORA_DO_PADRAO]['quantidade'], 5)
+
+    def test_comando_so_relata(self):
+        _, (item,) = self._conta([(self.rm, 1, None, 'PENDENTE')])
+        saida = StringIO()
+        call_command('avaliar_glosas', stdout=saida)
+        self.assertIn('FORA_DO_PADRAO', saida.getvalue())
+        item.refresh_from_db()
+        self.assertEqual(item.status, 'PENDENTE')
+
+
+class CensoDiarioTests(TestCase):
+    """Censo diário materializado (censo.py + signals.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        cls.pneumonia = Patologia.objects.create(nome="Pneumonia", codigo_cid="J18.0", tempo_internacao_ideal=7)
+        cls.fratura = Patologia.objects.create(nome="Fratura", codigo_cid="S72.0", tempo_internacao_ideal=5)
+        cls.paciente = Paciente.objects.create(nome="Maria Oliveira", cpf="222.222.222-22",
+                                               data_nascimento=date(1985, 5, 15))
+
+    def setUp(self):
+        # O cache sobrevive ao rollback entre testes
+        cache.clear()
+        self.client = Client()
+        self.client.login(username='auditor', password='123')
+
+    def _internar(self, setor='UTI', patologia=None, dias=1):
+        return Internacao.objects.create(
+            paciente=self.paciente, patologia=patologia or self.pneumonia,
+            data_entrada=timezone.now() - timedelta(days=dias), status='ATIVA', setor=setor
+        )
+
+    def _censo(self):
+        return {
+            (c.setor, c.patologia_id): (c.ativas, c.alertas)
+            for c in CensoDiario.objects.filter(data=timezone.localdate(), ativas__gt=0)
+        }
+
+    def _recalculado(self):
+        esperado = self._censo()
+        recalcular_censo()
+        self.assertEqual(self._censo(), esperado)
+        return esperado
+
+    def test_signals_mantem_censo(self):
+        uti = self._internar('UTI', dias=10)
+        self._internar('UTI', dias=2)
+        enfermaria = self._internar('ENFERMARIA', self.fratura, dias=1)
+        self.assertEqual(self._recalculado(), {
+            ('UTI', self.pneumonia.id): (2, 1),
+            ('ENFERMARIA', self.fratura.id): (1, 0),
+        })
+
+        # Transferência de setor move a contagem (com o alerta)
+        uti.setor = 'APARTAMENTO'
+        uti.save()
+        self.assertEqual(self._recalculado(), {
+            ('UTI', self.pneumonia.id): (1, 0),
+            ('APARTAMENTO', self.pneumonia.id): (1, 1),
+            ('ENFERMARIA', self.fratura.id): (1, 0),
+        })
+
+        # Alta e exclusão saem do censo
+        self.client.post(reverse('auditoria:efetivar_alta', args=[uti.id]))
+        enfermaria.delete()
+        self.assertEqual(self._recalculado(), {('UTI', self.pneumonia.id): (1, 0)})
+
+    def test_comando_recalcula_alertas_com_a_passagem_do_tempo(self):
+        internacao = self._internar('UTI', dias=3)
+        # update() não dispara signals: simula os dias passando
+        Internacao.objects.filter(pk=internacao.pk).update(data_entrada=timezone.now() - timedelta(days=8))
+        self.assertEqual(self._censo(), {('UTI', self.pneumonia.id): (1, 0)})
+
+        call_command('recalcular_censo', stdout=StringIO())
+        self.assertEqual(self._censo(), {('UTI', self.pneumonia.id): (1, 1)})
+
+    def test_alta_de_alerta_ainda_nao_recalculado_nao_deriva(self):
+        internacao = self._internar('UTI', dias=3)
+        self._internar('UTI', dias=2)
+        # Excedeu o tempo ideal depois do último recálculo: o alerta não está no censo
+        Internacao.objects.filter(pk=internacao.pk).update(data_entrada=timezone.now() - timedelta(days=8))
+        self.assertEqual(self._censo(), {('UTI', self.pneumonia.id): (2, 0)})
+
+        # Sem recontagem, a alta subtrairia um alerta nunca somado (alertas = -1)
+        self.client.post(reverse('auditoria:efetivar_alta', args=[internacao.id]))
+        self.assertEqual(self._recalculado(), {('UTI', self.pneumonia.id): (1, 0)})
+        self.assertFalse(CensoDiario.objects.filter(alertas__lt=0).exists())
+
+    def test_virada_do_dia_recalcula_e_preserva_historico(self):
+        self._internar('UTI')
+        ontem = timezone.localdate() - timedelta(days=1)
+        CensoDiario.objects.update(data=ontem)
+
+        self._internar('UTI')
+        self.assertEqual(self._censo(), {('UTI', self.pneumonia.id): (2, 0)})
+        self.assertEqual(CensoDiario.objects.get(data=ontem).ativas, 1)
+
+    def test_dashboard_le_censo_com_consultas_constantes(self):
+        for i in range(6):
+            self._internar(['UTI', 'ENFERMARIA'][i % 2], [self.pneumonia, self.fratura][i % 3 == 0], dias=i * 2)
+        CensoDiario.objects.all().delete()
+        self.client.get(reverse('auditoria:dashboard'))  # recálculo preguiçoso
+        cache.clear()
+
+        # sessão + usuário + totais + por setor + 5 internações da tabela
+        with self.assertNumQueries(5):
+            response = self.client.get(reverse('auditoria:dashboard'))
+        self.assertEqual(response.context['total_internacoes'], 6)
+        self.assertEqual(response.context['total_alertas'],
+                         Internacao.objects.ativas().com_alerta().count())
+        self.assertEqual({s['setor']: s['total'] for s in response.context['por_setor']},
+                         {'UTI': 3, 'ENFERMARIA': 3})
+
+
+class CacheConsultasTests(TestCase):
+    """Cache das views com invalidação por geração (cache_consultas.py + signals.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        patologia = Patologia.objects.create(nome="Pneumonia", codigo_cid="J18.0", tempo_internacao_ideal=7)
+        paciente = Paciente.objects.create(nome="Maria Oliveira", cpf="222.222.222-22",
+                                           data_nascimento=date(1985, 5, 15))
+        procedimento = Procedimento.objects.create(nome="Antibiótico", codigo="P555", valor_padrao=50)
+        cls.uti = Internacao.objects.create(paciente=paciente, patologia=patologia, setor='UTI',
+                                            data_entrada=timezone.now() - timedelta(days=10))
+        cls.enfermaria = Internacao.objects.create(paciente=paciente, patologia=patologia, setor='ENFERMARIA',
+                                                   data_entrada=timezone.now() - timedelta(days=2))
+        cls.item = ItemConta.objects.create(internacao=cls.uti, procedimento=procedimento,
+                                            quantidade=2, valor_unitario=50)
+
+    def setUp(self):
+        cache.clear()
+        cache_consultas.zerar_contadores()
+        self.client = Client()
+        self.client.login(username='auditor', password='123')
+
+    def test_dashboard_em_cache(self):
+        self.client.get(reverse('auditoria:dashboard'))
+        # Só sessão e usuário: cards, setores e tabela vêm do cache
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('auditoria:dashboard'))
+        self.assertEqual(response.context['total_internacoes'], 2)
+
+        estatisticas = self.client.get(reverse('auditoria:estatisticas_cache')).json()
+        self.assertEqual(estatisticas['consultas']['dashboard'], {'hits': 1, 'misses': 1, 'taxa_acerto': 0.5})
+
+    def test_efetivar_alta_invalida_dashboard_e_monitoramento(self):
+        self.assertEqual(self.client.get(reverse('auditoria:dashboard')).context['total_internacoes'], 2)
+        self.assertEqual(len(self.client.get(reverse('auditoria:monitoramento')).context['internacoes']), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('auditoria:efetivar_alta', args=[self.uti.id]))
+
+        self.assertEqual(self.client.get(reverse('auditoria:dashboard')).context['total_internacoes'], 1)
+        self.assertEqual(len(self.client.get(reverse('auditoria:monitoramento')).context['internacoes']), 1)
+
+    def test_validar_item_invalida_resumo_da_conta(self):
+        url = reverse('auditoria:detalhe_conta', args=[self.uti.id])
+        self.assertEqual(self.client.get(url).context['total_glosado'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('auditoria:validar_item', args=[self.item.id]),
+                             {'acao': 'glosar', 'justificativa': 'Excesso'})
+
+        self.assertEqual(self.client.get(url).context['total_glosado'], 100)
+        self.assertEqual(self.client.get(reverse('auditoria:resumo_conta', args=[self.uti.id])).json()['total_glosado'],
+                         '100.00')
+
+    def test_invalidacao_so_depois_do_commit(self):
+        url = reverse('auditoria:detalhe_conta', args=[self.uti.id])
+        self.assertEqual(self.client.get(url).context['total_glosado'], 0)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.item.status = 'GLOSADO'
+            self.item.save()
+            # Antes do commit a geração não muda: quem reler agora não grava dado novo sob ela
+            self.assertEqual(cache_consultas.geracoes(['contas']), {'contas': 0})
+        self.assertTrue(callbacks)
+
+        for callback in callbacks:
+            callback()
+        self.assertEqual(cache_consultas.geracoes(['contas']), {'contas': 1})
+        self.assertEqual(self.client.get(url).context['total_glosado'], 100)
+
+    def test_chave_por_filtro(self):
+        url = reverse('auditoria:monitoramento')
+        self.assertEqual(len(self.client.get(url).context['internacoes']), 2)
+        self.assertEqual(len(self.client.get(url, {'setor': 'UTI'}).context['internacoes']), 1)
+        self.assertEqual(len(self.client.get(url, {'setor': 'UTI'}).context['internacoes']), 1)
+
+        self.assertEqual(cache_consultas.estatisticas()['consultas']['monitoramento'],
+                         {'hits': 1, 'misses': 2, 'taxa_acerto': 0.333})
+
+
+class BuscaHistoricoTests(TestCase):
+    """Busca textual do histórico (busca.py + signals.py)"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        patologia = Patologia.objects.create(nome="Fratura", codigo_cid="S72.0", tempo_internacao_ideal=5)
+        cls.jose = Paciente.objects.create(nome="José Conceição", cpf="444.444.444-44",
+                                           data_nascimento=date(1960, 1, 1))
+        cls.ana = Paciente.objects.create(nome="Ana Lima", cpf="555.555.555-55",
+                                          data_nascimento=date(1990, 1, 1))
+        cls.internacao_jose = Internacao.objects.create(
+            paciente=cls.jose, patologia=patologia, data_entrada=timezone.now() - timedelta(days=3),
+            status='ALTA', setor='ENFERMARIA'
+        )
+        cls.internacao_ana = Internacao.objects.create(
+            paciente=cls.ana, patologia=patologia, data_entrada=timezone.now() - timedelta(days=3),
+            status='ALTA', setor='ENFERMARIA'
+        )
+        cls.auditoria_jose = Auditoria.objects.create(
+            internacao=cls.internacao_jose, tipo='RETROSPECTIVA', auditor=cls.user,
+            observacoes='Diária aprovada conforme protocolo, sem pendências de material ou medicação.'
+        )
+        cls.auditoria_ana = Auditoria.objects.create(
+            internacao=cls.internacao_ana, tipo='RETROSPECTIVA', auditor=cls.user,
+            observacoes='Glosa de diária: diária de UTI sem justificativa.'
+        )
+
+    def setUp(self):
+        # O cache sobrevive ao rollback entre testes
+        cache.clear()
+        self.client = Client()
+        self.client.login(username='auditor', password='123')
+
+    def _buscar(self, termo):
+        response = self.client.get(reverse('auditoria:historico'), {'busca': termo})
+        self.assertEqual(response.status_code, 200)
+        return [a.id for a in response.context['auditorias']]
+
+    def test_ignora_acentos_e_caixa(self):
+        self.assertEqual(self._buscar('jose conceicao'), [self.auditoria_jose.id])
+        self.assertEqual(self._buscar('CONCEIÇÃO'), [self.auditoria_jose.id])
+        self.assertEqual(self._buscar('glosa'), [self.auditoria_ana.id])
+
+    def test_prefixo_de_palavra(self):
+        self.assertEqual(self._buscar('Jos'), [self.auditoria_jose.id])
+
+    def test_mais_relevante_primeiro(self):
+        # "diaria" aparece duas vezes nas observações de Ana e uma vez nas de José
+        self.assertEqual(self._buscar('diaria'), [self.auditoria_ana.id, self.auditoria_jose.id])
+
+    def test_indice_acompanha_alteracoes(self):
+        # O cache das views é invalidado no commit (TestCase não confirma sozinho)
+        self.auditoria_jose.observacoes = 'Material especial auditado'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.auditoria_jose.save()
+        self.assertEqual(self._buscar('especial'), [self.auditoria_jose.id])
+        self.assertEqual(self._buscar('diaria'), [self.auditoria_ana.id])
+
+        self.ana.nome = 'Ana Souza'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.ana.save()
+        self.assertEqual(self._buscar('souza'), [self.auditoria_ana.id])
+        self.assertEqual(self._buscar('lima'), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.auditoria_ana.delete()
+        self.assertEqual(self._buscar('souza'), [])
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 é específico do SQLite')
+    def test_usa_indice_fts(self):
+        from .busca import indice_fts_disponivel, reconstruir_indice
+
+        self.assertTrue(indice_fts_disponivel())
+        self.assertEqual(reconstruir_indice(), 2)
+        consulta = str(buscar_auditorias(Auditoria.objects.all(), 'glosa').query)
+        self.assertIn('MATCH', consulta)
+        self.assertNotIn('LIKE', consulta)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é específico do SQLite')
+class PlanoConsultaTests(TestCase):
+    """Garante que as consultas principais das views usam índice, e não varredura completa"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='auditor', password='123')
+        patologias = Patologia.objects.bulk_create([
+            Patologia(nome=f"Patologia {i}", codigo_cid=f"X{i:02d}", tempo_internacao_ideal=3 + i % 7)
+            for i in range(10)
+        ])
+        procedimento = Procedimento.objects.create(nome="Antibiótico", codigo="P555", valor_padrao=50.00)
+        pacientes = Paciente.objects.bulk_create([
+            Paciente(nome=f"Paciente {i}", cpf=f"{i:011d}", data_nascimento=date(1970, 1, 1))
+            for i in range(500)
+        ])
+
+        agora = timezone.now()
+        setores = ['UTI', 'ENFERMARIA', 'APARTAMENTO']
+        internacoes = []
+        for i in range(3000):
+            # Poucas ativas e muitas finalizadas, como no censo real
+            ativa = i % 10 == 0
+            internacoes.append(Internacao(
+                paciente=pacientes[i % 500],
+                patologia=patologias[i % 10],
+                data_entrada=agora - timedelta(days=30 + i % 20),
+                data_saida=None if ativa else agora - timedelta(days=i % 25),
+                status='ATIVA' if ativa else 'ALTA',
+                setor=setores[i % 3],
+            ))
+        internacoes = Internacao.objects.bulk_create(internacoes)
+        cls.internacao = internacoes[1]
+
+        ItemConta.objects.bulk_create([
+            ItemConta(internacao=internacoes[i % 3000], procedimento=procedimento, quantidade=1,
+                      valor_unitario=50, valor_total=50, status=['PENDENTE', 'APROVADO', 'GLOSADO'][i % 3])
+            for i in range(9000)
+        ])
+        Auditoria.objects.bulk_create([
+            Auditoria(internacao=internacoes[i], tipo='RETROSPECTIVA', auditor=cls.user,
+                      observacoes='Auditoria', data_auditoria=agora - timedelta(hours=i))
+            for i in range(1000)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsaIndice(self, queryset, indice):
+        """
+        Roda EXPLAIN QUERY PLAN e verifica se `indice` aparece no plano e se a
+        tabela principal da consulta não é lida por varredura completa
+        """
+        plano = queryset.explain()
+        tabela = queryset.model._meta.db_table
+        self.assertIn(indice, plano, f"Índice {indice} não usado:\n{plano}")
+        varredura_completa = re.search(rf'SCAN {tabela}(?! USING)\b', plano)
+        self.assertIsNone(varredura_completa, f"Varredura completa em {tabela}:\n{plano}")
+        return plano
+
+    def assertPaginasUsamIndice(self, queryset, ordenacao, indice):
+        """
+        Primeira página e a seguinte (com cursor), montadas por consulta_keyset
+        com a ordenação da view: índice usado e ordenação sem TEMP B-TREE
+        """
+        primeira = consulta_keyset(queryset, ordenacao)[:TAMANHO_PAGINA_PADRAO + 1]
+        ultima = list(primeira)[TAMANHO_PAGINA_PADRAO - 1]
+        valores = [getattr(ultima, chave.lstrip('-')) for chave in ordenacao]
+        seguinte = consulta_keyset(queryset, ordenacao, valores)[:TAMANHO_PAGINA_PADRAO + 1]
+        for pagina in (primeira, seguinte):
+            plano = self.assertUsaIndice(pagina, indice)
+            self.assertNotIn('TEMP B-TREE FOR ORDER BY', plano)
+
+    def test_monitoramento_ativas(self):
+        self.assertPaginasUsamIndice(
+            Internacao.objects.ativas().com_permanencia().select_related('paciente', 'patologia'),
+            ORDENACAO_MONITORAMENTO, 'internacao_status_entrada_idx'
+        )
+
+    def test_monitoramento_ativas_por_setor(self):
+        self.assertPaginasUsamIndice(
+            Internacao.objects.ativas().com_permanencia().select_related('paciente', 'patologia').filter(setor='UTI'),
+            ORDENACAO_MONITORAMENTO, 'internacao_status_setor_idx'
+        )
+
+    def test_analise_contas_ordenada_por_saida(self):
+        self.assertPaginasUsamIndice(
+            Internacao.objects.filter(status='ALTA').select_related('paciente', 'patologia'),
+            ORDENACAO_ANALISE_CONTAS, 'internacao_status_saida_idx'
+        )
+
+    def test_detalhe_conta_itens_por_status(self):
+        itens = ItemConta.objects.filter(internacao=self.internacao, status='APROVADO')
+        self.assertUsaIndice(itens, 'itemconta_intern_status_idx')
+        self.assertEqual(itens.aggregate(total=Sum('valor_total'))['total'], 150)
+
+    def test_historico_ordenado_por_data(self):
+        self.assertPaginasUsamIndice(
+            Auditoria.objects.select_related('internacao__paciente', 'auditor'),
+            ORDENACAO_HISTORICO, 'auditoria_data_idx'
+        )
+
+
+class PopularDadosEscalaTests(TestCase):
+    """popular_dados --escala: volume sintético determinístico"""
+
+    def gerar(self, semente=7, **opcoes):
+        call_command('popular_dados', escala=60, semente=semente, lote=25, stdout=StringIO(), **opcoes)
+        return list(Internacao.objects.order_by('id').values_list(
+            'patologia__codigo_cid', 'setor', 'status', 'paciente__cpf'
+        ))
+
+    def test_volume_e_consistencia(self):
+        self.gerar()
+        self.assertEqual(Internacao.objects.count(), 60)
+        self.assertEqual(Paciente.objects.count(), 40)
+        self.assertTrue(ItemConta.objects.exists())
+        self.assertFalse(Internacao.objects.filter(status='ATIVA', data_saida__isnull=False).exists())
+        self.assertFalse(Internacao.objects.filter(status='ALTA', data_saida__isnull=True).exists())
+        # bulk_create não chama save(): valor_total precisa vir preenchido
+        for item in ItemConta.objects.all()[:50]:
+            self.assertEqual(item.valor_total, item.quantidade * item.valor_unitario)
+        # Censo recalculado ao final
+        self.assertEqual(
+            CensoDiario.objects.aggregate(total=Sum('ativas'))['total'] or 0,
+            Internacao.objects.filter(status='ATIVA').count()
+        )
+
+    def test_mesma_semente_mesmos_dados(self):
+        primeira = self.gerar()
+        self.assertEqual(self.gerar(limpar=True), primeira)
+        self.assertNotEqual(self.gerar(limpar=True, semente=8), primeira)
+
+    def test_data_referencia_fixa_as_datas(self):
+        referencia = date(2026, 1, 15)
+        self.gerar(data_referencia=referencia)
+        datas = list(Internacao.objects.order_by('id').values_list('data_entrada', 'data_saida'))
+        meia_noite = timezone.make_aware(datetime.combine(referencia, dt_time.min))
+        self.assertTrue(all(entrada <= meia_noite for entrada, _ in datas))
+
+        # Outro dia, mesma semente e data de referência
+        with patch('django.utils.timezone.localdate', return_value=date(2030, 6, 1)):
+            self.gerar(limpar=True, data_referencia=referencia)
+        self.assertEqual(list(Internacao.objects.order_by('id').values_list('data_entrada', 'data_saida')), datas)
+
+    def test_alerta_das_ativas_pelo_tempo_decorrido(self):
+        referencia = date(2026, 1, 15)
+        self.gerar(data_referencia=referencia)
+        meia_noite = timezone.make_aware(datetime.combine(referencia, dt_time.min))
+        ativas = Internacao.objects.filter(status='ATIVA').select_related('patologia')
+        self.assertTrue(ativas.exists())
+        for internacao in ativas:
+            self.assertEqual(internacao.alerta_tempo,
+                             (meia_noite - internacao.data_entrada).days > internacao.patologia.tempo_internacao_ideal)
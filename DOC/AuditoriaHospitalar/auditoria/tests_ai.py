@@ -1,9 +1,27 @@
+import copy
+import os
+import re
+import tempfile
+import time
+import pandas as pd
 from django.test import TestCase
 from unittest.mock import MagicMock, patch, Mock
 from llm_service.src.knowledge_base import MedicalKnowledgeBase
 from llm_service.src.gemini_integration import GeminiIntegration
 from llm_service.src.rag import RAGSystem
 from llm_service.src.services import LLMService
+from llm_service.src.batch_processor import BatchProcessor, ConfiguracaoTriagem, COLUNAS_RESULTADO
+from llm_service.src.rate_limiter import RateLimiter
+from llm_service.src.cache_analises import CacheAnalises
+from llm_service.src.diario_execucao import DiarioExecucao
+from llm_service.src.recursos import RegistroRecursos, registro_recursos
+from llm_service.src.parser_respostas import ParserRespostaLLM, parser_respostas
+from llm_service.src.prompts import PromptTemplates
+from llm_service.src.gemini_simulado import (
+    ClienteGeminiHTTP, ConfiguracaoSimulacao, ModeloGeminiSimulado, ServidorGeminiSimulado
+)
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core import exceptions as google_exceptions
 
 class KnowledgeBaseTests(TestCase):
     
@@ -29,6 +47,25 @@ class KnowledgeBaseTests(TestCase):
         self.assertTrue(resultado['alert_triggered'])
         self.assertEqual(resultado['excess_days'], 2)
 
+    def test_score_colunar_igual_ao_escalar(self):
+        df = pd.DataFrame([
+            {'patologia': 'APENDICITE', 'tempo_permanencia': 5, 'idade': 30, 'comorbidades': "['NENHUMA']", 'setor': 'ENFERMARIA'},
+            {'patologia': 'SEPSE', 'tempo_permanencia': 2, 'idade': 85, 'comorbidades': "['DPOC', 'DIABETES', 'IRC']", 'setor': 'UTI'},
+            {'patologia': 'PNEUMONIA', 'tempo_permanencia': 7, 'idade': 70, 'comorbidades': ['HIPERTENSAO'], 'setor': 'ENFERMARIA'},
+            {'patologia': 'DESCONHECIDA', 'tempo_permanencia': 12, 'idade': 50, 'comorbidades': None, 'setor': 'UTI'},
+        ], index=[10, 11, 12, 13])
+        processor = BatchProcessor.__new__(BatchProcessor)
+
+        colunar = self.kb.assess_discharge_readiness_df(df)
+
+        self.assertEqual(list(colunar.index), [10, 11, 12, 13])
+        for idx, linha in df.iterrows():
+            escalar = self.kb.assess_discharge_readiness(processor.preparar_dados_internacao(linha))
+            self.assertEqual(colunar.loc[idx, 'readiness_score'], escalar['readiness_score'])
+            self.assertEqual(colunar.loc[idx, 'readiness_level'], escalar['readiness_level'])
+            self.assertEqual(colunar.loc[idx, 'excess_days'], escalar['payer_status']['excess_days'])
+            self.assertEqual(colunar.loc[idx, 'is_compliant'], escalar['payer_status']['is_compliant'])
+
 class GeminiIntegrationTests(TestCase):
     
     @patch('llm_service.src.gemini_integration.genai')
@@ -46,6 +83,10 @@ class GeminiIntegrationTests(TestCase):
 
         self.assertIn('prioridade', resultado)
         self.assertIn('razoes_alta', resultado)
+        self.assertEqual(resultado['prioridade'], 'ALTA')
+        self.assertEqual(resultado['razoes_alta'], ["Paciente estável", "Exames normais"])
+        self.assertEqual(resultado['fontes_informacao'], ["Protocolo XYZ"])
+        self.assertEqual(resultado['confianca'], 0.95)
 
     @patch('llm_service.src.gemini_integration.genai')
     def test_analise_paciente_tratamento_erro(self, mock_genai):
@@ -63,7 +104,139 @@ class GeminiIntegrationTests(TestCase):
         self.assertIn('prioridade', resultado)
         self.assertIn('razoes_alta', resultado)
 
+class GeminiModoJsonTests(TestCase):
+
+    def _gemini(self, mock_genai, texto):
+        mock_model = MagicMock()
+        mock_genai.GenerativeModel.return_value = mock_model
+        mock_model.generate_content.return_value.text = texto
+        return GeminiIntegration(api_key="fake_key", modo_json=True)
+
+    @patch('llm_service.src.gemini_integration.GenerationConfig')
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_configuracao_pede_json_no_esquema(self, mock_genai, mock_config):
+        gemini = self._gemini(mock_genai, "{}")
+
+        kwargs = mock_config.call_args.kwargs
+        self.assertEqual(kwargs['response_mime_type'], 'application/json')
+        self.assertEqual(kwargs['response_schema']['required'],
+                         ['prioridade', 'razoes_alta', 'pendencias', 'fontes_informacao', 'confianca', 'analise_inicial'])
+        self.assertNotIn('response_schema', GeminiIntegration(api_key="fake_key", modo_json=False).configuracao_geracao)
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_resposta_json_decodificada_direto(self, mock_genai):
+        gemini = self._gemini(mock_genai, '{"prioridade": "MANTER", "razoes_alta": [], "pendencias": ["Laudo"], '
+                                          '"fontes_informacao": ["KB"], "confianca": 0.4, "analise_inicial": "Ok"}')
+
+        resultado = gemini.analisar_paciente_estruturado("prompt")
+
+        self.assertEqual(resultado['prioridade'], 'MANTER')
+        self.assertEqual(resultado['pendencias'], ['Laudo'])
+        self.assertEqual(resultado['confianca'], 0.4)
+        self.assertEqual(gemini.estatisticas()['respostas_fora_do_json'], 0)
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_json_truncado_cai_no_parser_de_texto(self, mock_genai):
+        gemini = self._gemini(mock_genai, 'RECOMENDACAO: ALTA_PRIORIDADE_BAIXA\nCONFIANCA: 0.7\n{"prioridade": "AL')
+
+        resultado = gemini.analisar_paciente_estruturado("prompt")
+
+        self.assertEqual(resultado['prioridade'], 'BAIXA')
+        self.assertEqual(resultado['confianca'], 0.7)
+        self.assertEqual(gemini.estatisticas()['respostas_fora_do_json'], 1)
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_contador_fora_do_json_com_workers(self, mock_genai):
+        gemini = self._gemini(mock_genai, 'RECOMENDACAO: ALTA_PRIORIDADE_BAIXA\nCONFIANCA: 0.7')
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: gemini._parse_resposta_llm_corrigido('CONFIANCA: 0.7'), range(400)))
+
+        self.assertEqual(gemini.estatisticas()['respostas_fora_do_json'], 400)
+
+
+class ParserRespostaTests(TestCase):
+
+    def setUp(self):
+        self.parser = ParserRespostaLLM()
+
+    def test_resposta_indentada_com_chaves_acentuadas(self):
+        # Mesmo formato do _resposta_mock: cada linha indentada
+        resultado = self.parser.parse(GeminiIntegration._resposta_mock(None, ""))
+
+        self.assertEqual(resultado['analise_inicial'], "Paciente em avaliação para possível alta.")
+        self.assertEqual(resultado['razoes_alta'], ["Tempo de internação adequado, Condições clínicas estáveis"])
+        self.assertEqual(resultado['pendencias'], ["Avaliação médica final pendente"])
+        self.assertEqual(resultado['prioridade'], 'MEDIA')
+        self.assertEqual(resultado['fontes_informacao'], ["Prontuário eletrônico, Protocolos institucionais"])
+        self.assertEqual(resultado['confianca'], 0.78)
+
+    def test_markdown_com_marcadores(self):
+        resposta = (
+            "**Análise Inicial:** Caso dentro do prazo.\n"
+            "**Razões Alta:**\n* Permanência adequada\n* Fora da UTI\n"
+            "Observação: sem intercorrências\n"
+            "**Recomendação:** MANTER_INTERNACAO\n"
+            "**Confiança:** 0,6"
+        )
+        resultado = self.parser.parse(resposta)
+
+        self.assertEqual(resultado['analise_inicial'], "Caso dentro do prazo.")
+        # Cabeçalho desconhecido não encerra a seção
+        self.assertEqual(resultado['razoes_alta'],
+                         ["Permanência adequada", "Fora da UTI", "Observação: sem intercorrências"])
+        self.assertEqual(resultado['prioridade'], 'MANTER')
+        self.assertEqual(resultado['confianca'], 0.6)
+        self.assertEqual(resultado['pendencias'], [])
+
+    def test_json_em_bloco_de_codigo(self):
+        resposta = '```json\n{"RECOMENDACAO": "ALTA_PRIORIDADE_BAIXA", "pendencias": "Laudo", "fontes": ["KB"]}\n```'
+        resultado = self.parser.parse(resposta)
+
+        self.assertEqual(resultado['prioridade'], 'BAIXA')
+        self.assertEqual(resultado['pendencias'], ["Laudo"])
+        self.assertEqual(resultado['fontes_informacao'], ["KB"])
+        self.assertEqual(resultado['confianca'], 0.75)
+
+    def test_json_invalido_cai_no_parser_de_texto(self):
+        resultado = self.parser.parse("RECOMENDACAO: ALTA_PRIORIDADE_ALTA {sem json}")
+        self.assertEqual(resultado['prioridade'], 'ALTA')
+
+
+class ColecaoFalsa:
+    """Coleção do Chroma em memória (sem embeddings) para testar a sincronização"""
+
+    def __init__(self):
+        self.documentos = {}
+        self.upserts = []
+
+    def count(self):
+        return len(self.documentos)
+
+    def add(self, ids, documents, metadatas):
+        self.documentos.update({i: (d, m) for i, d, m in zip(ids, documents, metadatas)})
+
+    def upsert(self, ids, documents, metadatas):
+        self.upserts.append(list(ids))
+        self.add(ids, documents, metadatas)
+
+    def delete(self, ids):
+        for id_doc in ids:
+            self.documentos.pop(id_doc, None)
+
+    def get(self, include=None):
+        return {'ids': list(self.documentos), 'metadatas': [m for _, m in self.documentos.values()]}
+
+    def query(self, query_texts, **kwargs):
+        return {'documents': [[] for _ in query_texts], 'metadatas': [[] for _ in query_texts],
+                'distances': [[] for _ in query_texts]}
+
+
 class RAGSystemTests(TestCase):
+
+    def setUp(self):
+        registro_recursos.limpar()
+        self.addCleanup(registro_recursos.limpar)
     
     @patch('llm_service.src.rag.chromadb.PersistentClient')
     @patch('llm_service.src.rag.SentenceTransformer')
@@ -86,6 +259,124 @@ class RAGSystemTests(TestCase):
         self.assertIn('vector_store', contexto)
         self.assertIn('knowledge_base', contexto)
 
+    @patch('llm_service.src.rag.chromadb.PersistentClient')
+    @patch('llm_service.src.rag.SentenceTransformer')
+    def test_recursos_carregados_uma_vez_por_processo(self, mock_transformer, mock_chroma_client):
+        mock_chroma_client.return_value.get_or_create_collection.return_value.count.return_value = 1
+
+        primeiro = RAGSystem()
+        segundo = RAGSystem()
+
+        self.assertEqual(mock_chroma_client.call_count, 1)
+        self.assertIs(primeiro.collection, segundo.collection)
+        # O modelo de embeddings só é carregado quando usado
+        mock_transformer.assert_not_called()
+        self.assertIs(primeiro.model, segundo.model)
+        self.assertEqual(mock_transformer.call_count, 1)
+
+    @patch('llm_service.src.rag.chromadb.PersistentClient')
+    @patch('llm_service.src.rag.SentenceTransformer')
+    def test_tabela_contexto_evita_busca_vetorial(self, mock_transformer, mock_chroma_client):
+        mock_collection = mock_chroma_client.return_value.get_or_create_collection.return_value
+        mock_collection.count.return_value = 1
+        # Resposta em lote: uma lista de documentos por consulta
+        mock_collection.query.side_effect = lambda query_texts, **kwargs: {
+            'documents': [[f'doc {i}'] for i in range(len(query_texts))],
+            'metadatas': [[{'tipo': 'protocolo'}] for _ in query_texts],
+            'distances': [[0.2] for _ in query_texts],
+        }
+
+        rag = RAGSystem()
+        # Tabela montada com uma única consulta na inicialização
+        self.assertEqual(mock_collection.query.call_count, 1)
+        mock_collection.query.reset_mock()
+
+        contexto = rag.buscar_contexto_relevante({'patologia': 'asma grave', 'tempo_permanencia': 2})
+        self.assertEqual(len(contexto['vector_store']), 1)
+        self.assertTrue(contexto['knowledge_base']['protocolo_patologia'])
+        mock_collection.query.assert_not_called()
+
+        # Patologia inédita: uma busca vetorial e depois servida da tabela
+        rag.buscar_contexto_relevante({'patologia': 'DENGUE'})
+        rag.buscar_contexto_relevante({'patologia': 'Dengue'})
+        self.assertEqual(mock_collection.query.call_count, 1)
+        self.assertEqual(rag.estatisticas_busca, {'tabela': 2, 'vetorial': 1})
+
+    @patch('llm_service.src.rag.chromadb.PersistentClient')
+    @patch('llm_service.src.rag.SentenceTransformer')
+    def test_busca_contexto_lote_uma_consulta(self, mock_transformer, mock_chroma_client):
+        mock_collection = mock_chroma_client.return_value.get_or_create_collection.return_value
+        mock_collection.count.return_value = 1
+        mock_collection.query.side_effect = lambda query_texts, **kwargs: {
+            'documents': [[texto] for texto in query_texts],
+            'metadatas': [[{'tipo': 'protocolo'}] for _ in query_texts],
+            'distances': [[0.2] for _ in query_texts],
+        }
+
+        rag = RAGSystem()
+        mock_collection.query.reset_mock()
+
+        lote = [{'patologia': p} for p in ['DENGUE', 'SEPSE', 'dengue', 'COVID', 'COVID']]
+        contextos = rag.buscar_contexto_lote(lote)
+
+        # Só as patologias inéditas e distintas vão ao Chroma, em uma única consulta
+        mock_collection.query.assert_called_once()
+        self.assertEqual(len(mock_collection.query.call_args.kwargs['query_texts']), 2)
+        self.assertEqual(len(contextos), 5)
+        self.assertIn('DENGUE', contextos[2]['vector_store'][0]['conteudo'])
+        self.assertIn('COVID', contextos[4]['vector_store'][0]['conteudo'])
+        self.assertIs(contextos[0]['dados_internacao'], lote[0])
+
+    @patch('llm_service.src.rag.chromadb.PersistentClient')
+    @patch('llm_service.src.rag.SentenceTransformer')
+    def test_sincronizacao_incremental(self, mock_transformer, mock_chroma_client):
+        colecao = ColecaoFalsa()
+        mock_chroma_client.return_value.get_or_create_collection.return_value = colecao
+
+        rag = RAGSystem()
+        total = colecao.count()
+        self.assertTrue(all('hash_conteudo' in m for _, m in colecao.documentos.values()))
+
+        # Sem mudanças na knowledge base: nada é re-embeddado
+        relatorio = rag.sincronizar_conhecimento()
+        self.assertEqual((relatorio['novos'], relatorio['alterados'], relatorio['removidos']), (0, 0, 0))
+        self.assertEqual(relatorio['inalterados'], total)
+        self.assertEqual(colecao.upserts, [])
+
+        # Um protocolo alterado, uma regra removida e uma patologia nova
+        rag.knowledge_base.protocols = copy.deepcopy(rag.knowledge_base.protocols)
+        rag.knowledge_base.payer_rules = copy.deepcopy(rag.knowledge_base.payer_rules)
+        rag.knowledge_base.protocols['SEPSE']['avg_length_of_stay'] = 99
+        del rag.knowledge_base.payer_rules['max_length_of_stay']['APENDICITE']
+        rag.knowledge_base.payer_rules['max_length_of_stay']['DENGUE'] = 5
+
+        relatorio = rag.sincronizar_conhecimento()
+        self.assertEqual((relatorio['novos'], relatorio['alterados'], relatorio['removidos']), (1, 1, 1))
+        self.assertEqual(sorted(colecao.upserts[0]), ['protocolo_SEPSE', 'regra_DENGUE'])
+        self.assertNotIn('regra_APENDICITE', colecao.documentos)
+        self.assertEqual(colecao.count(), total)
+
+
+class RegistroRecursosTests(TestCase):
+
+    def test_fabrica_executada_uma_vez_com_threads(self):
+        registro = RegistroRecursos()
+        fabrica = MagicMock(side_effect=lambda: time.sleep(0.05) or object())
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            recursos = list(executor.map(lambda _: registro.obter('modelo', fabrica), range(16)))
+
+        self.assertEqual(fabrica.call_count, 1)
+        self.assertTrue(all(recurso is recursos[0] for recurso in recursos))
+        self.assertIn('modelo', registro.tempos_carga)
+
+    def test_remover_forca_nova_carga(self):
+        registro = RegistroRecursos()
+        fabrica = MagicMock(side_effect=lambda: object())
+        primeiro = registro.obter('cliente', fabrica)
+        registro.remover('cliente')
+        self.assertIsNot(registro.obter('cliente', fabrica), primeiro)
+
 class ServiceOrchestrationTests(TestCase):
     
     @patch('llm_service.src.services.GeminiIntegration')
@@ -117,4 +408,760 @@ class ServiceOrchestrationTests(TestCase):
         resultado = service.analisar_paciente_alta(dados_entrada)
 
         self.assertIsNotNone(resultado)
-        mock_rag_instance.buscar_contexto_relevante.assert_called_once()
\ No newline at end of file
+        mock_rag_instance.buscar_contexto_relevante.assert_called_once()
+
+class BatchProcessorConcorrenciaTests(TestCase):
+
+    def setUp(self):
+        # Limitador sem restrição para medir só a concorrência
+        patcher = patch('llm_service.src.gemini_integration.gemini_rate_limiter',
+                        RateLimiter(requisicoes_por_minuto=100000, max_concorrencia=16))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _resposta_lenta(self, latencia):
+        def gerar(prompt):
+            time.sleep(latencia)
+            resposta = MagicMock()
+            resposta.text = "RECOMENDACAO: ALTA_PRIORIDADE_ALTA\nCONFIANCA: 0.9"
+            return resposta
+        return gerar
+
+    def _dataset(self, total):
+        return pd.DataFrame([{
+            'internacao_id': f'I{i:05d}',
+            'paciente_id': f'P{i:04d}',
+            'paciente_nome': f'Paciente {i}',
+            'idade': 40,
+            'comorbidades': "['NENHUMA']",
+            'patologia': 'PNEUMONIA',
+            'tempo_ideal_patologia': 5,
+            'setor': 'ENFERMARIA',
+            'tempo_permanencia': 6,
+            'alerta_tempo': True,
+            'dias_excesso': 1,
+        } for i in range(total)])
+
+    @patch('llm_service.src.services.RAGSystem')
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_modo_concorrente_preserva_ordem_e_esquema(self, mock_genai, MockRAG):
+        MockRAG.return_value.buscar_contexto_relevante.return_value = {
+            'vector_store': [], 'knowledge_base': {}, 'dados_internacao': {}
+        }
+        mock_genai.GenerativeModel.return_value.generate_content.side_effect = self._resposta_lenta(0.05)
+
+        processor = BatchProcessor(api_key="fake_key")
+        df = self._dataset(16)
+
+        sequencial = processor.analisar_lote(df, limite=None)
+        tempo_sequencial = processor.metricas_execucao['tempo_total']
+
+        concorrente = processor.analisar_lote(df, limite=None, max_workers=8)
+        tempo_concorrente = processor.metricas_execucao['tempo_total']
+
+        self.assertEqual(list(concorrente['internacao_id']), list(df['internacao_id']))
+        self.assertEqual(list(concorrente.columns), list(sequencial.columns))
+        self.assertTrue((concorrente['prioridade_gemini'] == 'ALTA').all())
+        self.assertLess(tempo_concorrente, tempo_sequencial / 2)
+        self.assertGreater(processor.metricas_execucao['linhas_por_segundo'], 0)
+
+    @patch('llm_service.src.services.RAGSystem')
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_modo_concorrente_usa_fallback_por_linha(self, mock_genai, MockRAG):
+        MockRAG.return_value.buscar_contexto_relevante.return_value = {
+            'vector_store': [], 'knowledge_base': {}, 'dados_internacao': {}
+        }
+        processor = BatchProcessor(api_key="fake_key")
+        processor.llm_service.analisar_paciente_alta = MagicMock(
+            side_effect=[{'prioridade': 'ALTA'}, RuntimeError('falha'), None, {'prioridade': 'BAIXA'}]
+        )
+
+        resultados = processor.analisar_lote(self._dataset(4), limite=None, max_workers=1)
+
+        self.assertEqual(len(resultados), 4)
+        self.assertEqual(list(resultados['prioridade_gemini']), ['ALTA', 'MEDIA', 'MEDIA', 'BAIXA'])
+        self.assertEqual(list(resultados['fontes_gemini'])[1], ['Sistema de fallback'])
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_contexto_pre_buscado_por_bloco(self, MockRAG):
+        mock_rag = MockRAG.return_value
+        mock_rag.buscar_contexto_lote.side_effect = lambda lista: [
+            {'vector_store': [], 'knowledge_base': {}, 'dados_internacao': dados} for dados in lista
+        ]
+        processor = BatchProcessor(api_key="fake_key")
+        processor.llm_service.gemini.analisar_paciente_estruturado = MagicMock(return_value={'prioridade': 'ALTA'})
+
+        resultados = processor.analisar_lote(self._dataset(70), limite=None, max_workers=4)
+
+        self.assertEqual(len(resultados), 70)
+        # 70 linhas = 2 blocos; nenhuma busca individual
+        self.assertEqual(mock_rag.buscar_contexto_lote.call_count, 2)
+        mock_rag.buscar_contexto_relevante.assert_not_called()
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_triagem_kb_evita_llm_em_casos_claros(self, MockRAG):
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [None] * len(lista)
+        df = pd.DataFrame([
+            # Score 100: alta por regra
+            {'internacao_id': 'I1', 'patologia': 'APENDICITE', 'tempo_permanencia': 3, 'idade': 30,
+             'comorbidades': "['NENHUMA']", 'setor': 'ENFERMARIA'},
+            # Score 0 com folga de 11 dias no pagador: manter por regra
+            {'internacao_id': 'I2', 'patologia': 'SEPSE', 'tempo_permanencia': 3, 'idade': 85,
+             'comorbidades': "['DPOC', 'IRC', 'DIABETES']", 'setor': 'UTI'},
+            # Score 60: faixa incerta
+            {'internacao_id': 'I3', 'patologia': 'PNEUMONIA', 'tempo_permanencia': 6, 'idade': 70,
+             'comorbidades': "['HIPERTENSAO']", 'setor': 'ENFERMARIA'},
+            # Score 0 mas acima do limite do pagador: conformidade ambígua, vai ao LLM
+            {'internacao_id': 'I4', 'patologia': 'PNEUMONIA', 'tempo_permanencia': 9, 'idade': 85,
+             'comorbidades': "['DPOC', 'IRC', 'DIABETES']", 'setor': 'UTI'},
+        ])
+        processor = BatchProcessor(api_key="fake_key", triagem=ConfiguracaoTriagem())
+        processor.llm_service.analisar_paciente_alta = MagicMock(return_value={'prioridade': 'MEDIA'})
+
+        resultados = processor.analisar_lote(df, limite=None)
+
+        self.assertEqual(list(resultados['prioridade_gemini']), ['ALTA', 'MANTER', 'MEDIA', 'MEDIA'])
+        self.assertEqual(list(resultados['origem_analise']), ['REGRA_KB', 'REGRA_KB', 'LLM', 'LLM'])
+        self.assertEqual(processor.llm_service.analisar_paciente_alta.call_count, 2)
+        triagem = processor.metricas_execucao['triagem']
+        self.assertEqual((triagem['chamadas_llm'], triagem['chamadas_evitadas']), (2, 2))
+
+        # Triagem desligada (padrão): todas as linhas vão ao LLM
+        processor.triagem = ConfiguracaoTriagem(ativa=False)
+        resultados = processor.analisar_lote(df, limite=None)
+        self.assertTrue((resultados['origem_analise'] == 'LLM').all())
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_falhas_do_gemini_nao_contam_como_llm(self, MockRAG):
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [
+            {'vector_store': [], 'knowledge_base': {}, 'dados_internacao': dados} for dados in lista
+        ]
+        relogio = RelogioFalso()
+        modelo = ModeloGeminiSimulado(ConfiguracaoSimulacao(latencia_mediana=0.0, taxa_429=1.0),
+                                      relogio=relogio, dormir=relogio.dormir)
+        processor = BatchProcessor(api_key="fake_key")
+        processor.llm_service.gemini = GeminiIntegration(
+            api_key=None, backend=modelo,
+            rate_limiter=RateLimiter(requisicoes_por_minuto=100000, max_tentativas=2,
+                                     relogio=relogio, dormir=relogio.dormir)
+        )
+
+        # Cota excedida em todas as chamadas: 429 propaga até o BatchProcessor
+        resultados = processor.analisar_lote(self._dataset(3), limite=None)
+
+        self.assertEqual(modelo.estatisticas()['erros_429'], 6)
+        self.assertEqual(list(resultados['origem_analise']), ['FALLBACK'] * 3)
+        self.assertEqual(list(resultados['fontes_gemini'])[0], ['Sistema de fallback'])
+
+        # Erro não retentável (ex.: RAG): resposta de erro do LLMService, também FALLBACK
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [None] * len(lista)
+        MockRAG.return_value.buscar_contexto_relevante.side_effect = RuntimeError('RAG fora')
+        resultados = processor.analisar_lote(self._dataset(2), limite=None)
+        self.assertEqual(list(resultados['origem_analise']), ['FALLBACK'] * 2)
+        self.assertEqual(list(resultados['confianca_gemini']), [0.0, 0.0])
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_erro_nao_retentavel_e_resposta_vazia_viram_fallback(self, MockRAG):
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [
+            {'vector_store': [], 'knowledge_base': {}, 'dados_internacao': dados} for dados in lista
+        ]
+        bloqueada = MagicMock()
+        bloqueada.candidates[0].content.parts = []
+        bloqueada.candidates[0].finish_reason = 'SAFETY'
+        backend = MagicMock()
+        backend.generate_content.side_effect = [
+            google_exceptions.from_http_status(400, 'Requisição inválida'), bloqueada,
+        ]
+        processor = BatchProcessor(api_key="fake_key")
+        processor.llm_service.gemini = GeminiIntegration(api_key=None, backend=backend,
+                                                         rate_limiter=RateLimiter(requisicoes_por_minuto=100000))
+
+        resultados = processor.analisar_lote(self._dataset(2), limite=None)
+
+        # 400 não é repetido; nenhuma das duas linhas usa o texto fixo do mock
+        self.assertEqual(backend.generate_content.call_count, 2)
+        self.assertEqual(list(resultados['origem_analise']), ['FALLBACK', 'FALLBACK'])
+        self.assertEqual(list(resultados['confianca_gemini']), [0.0, 0.0])
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_streaming_em_blocos_grava_incrementalmente(self, MockRAG):
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [None] * len(lista)
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        entrada = os.path.join(pasta.name, 'internacoes.csv')
+        saida = os.path.join(pasta.name, 'resultados.csv')
+        self._dataset(10).to_csv(entrada, index=False)
+
+        processor = BatchProcessor(api_key="fake_key")
+        processor.llm_service.analisar_paciente_alta = MagicMock(return_value={'prioridade': 'ALTA'})
+
+        bloco = next(processor.carregar_dataset_em_blocos(entrada, tamanho_bloco=3))
+        self.assertEqual(len(bloco), 3)
+        self.assertEqual(str(bloco['patologia'].dtype), 'category')
+        self.assertEqual(str(bloco['idade'].dtype), 'Int32')
+
+        with patch.object(processor, 'analisar_lote', wraps=processor.analisar_lote) as analisar:
+            resumo = processor.processar_arquivo_em_blocos(entrada, saida, tamanho_bloco=3)
+
+        self.assertEqual(analisar.call_count, 4)
+        self.assertEqual((resumo['linhas'], resumo['processadas'], resumo['blocos']), (10, 10, 4))
+        self.assertEqual(resumo['distribuicao_prioridades'], {'ALTA': 10})
+        gravado = pd.read_csv(saida)
+        self.assertEqual(list(gravado['internacao_id']), [f'I{i:05d}' for i in range(10)])
+
+        resumo = processor.processar_arquivo_em_blocos(entrada, saida, tamanho_bloco=3, limite=4)
+        self.assertEqual((resumo['linhas'], resumo['blocos']), (4, 2))
+        self.assertEqual(len(pd.read_csv(saida)), 4)
+
+
+class DiarioExecucaoTests(TestCase):
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.pasta = pasta.name
+        self.diario = DiarioExecucao(os.path.join(self.pasta, 'diario.sqlite3'))
+        self.addCleanup(self.diario.fechar)
+        patcher = patch('llm_service.src.services.RAGSystem')
+        self.MockRAG = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [None] * len(lista)
+
+    def _dataset(self, total):
+        return BatchProcessorConcorrenciaTests._dataset(self, total)
+
+    def _processor(self, respostas):
+        processor = BatchProcessor(api_key="fake_key", diario=self.diario)
+        processor.llm_service.analisar_paciente_alta = MagicMock(side_effect=respostas)
+        return processor
+
+    def test_retomada_pula_concluidas_apos_interrupcao(self):
+        df = self._dataset(70)
+        self.diario.iniciar('dataset')
+        # Interrupção (Ctrl+C) na linha 67: o primeiro bloco de 64 já está no diário
+        respostas = [{'prioridade': 'ALTA'}] * 66 + [KeyboardInterrupt()]
+        with self.assertRaises(KeyboardInterrupt):
+            self._processor(respostas).analisar_lote(df, limite=None)
+        self.assertEqual(self.diario.total(), 64)
+
+        self.assertEqual(self.diario.iniciar('dataset', retomar=True), 64)
+        processor = self._processor([{'prioridade': 'BAIXA'}] * 6)
+        novos = processor.analisar_lote(df, limite=None, max_workers=4)
+
+        self.assertEqual(processor.llm_service.analisar_paciente_alta.call_count, 6)
+        self.assertEqual(list(novos['internacao_id']), [f'I{i:05d}' for i in range(64, 70)])
+        self.assertEqual(processor.metricas_execucao['retomadas'], 64)
+
+        saida = os.path.join(self.pasta, 'resultados.csv')
+        self.assertEqual(processor.exportar_diario(saida, tamanho_bloco=16), 70)
+        exportado = pd.read_csv(saida)
+        self.assertEqual(list(exportado['internacao_id']), list(df['internacao_id']))
+        self.assertEqual(list(exportado.columns), COLUNAS_RESULTADO)
+        self.assertEqual(exportado['prioridade_gemini'].value_counts().to_dict(), {'ALTA': 64, 'BAIXA': 6})
+        self.assertFalse(os.path.exists(saida + '.tmp'))
+
+    def test_fallback_e_refeito_na_mesma_posicao(self):
+        df = self._dataset(3)
+        self.diario.iniciar('dataset')
+        self._processor([{'prioridade': 'ALTA'}, RuntimeError('Gemini fora'), {'prioridade': 'ALTA'}]
+                        ).analisar_lote(df, limite=None)
+        self.assertEqual(self.diario.concluidos(), {'I00000', 'I00002'})
+
+        self.diario.iniciar('dataset', retomar=True)
+        self._processor([{'prioridade': 'MANTER'}]).analisar_lote(df, limite=None)
+
+        resultados = self._processor([]).resultados_diario()
+        self.assertEqual(list(resultados['internacao_id']), ['I00000', 'I00001', 'I00002'])
+        self.assertEqual(list(resultados['prioridade_gemini']), ['ALTA', 'MANTER', 'ALTA'])
+        self.assertEqual(list(resultados['origem_analise']), ['LLM', 'LLM', 'LLM'])
+
+    def test_retomada_refaz_linhas_que_esbarraram_na_cota(self):
+        self.MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [
+            {'vector_store': [], 'knowledge_base': {}, 'dados_internacao': dados} for dados in lista
+        ]
+        relogio = RelogioFalso()
+        modelo = ModeloGeminiSimulado(ConfiguracaoSimulacao(latencia_mediana=0.0, taxa_429=1.0),
+                                      relogio=relogio, dormir=relogio.dormir)
+        processor = BatchProcessor(api_key="fake_key", diario=self.diario)
+        processor.llm_service.gemini = GeminiIntegration(
+            api_key=None, backend=modelo,
+            rate_limiter=RateLimiter(requisicoes_por_minuto=100000, max_tentativas=2,
+                                     relogio=relogio, dormir=relogio.dormir)
+        )
+        df = self._dataset(3)
+
+        # Primeira execução: cota esgotada, tudo em fallback e nada concluído
+        self.diario.iniciar('dataset')
+        processor.analisar_lote(df, limite=None)
+        self.assertEqual(self.diario.total(), 3)
+        self.assertEqual(self.diario.concluidos(), set())
+
+        # Cota restabelecida: a retomada refaz as três linhas
+        modelo.configuracao.taxa_429 = 0.0
+        self.assertEqual(self.diario.iniciar('dataset', retomar=True), 0)
+        novos = processor.analisar_lote(df, limite=None)
+
+        self.assertEqual(list(novos['origem_analise']), ['LLM'] * 3)
+        self.assertEqual(self.diario.concluidos(), set(df['internacao_id']))
+        resultados = processor.resultados_diario()
+        self.assertEqual(list(resultados['internacao_id']), list(df['internacao_id']))
+        self.assertEqual(list(resultados['origem_analise']), ['LLM'] * 3)
+
+    def test_concluidos_consulta_so_os_ids_do_bloco(self):
+        self.diario.iniciar('dataset')
+        self.diario.registrar(
+            [{'internacao_id': f'I{i:05d}', 'origem_analise': 'LLM'} for i in range(1200)]
+            + [{'internacao_id': 'I99999', 'origem_analise': 'FALLBACK'}]
+        )
+        bloco = [f'I{i:05d}' for i in range(1195, 1205)] + ['I99999', None]
+
+        self.assertEqual(self.diario.concluidos(bloco), {f'I{i:05d}' for i in range(1195, 1200)})
+        # Mais IDs que uma fatia do IN
+        self.assertEqual(len(self.diario.concluidos(f'I{i:05d}' for i in range(1300))), 1200)
+        self.assertEqual(self.diario.total_concluidos(), 1200)
+
+    def test_diario_de_outra_entrada_ou_sem_retomar_recomeca(self):
+        self.diario.iniciar('dataset_a')
+        self.diario.registrar([{'internacao_id': 'I1', 'origem_analise': 'LLM'},
+                               {'internacao_id': float('nan'), 'origem_analise': 'LLM'}])
+        self.assertEqual(self.diario.total(), 1)
+
+        self.assertEqual(self.diario.iniciar('dataset_b', retomar=True), 0)
+        self.diario.registrar([{'internacao_id': 'I1', 'origem_analise': 'LLM'}])
+        self.assertEqual(self.diario.iniciar('dataset_b'), 0)
+
+    def test_streaming_com_diario_exporta_uma_vez(self):
+        entrada = os.path.join(self.pasta, 'internacoes.csv')
+        saida = os.path.join(self.pasta, 'resultados.csv')
+        self._dataset(10).to_csv(entrada, index=False)
+        self.diario.iniciar(entrada)
+        self.diario.registrar([{'internacao_id': 'I00003', 'prioridade_gemini': 'MANTER', 'origem_analise': 'LLM'}])
+
+        processor = self._processor([{'prioridade': 'ALTA'}] * 9)
+        with patch.object(processor, 'salvar_resultados') as salvar:
+            resumo = processor.processar_arquivo_em_blocos(entrada, saida, tamanho_bloco=3)
+
+        salvar.assert_not_called()
+        self.assertEqual((resumo['linhas'], resumo['processadas'], resumo['retomadas']), (10, 9, 1))
+        exportado = pd.read_csv(saida)
+        self.assertEqual(len(exportado), 10)
+        self.assertEqual(exportado['internacao_id'].iloc[0], 'I00003')
+
+
+class PromptAgrupadoTests(TestCase):
+
+    def setUp(self):
+        patcher = patch('llm_service.src.gemini_integration.gemini_rate_limiter',
+                        RateLimiter(requisicoes_por_minuto=100000, max_concorrencia=16))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _responder_casos(self, omitir=()):
+        """Modelo falso: um bloco por "CASO <id>:" do prompt, exceto os omitidos"""
+        def gerar(prompt, **kwargs):
+            casos = re.findall(r"^\s*CASO (\S+):$", prompt, re.MULTILINE)
+            resposta = MagicMock()
+            if not casos:
+                resposta.text = "RECOMENDACAO: ALTA_PRIORIDADE_BAIXA\nCONFIANCA: 0.6"
+            else:
+                resposta.text = "\n\n".join(
+                    f"CASO {caso}\nANALISE_INICIAL: {caso}\nRECOMENDACAO: ALTA_PRIORIDADE_ALTA\nCONFIANCA: 0.9"
+                    for caso in casos if caso not in omitir
+                )
+            return resposta
+        return gerar
+
+    def test_prompt_agrupado_leva_prompt_do_sistema_uma_vez(self):
+        prompts = PromptTemplates()
+        lista = [{'internacao_id': 'I1', 'patologia': 'SEPSE'}, {'internacao_id': 'I2', 'patologia': 'DENGUE'}]
+
+        prompt = prompts.criar_prompt_analise_lote(list(zip(prompts.ids_casos(lista), lista, [{}, {}])))
+
+        self.assertEqual(prompt.count('LIMITAÇÕES IMPORTANTES'), 1)
+        self.assertEqual(re.findall(r"^\s*CASO (\S+):$", prompt, re.MULTILINE), ['I1', 'I2'])
+        # IDs repetidos ou vazios: posição no pacote
+        self.assertEqual(prompts.ids_casos([{'internacao_id': 'I1'}, {'internacao_id': 'I1'}]), ['C1', 'C2'])
+
+    def test_dividir_resposta_ignora_blocos_truncados_e_desconhecidos(self):
+        resposta = (
+            "### CASO I1\nRECOMENDACAO: ALTA_PRIORIDADE_ALTA\nCONFIANCA: 0.9\n"
+            "**CASO I9**\nRECOMENDACAO: MANTER_INTERNACAO\nCONFIANCA: 0.5\n"
+            "CASO I2\nANALISE_INICIAL: cortada\nRECOMEN"
+        )
+        resultados = parser_respostas.dividir_por_caso(resposta, ['I1', 'I2'])
+
+        self.assertEqual(list(resultados), ['I1'])
+        self.assertEqual(resultados['I1']['prioridade'], 'ALTA')
+
+    def test_tamanho_pacote_limitado_pelo_orcamento_de_saida(self):
+        gemini = GeminiIntegration(api_key=None)
+        gemini.tokens_saida_por_caso = 300
+
+        self.assertEqual(gemini.tamanho_pacote(50), 5)  # 2048 * 0.8 // 300
+        self.assertEqual(gemini.tamanho_pacote(3), 3)
+        gemini.max_output_tokens = 200
+        self.assertEqual(gemini.tamanho_pacote(3), 1)
+
+    @patch('llm_service.src.services.RAGSystem')
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_lote_em_pacotes_reenvia_casos_ausentes(self, mock_genai, MockRAG):
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [
+            {'vector_store': [], 'knowledge_base': {}, 'dados_internacao': dados} for dados in lista
+        ]
+        generate_content = mock_genai.GenerativeModel.return_value.generate_content
+        generate_content.side_effect = self._responder_casos(omitir={'I00004'})
+        processor = BatchProcessor(api_key="fake_key")
+        df = pd.DataFrame([{
+            'internacao_id': f'I{i:05d}', 'paciente_id': f'P{i:04d}', 'paciente_nome': f'Paciente {i}',
+            'idade': 40, 'comorbidades': "['NENHUMA']", 'patologia': 'PNEUMONIA', 'tempo_ideal_patologia': 5,
+            'setor': 'ENFERMARIA', 'tempo_permanencia': 6, 'alerta_tempo': True, 'dias_excesso': 1,
+        } for i in range(7)])
+
+        resultados = processor.analisar_lote(df, limite=None, max_workers=2, tamanho_pacote=3)
+
+        self.assertEqual(list(resultados['internacao_id']), list(df['internacao_id']))
+        # Pacotes [0-2] e [3-5]; I00004 (omitido) e I00006 (sozinho) vão individualmente
+        self.assertEqual(generate_content.call_count, 4)
+        self.assertEqual(list(resultados['prioridade_gemini']),
+                         ['ALTA', 'ALTA', 'ALTA', 'ALTA', 'BAIXA', 'ALTA', 'BAIXA'])
+        self.assertEqual(list(resultados['analise_inicial_gemini'])[:2], ['I00000', 'I00001'])
+        self.assertEqual(processor.metricas_execucao['pacotes'],
+                         {'tamanho_pacote': 3, 'pacotes': 2, 'casos_agrupados': 5, 'casos_reenviados': 2,
+                          'casos_fallback': 0})
+        self.assertEqual(processor.metricas_execucao['triagem']['chamadas_llm'], 4)
+
+    @patch('llm_service.src.services.RAGSystem')
+    def test_pacote_com_erro_retentavel_vira_fallback_sem_reenvio(self, MockRAG):
+        processor = BatchProcessor(api_key=None)
+        processor.llm_service.gemini.tamanho_pacote = lambda solicitado: solicitado
+        processor.llm_service.analisar_pacientes_alta_agrupados = MagicMock(
+            side_effect=[google_exceptions.ResourceExhausted("cota"), google_exceptions.InvalidArgument("prompt")]
+        )
+        processor.llm_service.analisar_paciente_alta = MagicMock(return_value={'prioridade': 'BAIXA'})
+        df = pd.DataFrame([{
+            'internacao_id': f'I{i:05d}', 'paciente_id': f'P{i:04d}', 'paciente_nome': f'Paciente {i}',
+            'idade': 40, 'comorbidades': "['NENHUMA']", 'patologia': 'PNEUMONIA', 'tempo_ideal_patologia': 5,
+            'setor': 'ENFERMARIA', 'tempo_permanencia': 6, 'alerta_tempo': True, 'dias_excesso': 1,
+        } for i in range(5)])
+
+        resultados = processor.analisar_lote(df, limite=None, tamanho_pacote=2)
+
+        # [0-1] 429: fallback sem chamadas individuais; [2-3] 400: reenvio; [4] sozinho
+        self.assertEqual(list(resultados['origem_analise']), ['FALLBACK', 'FALLBACK', 'LLM', 'LLM', 'LLM'])
+        self.assertEqual(processor.llm_service.analisar_paciente_alta.call_count, 3)
+        self.assertEqual(processor.metricas_execucao['pacotes'],
+                         {'tamanho_pacote': 2, 'pacotes': 2, 'casos_agrupados': 0, 'casos_reenviados': 3,
+                          'casos_fallback': 2})
+
+
+class RelogioFalso:
+    """Relógio controlado pelo teste: dormir apenas avança o tempo"""
+
+    def __init__(self):
+        self.agora = 0.0
+        self.esperas = []
+
+    def __call__(self):
+        return self.agora
+
+    def dormir(self, segundos):
+        self.esperas.append(segundos)
+        self.agora += segundos
+
+
+class RateLimiterTests(TestCase):
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+
+    def _limiter(self, **kwargs):
+        return RateLimiter(relogio=self.relogio, dormir=self.relogio.dormir, **kwargs)
+
+    def test_orcamentos_invalidos(self):
+        for kwargs in ({'requisicoes_por_minuto': 0}, {'requisicoes_por_minuto': -5},
+                       {'tokens_por_minuto': 0}, {'tokens_por_minuto': float('nan')}):
+            with self.assertRaises(ValueError):
+                self._limiter(**kwargs)
+
+    def test_menos_de_uma_requisicao_por_minuto(self):
+        # Capacidade mínima de 1: a segunda requisição espera a recarga (2 min a 0.5 RPM)
+        limiter = self._limiter(requisicoes_por_minuto=0.5)
+        for _ in range(2):
+            limiter.adquirir()
+            limiter.liberar()
+
+        self.assertAlmostEqual(sum(self.relogio.esperas), 120.0)
+
+    def test_bucket_requisicoes_espera_recarga(self):
+        limiter = self._limiter(requisicoes_por_minuto=60, tokens_por_minuto=10**9)
+        for _ in range(60):
+            limiter.adquirir()
+            limiter.liberar()
+        self.assertEqual(self.relogio.agora, 0.0)
+
+        limiter.adquirir()
+        self.assertAlmostEqual(self.relogio.agora, 1.0)
+        self.assertAlmostEqual(limiter.estatisticas()['tempo_espera_bucket'], 1.0)
+
+    def test_bucket_tokens_espera_recarga(self):
+        limiter = self._limiter(requisicoes_por_minuto=1000, tokens_por_minuto=1000)
+        limiter.adquirir(600)
+        limiter.liberar(600)
+        limiter.adquirir(600)
+        # Faltavam 200 tokens a 1000 tokens/min
+        self.assertAlmostEqual(self.relogio.agora, 12.0)
+
+    def test_aimd_reduz_pela_metade_e_cresce_aditivamente(self):
+        limiter = self._limiter(max_concorrencia=8)
+        limiter.registrar_limite_excedido()
+        self.assertEqual(limiter.limite_concorrencia, 4.0)
+        limiter.registrar_limite_excedido()
+        self.assertEqual(limiter.limite_concorrencia, 2.0)
+        limiter.registrar_sucesso()
+        self.assertEqual(limiter.limite_concorrencia, 2.5)
+
+    def test_executar_repete_erro_429_com_backoff(self):
+        limiter = self._limiter(requisicoes_por_minuto=1000)
+        chamada = MagicMock(side_effect=[google_exceptions.ResourceExhausted('429 quota'), 'ok'])
+
+        resultado = limiter.executar(chamada)
+
+        self.assertEqual(resultado, 'ok')
+        estatisticas = limiter.estatisticas()
+        self.assertEqual(estatisticas['retentativas'], 1)
+        self.assertEqual(estatisticas['erros_limite'], 1)
+        self.assertEqual(estatisticas['sucessos'], 1)
+        self.assertEqual(estatisticas['em_andamento'], 0)
+
+    def test_executar_nao_repete_erro_nao_retentavel(self):
+        limiter = self._limiter()
+        chamada = MagicMock(side_effect=ValueError('prompt inválido'))
+
+        with self.assertRaises(ValueError):
+            limiter.executar(chamada)
+        self.assertEqual(chamada.call_count, 1)
+        self.assertEqual(limiter.estatisticas()['falhas'], 1)
+
+
+class GeminiRateLimitTests(TestCase):
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+        self.limiter = RateLimiter(requisicoes_por_minuto=1000, max_tentativas=3,
+                                   relogio=self.relogio, dormir=self.relogio.dormir)
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_429_e_repetido_em_vez_de_virar_mock(self, mock_genai):
+        mock_response = MagicMock()
+        mock_response.text = "RECOMENDACAO: MANTER_INTERNACAO"
+        mock_genai.GenerativeModel.return_value.generate_content.side_effect = [
+            google_exceptions.ResourceExhausted('429 quota'), mock_response
+        ]
+
+        gemini = GeminiIntegration(api_key="fake_key", rate_limiter=self.limiter)
+        resposta = gemini.analisar_paciente("prompt")
+
+        self.assertEqual(resposta, "RECOMENDACAO: MANTER_INTERNACAO")
+        self.assertEqual(gemini.estatisticas()['retentativas'], 1)
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_cota_esgotada_propaga_erro(self, mock_genai):
+        mock_genai.GenerativeModel.return_value.generate_content.side_effect = \
+            google_exceptions.ResourceExhausted('429 quota')
+
+        gemini = GeminiIntegration(api_key="fake_key", rate_limiter=self.limiter)
+
+        with self.assertRaises(google_exceptions.ResourceExhausted):
+            gemini.analisar_paciente("prompt")
+        self.assertEqual(gemini.estatisticas()['retentativas'], 2)
+
+
+class GeminiSimuladoTests(TestCase):
+
+    PROMPT = "DADOS DO CASO:\n- Motivo Principal: SEPSE\n- Duração da Permanência: 12 dias\n- Tempo de Referência: 7 dias\n"
+
+    def setUp(self):
+        self.relogio = RelogioFalso()
+
+    def _modelo(self, **parametros):
+        configuracao = ConfiguracaoSimulacao(latencia_mediana=parametros.pop('latencia_mediana', 0.0), **parametros)
+        return ModeloGeminiSimulado(configuracao, relogio=self.relogio, dormir=self.relogio.dormir)
+
+    def test_resposta_deterministica_por_prompt(self):
+        resposta = self._modelo().generate_content(self.PROMPT)
+
+        self.assertEqual(resposta.text, self._modelo(semente=7).generate_content(self.PROMPT).text)
+        resultado = ParserRespostaLLM().parse(resposta.text)
+        self.assertEqual(resultado['prioridade'], 'ALTA')  # 12/7 dias
+        self.assertEqual(resposta.finish_reason, 'STOP')
+        self.assertGreater(resposta.usage_metadata.total_token_count, 0)
+
+    def test_prompt_agrupado_e_modo_json(self):
+        prompts = PromptTemplates()
+        lista = [{'internacao_id': 'I1', 'tempo_permanencia': 2, 'tempo_ideal_patologia': 7},
+                 {'internacao_id': 'I2', 'tempo_permanencia': 8, 'tempo_ideal_patologia': 7}]
+        prompt = prompts.criar_prompt_analise_lote(list(zip(['I1', 'I2'], lista, [{}, {}])))
+        modelo = self._modelo()
+
+        texto = parser_respostas.dividir_por_caso(modelo.generate_content(prompt).text, ['I1', 'I2'])
+        resposta_json = modelo.generate_content(prompt, generation_config={'response_mime_type': 'application/json'})
+        por_json = parser_respostas.dividir_por_caso(resposta_json.text, ['I1', 'I2'])
+
+        self.assertEqual([texto['I1']['prioridade'], texto['I2']['prioridade']], ['MANTER', 'MEDIA'])
+        self.assertEqual({k: v['prioridade'] for k, v in por_json.items()}, {'I1': 'MANTER', 'I2': 'MEDIA'})
+
+    def test_latencia_erros_e_truncamento(self):
+        modelo = self._modelo(latencia_mediana=0.5, latencia_sigma=0.0, latencia_por_token=0.0)
+        modelo.generate_content(self.PROMPT)
+        self.assertEqual(self.relogio.esperas, [0.5])
+
+        with self.assertRaises(google_exceptions.ResourceExhausted):
+            self._modelo(taxa_429=1.0).generate_content(self.PROMPT)
+        with self.assertRaises(google_exceptions.InternalServerError):
+            self._modelo(taxa_500=1.0).generate_content(self.PROMPT)
+
+        truncada = self._modelo().generate_content(self.PROMPT, generation_config={'max_output_tokens': 10})
+        self.assertEqual(truncada.finish_reason, 'MAX_TOKENS')
+        self.assertEqual(len(truncada.text), 40)
+        self.assertEqual(self._modelo(taxa_truncamento=1.0).generate_content(self.PROMPT).finish_reason, 'MAX_TOKENS')
+
+    def test_janela_de_cota(self):
+        modelo = self._modelo(requisicoes_por_janela=2, janela_cota=60.0)
+        modelo.generate_content(self.PROMPT)
+        modelo.generate_content(self.PROMPT)
+        with self.assertRaises(google_exceptions.ResourceExhausted):
+            modelo.generate_content(self.PROMPT)
+
+        self.relogio.agora += 60
+        modelo.generate_content(self.PROMPT)
+        self.assertEqual(modelo.estatisticas()['erros_429'], 1)
+        self.assertEqual(modelo.estatisticas()['sucessos'], 3)
+
+    @patch('llm_service.src.rate_limiter.random.uniform', side_effect=lambda minimo, teto: teto)
+    def test_backend_injetado_passa_pelo_rate_limiter(self, mock_uniform):
+        limiter = RateLimiter(requisicoes_por_minuto=1000, max_tentativas=3,
+                              relogio=self.relogio, dormir=self.relogio.dormir)
+        modelo = self._modelo(requisicoes_por_janela=1, janela_cota=1.0)
+        gemini = GeminiIntegration(api_key=None, rate_limiter=limiter, backend=modelo)
+
+        primeira = gemini.analisar_paciente_estruturado(self.PROMPT)
+        # Cota da janela esgotada: 429 simulado, backoff do limitador e nova tentativa
+        segunda = gemini.analisar_paciente_estruturado(self.PROMPT)
+
+        self.assertEqual(primeira['prioridade'], 'ALTA')
+        self.assertEqual(segunda, primeira)
+        # Jitter fixo no teto: uma espera (>= 1s) basta para a janela virar
+        self.assertEqual(gemini.estatisticas()['retentativas'], 1)
+        self.assertEqual(modelo.estatisticas()['erros_429'], 1)
+        self.assertEqual(modelo.generation_config['max_output_tokens'], gemini.max_output_tokens)
+
+    def test_servidor_http_equivale_ao_modelo_em_processo(self):
+        with ServidorGeminiSimulado(self._modelo()) as servidor:
+            cliente = ClienteGeminiHTTP(servidor.url)
+            resposta = cliente.generate_content(self.PROMPT)
+            servidor.modelo.configuracao.taxa_429 = 1.0
+            with self.assertRaises(google_exceptions.TooManyRequests) as erro:
+                cliente.generate_content(self.PROMPT)
+
+        self.assertEqual(resposta.text, self._modelo().generate_content(self.PROMPT).text)
+        self.assertEqual(resposta.finish_reason, 'STOP')
+        self.assertEqual(erro.exception.code, 429)
+
+
+class CacheAnalisesTests(TestCase):
+
+    def setUp(self):
+        pasta = tempfile.TemporaryDirectory()
+        self.addCleanup(pasta.cleanup)
+        self.caminho = os.path.join(pasta.name, 'cache.sqlite3')
+        self.relogio = RelogioFalso()
+
+    def _cache(self, **kwargs):
+        cache = CacheAnalises(self.caminho, relogio=self.relogio, **kwargs)
+        self.addCleanup(cache.fechar)
+        return cache
+
+    def test_chave_depende_de_prompt_modelo_e_configuracao(self):
+        base = CacheAnalises.gerar_chave('prompt', 'gemini-2.0-flash', {'temperature': 0.1})
+        self.assertEqual(base, CacheAnalises.gerar_chave('prompt', 'gemini-2.0-flash', {'temperature': 0.1}))
+        self.assertNotEqual(base, CacheAnalises.gerar_chave('prompt 2', 'gemini-2.0-flash', {'temperature': 0.1}))
+        self.assertNotEqual(base, CacheAnalises.gerar_chave('prompt', 'gemini-1.5-pro', {'temperature': 0.1}))
+        self.assertNotEqual(base, CacheAnalises.gerar_chave('prompt', 'gemini-2.0-flash', {'temperature': 0.5}))
+
+    def test_hit_miss_e_persistencia(self):
+        cache = self._cache()
+        self.assertIsNone(cache.obter('a'))
+        cache.salvar('a', 'resposta A')
+        self.assertEqual(cache.obter('a'), 'resposta A')
+
+        reaberto = self._cache()
+        self.assertEqual(reaberto.obter('a'), 'resposta A')
+        self.assertEqual(cache.estatisticas()['hits'], 1)
+        self.assertEqual(cache.estatisticas()['misses'], 1)
+
+    def test_ttl_expira_entrada(self):
+        cache = self._cache(ttl_segundos=60)
+        cache.salvar('a', 'resposta A')
+        self.relogio.agora += 61
+        self.assertIsNone(cache.obter('a'))
+        self.assertEqual(cache.estatisticas()['expiradas'], 1)
+
+    def test_despejo_lru(self):
+        cache = self._cache(max_entradas=2)
+        cache.salvar('a', 'A')
+        self.relogio.agora += 1
+        cache.salvar('b', 'B')
+        self.relogio.agora += 1
+        cache.obter('a')  # 'b' passa a ser a menos usada
+        self.relogio.agora += 1
+        cache.salvar('c', 'C')
+
+        self.assertEqual(cache.estatisticas()['entradas'], 2)
+        self.assertIsNone(cache.obter('b'))
+        self.assertEqual(cache.obter('a'), 'A')
+
+    def test_bypass_ignora_leitura_mas_grava(self):
+        cache = self._cache(bypass=True)
+        cache.salvar('a', 'antiga')
+        self.assertIsNone(cache.obter('a'))
+        cache.bypass = False
+        self.assertEqual(cache.obter('a'), 'antiga')
+
+    @patch('llm_service.src.gemini_integration.genai')
+    def test_gemini_reutiliza_resposta_em_cache(self, mock_genai):
+        mock_response = MagicMock()
+        mock_response.text = "RECOMENDACAO: ALTA_PRIORIDADE_ALTA"
+        mock_response.candidates[0].finish_reason = 'STOP'
+        mock_model = mock_genai.GenerativeModel.return_value
+        mock_model.generate_content.return_value = mock_response
+
+        limiter = RateLimiter(requisicoes_por_minuto=1000)
+        gemini = GeminiIntegration(api_key="fake_key", rate_limiter=limiter, cache=self._cache())
+
+        primeira = gemini.analisar_paciente("prompt igual")
+        segunda = gemini.analisar_paciente("prompt igual")
+
+        self.assertEqual(primeira, segunda)
+        self.assertEqual(mock_model.generate_content.call_count, 1)
+        self.assertEqual(gemini.cache.estatisticas()['hits'], 1)
+
+    def test_resposta_truncada_nao_vai_para_o_cache(self):
+        relogio = RelogioFalso()
+        modelo = ModeloGeminiSimulado(ConfiguracaoSimulacao(latencia_mediana=0.0, taxa_truncamento=1.0),
+                                      relogio=relogio, dormir=relogio.dormir)
+        gemini = GeminiIntegration(api_key=None, backend=modelo, cache=self._cache(),
+                                   rate_limiter=RateLimiter(requisicoes_por_minuto=1000,
+                                                            relogio=relogio, dormir=relogio.dormir))
+        prompt = GeminiSimuladoTests.PROMPT
+
+        gemini.analisar_paciente(prompt)
+        gemini.analisar_paciente(prompt)
+        # MAX_TOKENS: refeita nas duas vezes e nunca gravada
+        self.assertEqual(modelo.estatisticas()['chamadas'], 2)
+        self.assertEqual(gemini.cache.estatisticas()['gravacoes'], 0)
+
+        modelo.configuracao.taxa_truncamento = 0.0
+        gemini.analisar_paciente(prompt)
+        gemini.analisar_paciente(prompt)
+        self.assertEqual(modelo.estatisticas()['chamadas'], 3)
+        self.assertEqual(gemini.cache.estatisticas()['hits'], 1)
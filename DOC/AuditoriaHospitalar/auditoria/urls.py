@@ -10,6 +10,9 @@ urlpatterns = [
     path('efetivar-alta/<int:internacao_id>/', views.efetivar_alta, name='efetivar_alta'),
     path('analise-contas/', views.analise_contas, name='analise_contas'),
     path('conta/<int:internacao_id>/', views.detalhe_conta, name='detalhe_conta'),
+    path('conta/<int:internacao_id>/resumo/', views.resumo_conta_json, name='resumo_conta'),
     path('validar-item/<int:item_id>/', views.validar_item, name='validar_item'),
+    path('conta/<int:internacao_id>/validar-itens/', views.validar_itens_lote, name='validar_itens_lote'),
     path('historico/', views.historico_auditorias, name='historico'),
+    path('cache/estatisticas/', views.estatisticas_cache, name='estatisticas_cache'),
 ]
@@ -1,28 +1,38 @@
+from django.http import HttpResponseBadRequest, JsonResponse
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.utils import timezone
-from django.db.models import Sum, Count, Q
 from .models import Internacao, ItemConta, Auditoria
+from .busca import buscar_auditorias
+from .cache_consultas import cache_consultas
+from .censo import resumo_censo
+from .paginacao import paginar_keyset
+from .services import ACOES_ITEM, item_para_dict, resumo_conta, validar_itens_em_lote
 from core.models import Paciente
 
+# Ordenação da paginação keyset de cada lista (a última chave é única).
+# PlanoConsultaTests confere o plano dessas mesmas ordenações.
+ORDENACAO_MONITORAMENTO = ['data_entrada', 'id']
+ORDENACAO_CONTROLE_ALTAS = ['limite_alerta', 'id']
+ORDENACAO_ANALISE_CONTAS = ['-data_saida', '-id']
+ORDENACAO_HISTORICO = ['-data_auditoria', '-id']
+
 @login_required
 def dashboard(request):
     """Dashboard principal - HU04"""
-    internacoes_ativas = Internacao.objects.filter(status='ATIVA').select_related('paciente', 'patologia')
-    
-    # Calcular alertas
-    total_alertas = sum(1 for i in internacoes_ativas if i.excedeu_tempo_ideal())
-    
-    # Estatísticas
-    total_internacoes = internacoes_ativas.count()
-    por_setor = internacoes_ativas.values('setor').annotate(total=Count('id'))
-    
-    context = {
-        'internacoes_ativas': internacoes_ativas,
-        'total_internacoes': total_internacoes,
-        'total_alertas': total_alertas,
-        'por_setor': por_setor,
-    }
+    hoje = timezone.localdate()
+    
+    def calcular():
+        # Totais, alertas e distribuição por setor do censo diário materializado
+        return {
+            **resumo_censo(hoje),
+            'internacoes_ativas': list(
+                Internacao.objects.ativas().com_permanencia().select_related('paciente', 'patologia')[:5]
+            ),
+        }
+    
+    context = cache_consultas.obter_ou_calcular('dashboard', ['internacoes'], calcular, {'data': hoje})
     return render(request, 'auditoria/dashboard.html', context)
 
 
@@ -31,17 +41,22 @@ def monitoramento_tempo_real(request):
     """Monitoramento em tempo real - HU01"""
     setor_filtro = request.GET.get('setor', None)
     
-    internacoes = Internacao.objects.filter(status='ATIVA').select_related('paciente', 'patologia')
+    # Flag de alerta (tem_alerta) e dias calculados no banco
+    internacoes = Internacao.objects.ativas().com_permanencia().select_related('paciente', 'patologia')
     
     if setor_filtro:
         internacoes = internacoes.filter(setor=setor_filtro)
     
-    # Adicionar flag de alerta
-    for internacao in internacoes:
-        internacao.tem_alerta = internacao.excedeu_tempo_ideal()
+    # Mais antigas primeiro, paginado por keyset; em cache por filtro/cursor
+    pagina = cache_consultas.obter_ou_calcular(
+        'monitoramento', ['internacoes'],
+        lambda: paginar_keyset(internacoes, request, ORDENACAO_MONITORAMENTO),
+        request.GET.dict()
+    )
     
     context = {
-        'internacoes': internacoes,
+        'internacoes': pagina.itens,
+        'pagina': pagina,
         'setor_filtro': setor_filtro,
         'setores': Paciente.SETOR_CHOICES,
     }
@@ -51,15 +66,14 @@ def monitoramento_tempo_real(request):
 @login_required
 def controle_altas(request):
     """Controle de altas - HU03"""
-    prontas_alta = Internacao.objects.filter(
-        status='ATIVA'
-    ).select_related('paciente', 'patologia')
-    
-    # Filtrar pacientes que excederam tempo ideal
-    prontas_alta = [i for i in prontas_alta if i.excedeu_tempo_ideal()]
+    # Pacientes que excederam tempo ideal, maior excesso primeiro. O cursor usa
+    # limite_alerta (fixo) e não excesso_dias, que muda com Now() entre as páginas
+    prontas_alta = Internacao.objects.ativas().com_alerta().com_limite_alerta().select_related('paciente', 'patologia')
+    pagina = paginar_keyset(prontas_alta, request, ORDENACAO_CONTROLE_ALTAS)
     
     context = {
-        'prontas_alta': prontas_alta,
+        'prontas_alta': pagina.itens,
+        'pagina': pagina,
     }
     return render(request, 'auditoria/controle_altas.html', context)
 
@@ -83,33 +97,56 @@ def analise_contas(request):
     """Análise de contas médicas - HU05"""
     internacoes_finalizadas = Internacao.objects.filter(
         status='ALTA'
-    ).select_related('paciente', 'patologia').order_by('-data_saida')
+    ).select_related('paciente', 'patologia')
+    # data_saida pode ser nula: essas ficam no fim da lista
+    pagina = paginar_keyset(internacoes_finalizadas, request, ORDENACAO_ANALISE_CONTAS)
     
     context = {
-        'internacoes': internacoes_finalizadas,
+        'internacoes': pagina.itens,
+        'pagina': pagina,
     }
     return render(request, 'auditoria/analise_contas.html', context)
 
 
+def _resumo_conta_cache(internacao_id):
+    return cache_consultas.obter_ou_calcular(
+        'resumo_conta', ['contas'], lambda: resumo_conta(internacao_id), {'internacao': internacao_id}
+    )
+
+
 @login_required
 def detalhe_conta(request, internacao_id):
     """Detalhe da conta para auditoria retrospectiva - HU06"""
-    internacao = get_object_or_404(Internacao, id=internacao_id)
-    itens = ItemConta.objects.filter(internacao=internacao).select_related('procedimento')
-    
-    # Calcular totais
-    valor_total = itens.aggregate(total=Sum('valor_total'))['total'] or 0
-    total_glosado = itens.filter(status='GLOSADO').aggregate(total=Sum('valor_total'))['total'] or 0
+    internacao = get_object_or_404(
+        Internacao.objects.select_related('paciente', 'patologia'), id=internacao_id
+    )
+    resumo = _resumo_conta_cache(internacao.id)
     
     context = {
         'internacao': internacao,
-        'itens': itens,
-        'valor_total': valor_total,
-        'total_glosado': total_glosado,
+        **resumo,
     }
     return render(request, 'auditoria/detalhe_conta.html', context)
 
 
+@login_required
+def resumo_conta_json(request, internacao_id):
+    """Resumo da conta (itens + totais) em JSON"""
+    internacao = get_object_or_404(Internacao, id=internacao_id)
+    resumo = _resumo_conta_cache(internacao.id)
+    return JsonResponse({
+        **resumo,
+        'internacao': internacao.id,
+        'itens': [item_para_dict(item) for item in resumo['itens']],
+    })
+
+
+@login_required
+def estatisticas_cache(request):
+    """Acertos/erros do cache das consultas (por processo)"""
+    return JsonResponse(cache_consultas.estatisticas())
+
+
 @login_required
 def validar_item(request, item_id):
     """Aprovar ou glosar item - HU07, HU09"""
@@ -132,23 +169,59 @@ def validar_item(request, item_id):
     return render(request, 'auditoria/validar_item.html', {'item': item})
 
 
+@login_required
+@require_POST
+def validar_itens_lote(request, internacao_id):
+    """Aprovar ou glosar vários itens da conta de uma vez - HU07, HU09"""
+    internacao = get_object_or_404(Internacao, id=internacao_id)
+    acao = request.POST.get('acao')
+    if acao not in ACOES_ITEM:
+        return HttpResponseBadRequest('Ação inválida')
+    try:
+        item_ids = [int(item_id) for item_id in request.POST.getlist('itens')]
+    except ValueError:
+        return HttpResponseBadRequest('Itens inválidos')
+    justificativa = request.POST.get('justificativa', '').strip()
+    if acao == 'glosar' and not justificativa:
+        return HttpResponseBadRequest('Justificativa obrigatória para glosa')
+    
+    auditoria, atualizados = validar_itens_em_lote(
+        internacao, item_ids, acao, justificativa, request.user
+    )
+    
+    if 'application/json' in request.headers.get('Accept', ''):
+        return JsonResponse({
+            'auditoria': auditoria.id if auditoria else None,
+            'itens_atualizados': atualizados,
+            'itens_glosados': auditoria.itens_glosados if auditoria else 0,
+            'valor_glosado': auditoria.valor_glosado if auditoria else 0,
+        })
+    return redirect('auditoria:detalhe_conta', internacao_id=internacao.id)
+
+
 @login_required
 def historico_auditorias(request):
     """Histórico de auditorias - HU11"""
     auditorias = Auditoria.objects.all().select_related(
         'internacao__paciente', 'auditor'
-    ).order_by('-data_auditoria')
+    )
     
     # Filtros
     termo_busca = request.GET.get('busca', '')
+    ordenacao = ORDENACAO_HISTORICO
     if termo_busca:
-        auditorias = auditorias.filter(
-            Q(internacao__paciente__nome__icontains=termo_busca) |
-            Q(observacoes__icontains=termo_busca)
-        )
+        # Índice textual (FTS5/tsvector), mais relevantes primeiro
+        auditorias = buscar_auditorias(auditorias, termo_busca)
+        ordenacao = ['-relevancia'] + ordenacao
+    
+    pagina = cache_consultas.obter_ou_calcular(
+        'historico', ['auditorias'], lambda: paginar_keyset(auditorias, request, ordenacao),
+        request.GET.dict()
+    )
     
     context = {
-        'auditorias': auditorias,
+        'auditorias': pagina.itens,
+        'pagina': pagina,
         'termo_busca': termo_busca,
     }
     return render(request, 'auditoria/historico.html', context)
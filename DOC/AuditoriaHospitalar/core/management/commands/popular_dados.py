@@ -1,12 +1,39 @@
+import random
+import time
+
 from django.core.management.base import BaseCommand
 from django.contrib.auth.models import User
+from django.db import transaction
 from django.utils import timezone
-from datetime import timedelta
+from datetime import date, datetime, time as dt_time, timedelta
 from decimal import Decimal
 
 from core.models import Patologia, Procedimento, ProcedimentoPadrao, Paciente
+from auditoria.busca import reconstruir_indice
+from auditoria.cache_consultas import cache_consultas
+from auditoria.censo import recalcular_censo
 from auditoria.models import Internacao, ItemConta, Auditoria
 
+# Vocabulário dos dados sintéticos de --escala
+PRIMEIROS_NOMES = [
+    'Ana', 'João', 'Maria', 'José', 'Antônio', 'Francisca', 'Carlos', 'Paulo', 'Adriana', 'Lúcia',
+    'Luiz', 'Márcia', 'Pedro', 'Fernanda', 'Rafael', 'Juliana', 'Sebastião', 'Conceição', 'Inês', 'Otávio',
+]
+SOBRENOMES = [
+    'Silva', 'Santos', 'Oliveira', 'Souza', 'Rodrigues', 'Ferreira', 'Alves', 'Pereira', 'Lima', 'Gomes',
+    'Ribeiro', 'Carvalho', 'Araújo', 'Magalhães', 'Conceição', 'Brandão', 'Guimarães', 'Simões', 'Assunção', 'Falcão',
+]
+OBSERVACOES_AUDITORIA = [
+    'Conta conferida conforme protocolo da patologia.',
+    'Diárias compatíveis com o tempo de permanência.',
+    'Exames de imagem acima do previsto no protocolo; excesso glosado.',
+    'Medicação em quantidade superior à prescrição; glosa parcial.',
+    'Procedimento sem justificativa clínica registrada em prontuário.',
+    'Valor unitário divergente da tabela contratual.',
+    'Solicitado parecer médico para diárias excedentes.',
+]
+DIARIA_POR_SETOR = {'UTI': 'INT001', 'ENFERMARIA': 'INT002', 'APARTAMENTO': 'INT003'}
+
 
 class Command(BaseCommand):
     help = 'Popula o banco de dados com dados de exemplo'
@@ -17,6 +44,31 @@ class Command(BaseCommand):
             action='store_true',
             help='Limpa todos os dados antes de popular',
         )
+        parser.add_argument(
+            '--escala',
+            type=int,
+            default=0,
+            help='Gera N internações sintéticas (com pacientes, itens e auditorias) via bulk_create',
+        )
+        parser.add_argument(
+            '--semente',
+            type=int,
+            default=42,
+            help='Semente do gerador sintético (mesma semente e --data-referencia = mesmos dados; '
+                 'os CPFs continuam a numeração dos pacientes já existentes)',
+        )
+        parser.add_argument(
+            '--data-referencia',
+            type=date.fromisoformat,
+            default=None,
+            help='Data (AAAA-MM-DD) em relação à qual as datas sintéticas são geradas (padrão: hoje)',
+        )
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=5000,
+            help='Internações por transação/bulk_create no modo --escala',
+        )
 
     def handle(self, *args, **kwargs):
         limpar = kwargs['limpar']
@@ -147,6 +199,11 @@ class Command(BaseCommand):
 
         self.stdout.write('✓ Base de conhecimento configurada\n')
 
+        if kwargs['escala']:
+            self.gerar_em_escala(kwargs['escala'], kwargs['semente'], kwargs['lote'], auditor,
+                                 kwargs['data_referencia'])
+            return
+
         # Criar Pacientes
         pacientes_data = [
             {'nome': 'João Silva', 'cpf': '123.456.789-00', 'data_nascimento': '1965-03-15', 'setor_atual': 'ENFERMARIA'},
@@ -484,7 +541,7 @@ class Command(BaseCommand):
         self.stdout.write(f'   • {Auditoria.objects.count()} auditorias registradas')
         
         alertas = Internacao.objects.filter(status='ATIVA').count()
-        com_alerta = sum(1 for i in Internacao.objects.filter(status='ATIVA') if i.excedeu_tempo_ideal())
+        com_alerta = Internacao.objects.ativas().com_alerta().count()
         self.stdout.write(f'   • {com_alerta} internações com alerta de tempo')
 
         self.stdout.write('\n👥 CREDENCIAIS:')
@@ -503,4 +560,155 @@ class Command(BaseCommand):
         self.stdout.write('   5. Histórico - 5 auditorias registradas')
         
         self.stdout.write('\n💡 DICA: Use --limpar para resetar o banco antes de popular')
-        self.stdout.write('   python manage.py popular_dados --limpar\n')
\ No newline at end of file
+        self.stdout.write('   python manage.py popular_dados --limpar\n')
+
+    # ------------------------------------------------------------------
+    # Modo --escala: dados sintéticos em massa
+    # ------------------------------------------------------------------
+
+    @staticmethod
+    def _cpf(numero: int) -> str:
+        """CPF com dígitos verificadores válidos a partir de um número de 9 dígitos"""
+        digitos = [int(d) for d in f'{numero % 1_000_000_000:09d}']
+        for tamanho in (9, 10):
+            soma = sum(d * peso for d, peso in zip(digitos, range(tamanho + 1, 1, -1)))
+            resto = soma * 10 % 11
+            digitos.append(0 if resto == 10 else resto)
+        texto = ''.join(map(str, digitos))
+        return f'{texto[:3]}.{texto[3:6]}.{texto[6:9]}-{texto[9:]}'
+
+    def gerar_em_escala(self, total: int, semente: int, lote: int, auditor, data_referencia: date = None):
+        """
+        Gera `total` internações (com ~2/3 disso em pacientes, itens de conta
+        e auditorias) em transações de `lote` internações usando bulk_create.
+        Datas relativas à meia-noite de `data_referencia` (padrão: hoje); com a
+        mesma semente e data, os mesmos dados. Só os CPFs dependem do banco:
+        seguem a numeração a partir dos pacientes existentes.
+        """
+        rng = random.Random(semente)
+        inicio = time.perf_counter()
+        hoje = timezone.make_aware(datetime.combine(data_referencia or timezone.localdate(), dt_time.min))
+
+        patologias = list(Patologia.objects.order_by('id'))
+        procedimentos = {p.codigo: p for p in Procedimento.objects.order_by('id')}
+        lista_procedimentos = list(procedimentos.values())
+        padroes = {}
+        for padrao in ProcedimentoPadrao.objects.select_related('procedimento').order_by('id'):
+            padroes.setdefault(padrao.patologia_id, []).append(padrao)
+        setores = [codigo for codigo, _ in Paciente.SETOR_CHOICES]
+
+        # Pacientes: CPFs sequenciais a partir dos já existentes
+        total_pacientes = max(1, total * 2 // 3)
+        deslocamento = Paciente.objects.count()
+        paciente_ids = []
+        for inicio_lote in range(0, total_pacientes, lote):
+            pacientes = [
+                Paciente(
+                    nome=f'{rng.choice(PRIMEIROS_NOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)}',
+                    cpf=self._cpf(100_000_000 + deslocamento + i),
+                    data_nascimento=date(1930, 1, 1) + timedelta(days=rng.randrange(0, 33000)),
+                    setor_atual=rng.choice(setores),
+                )
+                for i in range(inicio_lote, min(inicio_lote + lote, total_pacientes))
+            ]
+            with transaction.atomic():
+                paciente_ids.extend(p.id for p in Paciente.objects.bulk_create(pacientes))
+        self.stdout.write(f'✓ {len(paciente_ids)} pacientes')
+
+        totais = {'internacoes': 0, 'itens': 0, 'auditorias': 0}
+        for inicio_lote in range(0, total, lote):
+            tamanho = min(lote, total - inicio_lote)
+            with transaction.atomic():
+                self._gerar_lote(rng, tamanho, hoje, paciente_ids, patologias, padroes,
+                                 procedimentos, lista_procedimentos, setores, auditor, totais)
+            self.stdout.write(f'   {totais["internacoes"]}/{total} internações '
+                              f'({time.perf_counter() - inicio:.1f}s)')
+
+        # bulk_create não dispara signals: índice de busca, censo e cache
+        self.stdout.write('Atualizando índice de busca, censo e cache...')
+        reconstruir_indice()
+        recalcular_censo()
+        cache_consultas.invalidar()
+
+        tempo = time.perf_counter() - inicio
+        self.stdout.write(self.style.SUCCESS(
+            f'✅ Escala: {totais["internacoes"]} internações, {totais["itens"]} itens, '
+            f'{totais["auditorias"]} auditorias em {tempo:.1f}s (semente {semente})'
+        ))
+
+    def _gerar_lote(self, rng, tamanho, hoje, paciente_ids, patologias, padroes,
+                    procedimentos, lista_procedimentos, setores, auditor, totais):
+        internacoes = []
+        for _ in range(tamanho):
+            patologia = rng.choice(patologias)
+            entrada = hoje - timedelta(days=rng.uniform(0, 90))
+            # Permanência em torno do tempo ideal, com cauda longa
+            permanencia = timedelta(days=max(0.5, rng.lognormvariate(0, 0.4) * patologia.tempo_internacao_ideal))
+            saida = entrada + permanencia
+            ativa = saida > hoje
+            # Ativa: alerta pelo tempo já decorrido, não pela permanência projetada
+            dias_internado = (hoje - entrada).days if ativa else permanencia.days
+            internacoes.append(Internacao(
+                paciente_id=rng.choice(paciente_ids),
+                patologia=patologia,
+                data_entrada=entrada,
+                data_saida=None if ativa else saida,
+                status='ATIVA' if ativa else 'ALTA',
+                setor=rng.choice(setores),
+                alerta_tempo=dias_internado > patologia.tempo_internacao_ideal,
+            ))
+        Internacao.objects.bulk_create(internacoes)
+
+        itens = []
+        auditorias = []
+        for internacao in internacoes:
+            itens_conta = []
+            dias = max(1, ((internacao.data_saida or hoje) - internacao.data_entrada).days)
+            lancamentos = [(procedimentos[DIARIA_POR_SETOR[internacao.setor]], dias)]
+            for padrao in padroes.get(internacao.patologia_id, []):
+                # Obrigatórios quase sempre; ~10% acima da quantidade máxima
+                if (padrao.obrigatorio and rng.random() < 0.95) or rng.random() < 0.5:
+                    quantidade = rng.randint(1, padrao.quantidade_maxima)
+                    if rng.random() < 0.1:
+                        quantidade += rng.randint(1, 3)
+                    lancamentos.append((padrao.procedimento, quantidade))
+            if rng.random() < 0.15:
+                lancamentos.append((rng.choice(lista_procedimentos), 1))
+
+            for procedimento, quantidade in lancamentos:
+                valor = procedimento.valor_padrao
+                if rng.random() < 0.05:
+                    valor = (valor * Decimal(rng.uniform(0.8, 1.3))).quantize(Decimal('0.01'))
+                status = 'PENDENTE'
+                if internacao.status == 'ALTA':
+                    status = rng.choices(['PENDENTE', 'APROVADO', 'GLOSADO'], weights=[6, 3, 1])[0]
+                itens_conta.append(ItemConta(
+                    internacao=internacao,
+                    procedimento=procedimento,
+                    quantidade=quantidade,
+                    valor_unitario=valor,
+                    # bulk_create não chama save(): valor_total calculado aqui
+                    valor_total=valor * quantidade,
+                    data_lancamento=internacao.data_entrada + timedelta(hours=rng.uniform(0, 24 * dias)),
+                    status=status,
+                    justificativa='Glosa sintética' if status == 'GLOSADO' else '',
+                ))
+            itens.extend(itens_conta)
+
+            if internacao.status == 'ALTA' and rng.random() < 0.3:
+                glosados = [item for item in itens_conta if item.status == 'GLOSADO']
+                auditorias.append(Auditoria(
+                    internacao=internacao,
+                    tipo='RETROSPECTIVA',
+                    auditor=auditor,
+                    data_auditoria=min(hoje, internacao.data_saida + timedelta(days=rng.uniform(0, 10))),
+                    observacoes=rng.choice(OBSERVACOES_AUDITORIA),
+                    itens_glosados=len(glosados),
+                    valor_glosado=sum((item.valor_total for item in glosados), Decimal('0.00')),
+                ))
+
+        ItemConta.objects.bulk_create(itens, batch_size=2000)
+        Auditoria.objects.bulk_create(auditorias, batch_size=2000)
+        totais['internacoes'] += len(internacoes)
+        totais['itens'] += len(itens)
+        totais['auditorias'] += len(auditorias)
@@ -0,0 +1,236 @@
+"""
+Benchmarks offline do pipeline de análise (sem chamadas reais ao Gemini)
+
+Uso:
+    python benchmark.py lote --linhas 200 --workers 1 8 16 --latencia 0.2
+    python benchmark.py lote --linhas 200 --workers 4 --pacote 6
+    python benchmark.py lote --workers 8 --sigma 0.4 --taxa-429 0.05 --taxa-500 0.01 --http
+    python benchmark.py recursos
+    python benchmark.py kb --linhas 1000000
+    python benchmark.py parser --repeticoes 2000
+"""
+import argparse
+import contextlib
+import json
+import time
+from pathlib import Path
+from unittest.mock import patch
+
+import pandas as pd
+
+from src.batch_processor import BatchProcessor, DTYPES_DATASET
+from src.gemini_simulado import ClienteGeminiHTTP, ConfiguracaoSimulacao, ModeloGeminiSimulado, ServidorGeminiSimulado
+from src.rate_limiter import RateLimiter
+
+ARQUIVO_DATASET = Path("./data/dataset_internacoes.csv")
+ARQUIVO_RESULTADOS = Path("./resultados_analise.csv")
+
+
+def benchmark_lote(args):
+    df = pd.read_csv(ARQUIVO_DATASET).head(args.linhas)
+
+    # RAG desligado: o objetivo é medir a espera de rede do Gemini
+    with patch("src.services.RAGSystem") as MockRAG:
+        MockRAG.return_value.buscar_contexto_relevante.return_value = {
+            "vector_store": [], "knowledge_base": {}, "dados_internacao": {}
+        }
+        MockRAG.return_value.buscar_contexto_lote.side_effect = lambda lista: [
+            {"vector_store": [], "knowledge_base": {}, "dados_internacao": dados} for dados in lista
+        ]
+        # Gemini simulado: em processo ou atrás do servidor HTTP local
+        modelo = ModeloGeminiSimulado(ConfiguracaoSimulacao(
+            latencia_mediana=args.latencia, latencia_sigma=args.sigma, latencia_por_token=args.latencia_por_token,
+            taxa_429=args.taxa_429, taxa_500=args.taxa_500, taxa_truncamento=args.truncamento,
+            requisicoes_por_janela=args.cota_rpm, semente=args.semente,
+        ))
+        servidor = ServidorGeminiSimulado(modelo).iniciar() if args.http else None
+        backend = ClienteGeminiHTTP(servidor.url) if servidor else modelo
+        processor = BatchProcessor()
+        gemini = processor.llm_service.gemini
+        backend.configurar_geracao(gemini.configuracao_geracao)
+        gemini.model = backend
+        gemini.rate_limiter = RateLimiter(
+            requisicoes_por_minuto=args.rpm, max_concorrencia=max(args.workers), backoff_base=args.backoff
+        )
+
+        linhas_resultado = []
+        with servidor or contextlib.nullcontext():
+            for workers in args.workers:
+                antes = modelo.estatisticas()
+                processor.analisar_lote(df, limite=None, max_workers=workers, tamanho_pacote=args.pacote)
+                depois = modelo.estatisticas()
+                linhas_resultado.append((processor.metricas_execucao,
+                                         {chave: depois[chave] - antes[chave] for chave in depois}))
+
+    print(f"\nRESULTADO DO BENCHMARK (lote{', via HTTP' if args.http else ''})")
+    print(f"{'workers':>8} {'pacote':>7} {'linhas':>8} {'chamadas':>9} {'429':>5} {'500':>5} {'trunc.':>7} "
+          f"{'tokens prompt':>14} {'tempo (s)':>10} {'linhas/s':>10}")
+    for metricas, simulado in linhas_resultado:
+        print(f"{metricas['max_workers']:>8} {metricas['pacotes']['tamanho_pacote']:>7} {metricas['linhas']:>8} "
+              f"{simulado['chamadas']:>9} {simulado['erros_429']:>5} {simulado['erros_500']:>5} {simulado['truncadas']:>7} "
+              f"{simulado['tokens_prompt']:>14} {metricas['tempo_total']:>10} {metricas['linhas_por_segundo']:>10}")
+
+
+def benchmark_recursos(args):
+    from src.rag import RAGSystem, aquecer_recursos
+    from src.recursos import registro_recursos
+
+    inicio = time.perf_counter()
+    etapas = aquecer_recursos(args.persist_directory, carregar_embeddings=not args.sem_embeddings)
+    tempo_frio = time.perf_counter() - inicio
+
+    tempos_quentes = []
+    for _ in range(args.repeticoes):
+        inicio = time.perf_counter()
+        rag = RAGSystem(args.persist_directory)
+        if not args.sem_embeddings:
+            rag.model
+        tempos_quentes.append(time.perf_counter() - inicio)
+    tempo_quente = sum(tempos_quentes) / len(tempos_quentes)
+
+    print("\nRESULTADO DO BENCHMARK (recursos)")
+    for etapa, tempo in etapas.items():
+        print(f"   {etapa:<22} {tempo:8.3f}s")
+    print(f"   {'cold start':<22} {tempo_frio:8.3f}s")
+    print(f"   {'warm start (média)':<22} {tempo_quente:8.4f}s  ({args.repeticoes} repetições)")
+    print(f"   Recursos no registro: {len(registro_recursos.tempos_carga)}")
+
+
+def benchmark_kb(args):
+    from src.knowledge_base import medical_kb
+
+    base = pd.read_csv(ARQUIVO_DATASET, dtype=DTYPES_DATASET)
+    df = base.sample(args.linhas, replace=True, random_state=42).reset_index(drop=True)
+    processor = BatchProcessor.__new__(BatchProcessor)  # só para preparar_dados_internacao
+
+    inicio = time.perf_counter()
+    medical_kb.assess_discharge_readiness_df(df)
+    tempo_colunar = time.perf_counter() - inicio
+
+    amostra = df.head(args.amostra_escalar)
+    inicio = time.perf_counter()
+    for _, linha in amostra.iterrows():
+        medical_kb.assess_discharge_readiness(processor.preparar_dados_internacao(linha))
+    tempo_escalar = (time.perf_counter() - inicio) * len(df) / max(len(amostra), 1)
+
+    print("\nRESULTADO DO BENCHMARK (kb)")
+    print(f"   Linhas: {len(df)}")
+    print(f"   Colunar (assess_discharge_readiness_df): {tempo_colunar:8.2f}s")
+    print(f"   Escalar por linha (estimado de {len(amostra)}): {tempo_escalar:8.2f}s")
+    print(f"   Ganho: {tempo_escalar / max(tempo_colunar, 1e-9):.0f}x")
+
+
+def corpus_respostas(arquivo=None):
+    """
+    Respostas gravadas: um JSON string por linha em `arquivo` ou, por padrão,
+    as análises de resultados_analise.csv remontadas nos formatos que o
+    Gemini devolve (plano, indentado, markdown e JSON)
+    """
+    if arquivo:
+        with open(arquivo, encoding="utf-8") as f:
+            return [json.loads(linha) for linha in f if linha.strip()]
+
+    recomendacoes = {"ALTA": "ALTA_PRIORIDADE_ALTA", "MEDIA": "ALTA_PRIORIDADE_MEDIA",
+                     "BAIXA": "ALTA_PRIORIDADE_BAIXA", "MANTER": "MANTER_INTERNACAO"}
+    corpus = []
+    for _, linha in pd.read_csv(ARQUIVO_RESULTADOS).fillna("").iterrows():
+        razoes = [r.strip() for r in str(linha["razoes_alta_gemini"]).split(";") if r.strip()]
+        pendencias = [p.strip() for p in str(linha["pendencias_gemini"]).split(";") if p.strip()]
+        recomendacao = recomendacoes.get(linha["prioridade_gemini"], "ALTA_PRIORIDADE_MEDIA")
+        campos = [
+            ("ANALISE_INICIAL", [linha["analise_inicial_gemini"]]),
+            ("RAZÕES_ALTA", razoes),
+            ("PENDENCIAS", pendencias),
+            ("RECOMENDACAO", [recomendacao]),
+            ("FONTES", [linha["fontes_gemini"]]),
+            ("CONFIANCA", [str(linha["confianca_gemini"])]),
+        ]
+        corpus.append("\n".join(f"{chave}: " + "\n".join(valores) for chave, valores in campos))
+        corpus.append("\n".join(f"        {chave}: " + ", ".join(valores) for chave, valores in campos))
+        corpus.append("\n\n".join(
+            f"**{chave.title()}:**\n" + "\n".join(f"* {v}" for v in valores) for chave, valores in campos
+        ))
+        corpus.append("```json\n" + json.dumps({
+            "analise_inicial": linha["analise_inicial_gemini"], "razoes_alta": razoes,
+            "pendencias": pendencias, "recomendacao": recomendacao,
+            "fontes_informacao": [linha["fontes_gemini"]], "confianca": float(linha["confianca_gemini"] or 0.75),
+        }, ensure_ascii=False) + "\n```")
+    return corpus
+
+
+def benchmark_parser(args):
+    from src.parser_respostas import parser_respostas
+
+    corpus = corpus_respostas(args.arquivo)
+    for resposta in corpus:  # aquecimento
+        parser_respostas.parse(resposta)
+
+    inicio = time.perf_counter()
+    for _ in range(args.repeticoes):
+        for resposta in corpus:
+            parser_respostas.parse(resposta)
+    tempo = time.perf_counter() - inicio
+    total = args.repeticoes * len(corpus)
+
+    # Modo JSON (response_schema): objeto puro, sem cerca de código
+    respostas_json = [r.strip("`\n").removeprefix("json").strip() for r in corpus if "{" in r]
+    inicio = time.perf_counter()
+    for _ in range(args.repeticoes):
+        for resposta in respostas_json:
+            parser_respostas.parse_json(resposta)
+    tempo_json = time.perf_counter() - inicio
+    total_json = max(args.repeticoes * len(respostas_json), 1)
+
+    print("\nRESULTADO DO BENCHMARK (parser)")
+    print(f"   Respostas no corpus: {len(corpus)}")
+    print(f"   Parses: {total} em {tempo:.3f}s")
+    print(f"   Custo por resposta: {tempo / total * 1e6:.1f} µs")
+    print(f"   Modo JSON (parse_json, {len(respostas_json)} respostas): {tempo_json / total_json * 1e6:.1f} µs")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks offline do llm_service")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    parser_lote = subparsers.add_parser("lote", help="Vazão do BatchProcessor com Gemini simulado")
+    parser_lote.add_argument("--linhas", type=int, default=100)
+    parser_lote.add_argument("--workers", type=int, nargs="+", default=[1, 8])
+    parser_lote.add_argument("--latencia", type=float, default=0.2, help="Mediana da latência simulada por chamada (s)")
+    parser_lote.add_argument("--sigma", type=float, default=0.0, help="Desvio do log da latência (0 = fixa)")
+    parser_lote.add_argument("--rpm", type=float, default=1_000_000, help="Orçamento de requisições/min do limitador")
+    parser_lote.add_argument("--pacote", type=int, default=1, help="Casos por prompt agrupado")
+    parser_lote.add_argument("--latencia-por-token", type=float, default=0.00025,
+                             help="Latência por token de saída (s)")
+    parser_lote.add_argument("--taxa-429", type=float, default=0.0)
+    parser_lote.add_argument("--taxa-500", type=float, default=0.0)
+    parser_lote.add_argument("--truncamento", type=float, default=0.0, help="Fração de respostas truncadas")
+    parser_lote.add_argument("--cota-rpm", type=int, default=0, help="Cota simulada de requisições/min (0 = sem cota)")
+    parser_lote.add_argument("--backoff", type=float, default=1.0, help="Backoff base do limitador (s)")
+    parser_lote.add_argument("--semente", type=int, default=42)
+    parser_lote.add_argument("--http", action="store_true", help="Passa pelo servidor HTTP simulado")
+    parser_lote.set_defaults(funcao=benchmark_lote)
+
+    parser_recursos = subparsers.add_parser("recursos", help="Cold start vs warm start do RAGSystem")
+    parser_recursos.add_argument("--persist-directory", default="./chroma_db")
+    parser_recursos.add_argument("--repeticoes", type=int, default=5)
+    parser_recursos.add_argument("--sem-embeddings", action="store_true",
+                                 help="Não carrega o SentenceTransformer")
+    parser_recursos.set_defaults(funcao=benchmark_recursos)
+
+    parser_kb = subparsers.add_parser("kb", help="Score da knowledge base: colunar vs linha a linha")
+    parser_kb.add_argument("--linhas", type=int, default=1_000_000)
+    parser_kb.add_argument("--amostra-escalar", type=int, default=20_000,
+                           help="Linhas medidas no caminho escalar (tempo extrapolado)")
+    parser_kb.set_defaults(funcao=benchmark_kb)
+
+    parser_parser = subparsers.add_parser("parser", help="Custo do parse das respostas do Gemini")
+    parser_parser.add_argument("--arquivo", help="Respostas gravadas (um JSON string por linha)")
+    parser_parser.add_argument("--repeticoes", type=int, default=2000)
+    parser_parser.set_defaults(funcao=benchmark_parser)
+
+    args = parser.parse_args()
+    args.funcao(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,12 @@ import os
 import time
 from dotenv import load_dotenv
 from pathlib import Path
-from src.batch_processor import BatchProcessor
+from src.batch_processor import BatchProcessor, ConfiguracaoTriagem, DTYPES_DATASET
+from src.cache_analises import CacheAnalises
+from src.rag import aquecer_recursos
+
+# Linhas lidas do CSV para prévia/análise (o slider nunca pede mais que isso)
+MAX_ANALISE = 50
 
 # Configuração da Página
 st.set_page_config(page_title="Auditoria Hospitalar IA", page_icon="🏥", layout="wide")
@@ -30,7 +35,10 @@ with st.sidebar:
         api_key = st.text_input("Insira sua Gemini API Key", type="password")
 
     st.markdown("---")
-    qtd_analise = st.slider("Quantidade de internações para analisar", 1, 50, 5)
+    qtd_analise = st.slider("Quantidade de internações para analisar", 1, MAX_ANALISE, 5)
+    max_workers = st.slider("Chamadas simultâneas ao Gemini", 1, 16, 4)
+    ignorar_cache = st.checkbox("Ignorar cache de análises (forçar nova consulta)")
+    usar_triagem = st.checkbox("Triagem pela knowledge base (casos claros sem IA)")
 
     modo_debug = st.checkbox("Modo Debug (Logs)")
 
@@ -41,7 +49,36 @@ def carregar_dados():
     caminho = Path("./data/dataset_internacoes.csv")
     if not caminho.exists():
         return None
-    return pd.read_csv(caminho)
+    # Só as primeiras linhas: o export mensal pode ter vários GB
+    return pd.read_csv(caminho, nrows=MAX_ANALISE, dtype=DTYPES_DATASET)
+
+
+@st.cache_data
+def contar_registros():
+    """Conta as linhas do CSV sem montar DataFrame (leitura em blocos de 1 MB)"""
+    caminho = Path("./data/dataset_internacoes.csv")
+    with open(caminho, "rb") as arquivo:
+        linhas = sum(bloco.count(b"\n") for bloco in iter(lambda: arquivo.read(1 << 20), b""))
+    return max(0, linhas - 1)  # sem o cabeçalho
+
+
+# Cache de respostas compartilhado entre execuções do Streamlit
+@st.cache_resource
+def obter_cache_analises():
+    return CacheAnalises("./cache/analises_llm.sqlite3")
+
+
+# Carrega Chroma/embeddings uma vez por processo, antes do primeiro clique
+@st.cache_resource(show_spinner="Carregando base de conhecimento...")
+def aquecer_rag():
+    try:
+        return aquecer_recursos()
+    except Exception as e:
+        st.warning(f"Pré-carregamento do RAG falhou, será feito na primeira análise: {e}")
+        return {}
+
+
+aquecer_rag()
 
 
 # Área Principal
@@ -53,7 +90,7 @@ with col1:
 
     if df is not None:
         st.dataframe(df.head(), use_container_width=True)
-        st.caption(f"Total de registros disponíveis: {len(df)}")
+        st.caption(f"Total de registros disponíveis: {contar_registros()}")
     else:
         st.warning("Arquivo 'data/dataset_internacoes.csv' não encontrado.")
 
@@ -69,7 +106,11 @@ with col2:
         else:
             # Processamento
             try:
-                processor = BatchProcessor(api_key)
+                cache = obter_cache_analises()
+                cache.bypass = ignorar_cache
+                processor = BatchProcessor(
+                    api_key, cache=cache, triagem=ConfiguracaoTriagem(ativa=usar_triagem)
+                )
 
                 with st.status("Processando internações...", expanded=True) as status:
                     st.write("🧠 Inicializando Gemini...")
@@ -79,7 +120,9 @@ with col2:
                     st.write(f"📂 Carregando lote de {qtd_analise} registros...")
 
                     # Chama sua classe existente
-                    resultados = processor.analisar_lote(df, limite=qtd_analise)
+                    resultados = processor.analisar_lote(
+                        df, limite=qtd_analise, max_workers=max_workers
+                    )
 
                     status.update(
                         label="Análise Concluída!", state="complete", expanded=False
@@ -87,6 +130,7 @@ with col2:
 
                 # Salvar no session state para não perder ao recarregar
                 st.session_state["resultados"] = resultados
+                st.session_state["triagem"] = processor.metricas_execucao.get("triagem", {})
                 st.rerun()
 
             except Exception as e:
@@ -113,6 +157,13 @@ if "resultados" in st.session_state:
     taxa = (concordancia / len(res)) * 100 if len(res) > 0 else 0
     m4.metric("Concordância (IA x Protocolo)", f"{taxa:.1f}%")
 
+    triagem = st.session_state.get("triagem", {})
+    if triagem.get("chamadas_evitadas"):
+        st.caption(
+            f"Triagem KB: {triagem['chamadas_evitadas']} chamadas à IA evitadas "
+            f"(~{triagem['tempo_economizado_estimado']}s economizados)"
+        )
+
     # Tabela detalhada
     st.subheader("Detalhamento dos Casos")
 
@@ -2,13 +2,36 @@
 Executor do Batch Processor - CHAMA a classe para rodar
 """
 
+import argparse
 import os
 from dotenv import load_dotenv
-from src.batch_processor import BatchProcessor
+from src.batch_processor import BatchProcessor, ConfiguracaoTriagem
+from src.cache_analises import CacheAnalises
+from src.diario_execucao import DiarioExecucao
 from pathlib import Path
 
+# Chamadas simultâneas ao Gemini (1 = sequencial)
+MAX_WORKERS = int(os.getenv("GEMINI_MAX_WORKERS", "4"))
+
+# GEMINI_CACHE_BYPASS=1 força nova consulta ao Gemini (respostas novas ainda são gravadas)
+CACHE_BYPASS = os.getenv("GEMINI_CACHE_BYPASS", "0") == "1"
+
+# GEMINI_PACOTE > 1 envia vários casos por prompt (limitado por max_output_tokens)
+TAMANHO_PACOTE = int(os.getenv("GEMINI_PACOTE", "1"))
+
+# BATCH_TAMANHO_BLOCO > 0 processa o arquivo inteiro em streaming, bloco a bloco
+TAMANHO_BLOCO = int(os.getenv("BATCH_TAMANHO_BLOCO", "0"))
+
+# Resultados concluídos por internacao_id (--retomar pula os já gravados)
+ARQUIVO_DIARIO = os.getenv("BATCH_DIARIO", "./cache/diario_execucao.sqlite3")
+
 
 def main():
+    parser = argparse.ArgumentParser(description="Análise em lote das internações com Gemini")
+    parser.add_argument("--retomar", action="store_true",
+                        help="continua a execução interrompida, pulando as internações já concluídas no diário")
+    args = parser.parse_args()
+
     print("INICIANDO PROCESSAMENTO EM LOTE")
     print("=" * 50)
 
@@ -16,18 +39,45 @@ def main():
     load_dotenv()
     api_key = os.getenv("GEMINI_API_KEY")
 
-    if not api_key:
+    # GEMINI_BACKEND (simulado ou URL do servidor simulado) dispensa a chave
+    if not api_key and not os.getenv("GEMINI_BACKEND"):
         print("ERRO: GEMINI_API_KEY não encontrada no .env")
         return
 
     # 1. Criar o processador
 
-    processor = BatchProcessor(api_key)
+    cache = CacheAnalises("./cache/analises_llm.sqlite3", bypass=CACHE_BYPASS)
+    diario = DiarioExecucao(ARQUIVO_DIARIO)
+    # TRIAGEM_KB=1 resolve casos claros pela knowledge base, sem chamar o Gemini
+    processor = BatchProcessor(api_key, cache=cache, triagem=ConfiguracaoTriagem.a_partir_do_ambiente(),
+                               diario=diario)
+
+    PASTA_DATASET = Path("./data")
+    ARQUIVO_DATASET = PASTA_DATASET / "dataset_internacoes.csv"
+
+    # O diário só é retomado se for do mesmo dataset (caminho e tamanho)
+    identificacao = f"{ARQUIVO_DATASET.resolve()}:{ARQUIVO_DATASET.stat().st_size if ARQUIVO_DATASET.exists() else 0}"
+    concluidas = diario.iniciar(identificacao, retomar=args.retomar)
+    if args.retomar:
+        print(f"Retomando: {concluidas} internações já concluídas em {ARQUIVO_DIARIO}")
+
+    if TAMANHO_BLOCO > 0:
+        # Modo streaming: resultados gravados a cada bloco, memória limitada ao bloco
+        resumo = processor.processar_arquivo_em_blocos(
+            str(ARQUIVO_DATASET), "resultados_analise.csv",
+            tamanho_bloco=TAMANHO_BLOCO, max_workers=MAX_WORKERS, tamanho_pacote=TAMANHO_PACOTE
+        )
+        print("\nRELATORIO FINAL (streaming):")
+        print(f"   Total processado: {resumo['processadas']}/{resumo['linhas']} em {resumo['blocos']} blocos "
+              f"({resumo['retomadas']} retomadas do diário)")
+        print(f"   Prioridades: {resumo['distribuicao_prioridades']}")
+        print(f"   Chamadas ao LLM evitadas pela triagem: {resumo['chamadas_evitadas']} "
+              f"(~{resumo['tempo_economizado_estimado']}s)")
+        print(f"   Tempo: {resumo['tempo_total']}s ({resumo['linhas_por_segundo']} linhas/s)")
+        return
 
     # 2. Carregar dataset
     try:
-        PASTA_DATASET = Path("./data")
-        ARQUIVO_DATASET = PASTA_DATASET / "dataset_internacoes.csv"
         df = processor.carregar_dataset(str(ARQUIVO_DATASET))
     except Exception as e:
         print(f"ERRO ao carregar dataset: {e}")
@@ -35,10 +85,11 @@ def main():
 
     # 3. Processar (ex: apenas 5 casos para teste)
     print(f"Processando {len(df)} internações...")
-    resultados = processor.analisar_lote(df, limite=5)
+    processor.analisar_lote(df, limite=5, max_workers=MAX_WORKERS, tamanho_pacote=TAMANHO_PACOTE)
 
-    # 4. Salvar resultados
-    processor.salvar_resultados(resultados, "resultados_analise.csv")
+    # 4. Salvar resultados (diário inteiro, inclusive os retomados; troca atômica do CSV)
+    processor.exportar_diario("resultados_analise.csv")
+    resultados = processor.resultados_diario()
 
     # 5. Gerar relatório
     relatorio = processor.gerar_relatorio_estatistico(resultados)
@@ -48,6 +99,9 @@ def main():
     print(f"   Confianca media: {relatorio.get('confianca_media', 0)}")
     print(f"   Casos alta prioridade: {relatorio.get('casos_alta_prioridade', 0)}")
     print(f"   Taxa concordancia: {relatorio.get('taxa_concordancia', 0)}%")
+    triagem = processor.metricas_execucao.get('triagem', {})
+    print(f"   Chamadas ao LLM evitadas pela triagem: {triagem.get('chamadas_evitadas', 0)} "
+          f"(~{triagem.get('tempo_economizado_estimado', 0)}s)")
 
 
 if __name__ == "__main__":
@@ -2,17 +2,100 @@
 Processador em lote para analisar múltiplas internações com Gemini
 """
 import pandas as pd
+import numpy as np  #type: ignore
 import json
 import logging
-from typing import List, Dict, Any
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Iterator, Optional
 from .services import LLMService
 from .knowledge_base import medical_kb
+from .cache_analises import CacheAnalises
+from .diario_execucao import DiarioExecucao, chave_internacao
+from .rate_limiter import erro_retentavel
 
 logger = logging.getLogger(__name__)
 
+COLUNAS_RESULTADO = [
+    'internacao_id', 'paciente_id', 'paciente_nome', 'patologia', 'idade',
+    'tempo_permanencia', 'tempo_ideal', 'setor', 'comorbidades',
+    'alerta_tempo_dataset', 'dias_excesso_dataset', 'score_prontidao_kb',
+    'nivel_prontidao_kb', 'fatores_kb', 'prioridade_gemini', 'razoes_alta_gemini',
+    'pendencias_gemini', 'fontes_gemini', 'confianca_gemini', 'analise_inicial_gemini',
+    'documentos_contexto', 'origem_analise'
+]
+
+# Origem do resultado de cada linha
+ORIGEM_LLM = 'LLM'
+ORIGEM_REGRA_KB = 'REGRA_KB'
+ORIGEM_FALLBACK = 'FALLBACK'
+
+# Internações por bloco na pré-busca de contexto do RAG
+TAMANHO_BLOCO_CONTEXTO = 64
+
+# Tipos explícitos na leitura em blocos: categorias para colunas repetitivas e
+# inteiros de 32 bits (anuláveis, para uma linha vazia não derrubar o bloco)
+DTYPES_DATASET = {
+    'patologia': 'category',
+    'setor': 'category',
+    'status': 'category',
+    'idade': 'Int32',
+    'tempo_ideal_patologia': 'Int32',
+    'tempo_permanencia': 'Int32',
+    'dias_excesso': 'Int32',
+}
+
+class ConfiguracaoTriagem:
+    """
+    Triagem pela knowledge base antes do Gemini: casos claros recebem resultado
+    por regra e só a faixa incerta de score vai para o LLM.
+    """
+    
+    def __init__(self, ativa: bool = True, score_alto: int = 80, score_baixo: int = 30,
+                 margem_conformidade: int = 2):
+        self.ativa = ativa
+        # Score >= score_alto só é possível dentro do limite do pagador
+        self.score_alto = score_alto
+        self.score_baixo = score_baixo
+        # "Manter" por regra só se faltarem ao menos N dias para estourar o limite
+        self.margem_conformidade = margem_conformidade
+    
+    @classmethod
+    def a_partir_do_ambiente(cls) -> 'ConfiguracaoTriagem':
+        """TRIAGEM_KB=1 ativa; limites opcionais TRIAGEM_SCORE_ALTO/BAIXO e TRIAGEM_MARGEM"""
+        return cls(
+            ativa=os.getenv('TRIAGEM_KB', '0') == '1',
+            score_alto=int(os.getenv('TRIAGEM_SCORE_ALTO', '80')),
+            score_baixo=int(os.getenv('TRIAGEM_SCORE_BAIXO', '30')),
+            margem_conformidade=int(os.getenv('TRIAGEM_MARGEM', '2')),
+        )
+    
+    def classificar(self, df: pd.DataFrame) -> List[Optional[str]]:
+        """Prioridade por regra para cada linha ('ALTA' ou 'MANTER') ou None para ir ao LLM"""
+        if not self.ativa or len(df) == 0:
+            return [None] * len(df)
+        
+        kb = medical_kb.assess_discharge_readiness_df(df)
+        tempo_permanencia = df['tempo_permanencia'] if 'tempo_permanencia' in df.columns else pd.Series(0, index=df.index)
+        tempo_permanencia = pd.to_numeric(tempo_permanencia, errors='coerce').fillna(0).to_numpy()
+        folga = kb['max_allowed_stay'].to_numpy() - tempo_permanencia
+        
+        alta = (kb['readiness_score'].to_numpy() >= self.score_alto) & kb['is_compliant'].to_numpy()
+        manter = (kb['readiness_score'].to_numpy() <= self.score_baixo) & (folga >= self.margem_conformidade)
+        return np.select([alta, manter], ['ALTA', 'MANTER'], default=None).tolist()
+
+
 class BatchProcessor:
-    def __init__(self, api_key: str = None):
-        self.llm_service = LLMService(api_key)
+    def __init__(self, api_key: str = None, cache: Optional[CacheAnalises] = None,
+                 triagem: Optional[ConfiguracaoTriagem] = None,
+                 diario: Optional[DiarioExecucao] = None):
+        self.llm_service = LLMService(api_key, cache=cache)
+        self.triagem = triagem or ConfiguracaoTriagem(ativa=False)
+        # Com diário, cada resultado é gravado ao sair e as internações já concluídas são puladas
+        self.diario = diario
+        self.metricas_execucao: Dict[str, Any] = {}
+        self._tempos_llm: List[float] = []
     
     def carregar_dataset(self, arquivo_csv: str) -> pd.DataFrame:
         """Carrega dataset de internações"""
@@ -24,6 +107,63 @@ class BatchProcessor:
             logger.error(f"Erro ao carregar dataset: {e}")
             raise
     
+    def carregar_dataset_em_blocos(self, arquivo_csv: str, tamanho_bloco: int = 10000) -> Iterator[pd.DataFrame]:
+        """Lê o dataset em blocos de `tamanho_bloco` linhas, sem carregar o arquivo inteiro"""
+        leitor = pd.read_csv(arquivo_csv, dtype=DTYPES_DATASET, chunksize=tamanho_bloco)
+        with leitor:
+            for bloco in leitor:
+                yield bloco
+    
+    def processar_arquivo_em_blocos(self, arquivo_csv: str, arquivo_saida: str,
+                                    tamanho_bloco: int = 1000, limite: Optional[int] = None,
+                                    max_workers: int = 1, tamanho_pacote: int = 1) -> Dict[str, Any]:
+        """
+        Modo streaming: cada bloco do CSV passa por preparação, KB e Gemini e os
+        resultados são anexados ao arquivo de saída. Só um bloco fica em memória,
+        então o uso de memória não cresce com o tamanho do arquivo.
+
+        Com diário, os resultados vão para o diário e o arquivo de saída só é
+        gerado ao final, de uma vez (exportar_diario), com as linhas retomadas.
+        """
+        inicio = time.perf_counter()
+        resumo = {'linhas': 0, 'processadas': 0, 'retomadas': 0, 'blocos': 0, 'distribuicao_prioridades': {},
+                  'chamadas_llm': 0, 'chamadas_evitadas': 0, 'tempo_economizado_estimado': 0.0}
+        
+        for bloco in self.carregar_dataset_em_blocos(arquivo_csv, tamanho_bloco):
+            if limite is not None:
+                restante = limite - resumo['linhas']
+                if restante <= 0:
+                    break
+                bloco = bloco.head(restante)
+            
+            df_resultados = self.analisar_lote(bloco, limite=None, max_workers=max_workers,
+                                               tamanho_pacote=tamanho_pacote)
+            if self.diario is None:
+                self.salvar_resultados(df_resultados, arquivo_saida, anexar=resumo['blocos'] > 0)
+            
+            resumo['linhas'] += len(bloco)
+            resumo['processadas'] += len(df_resultados)
+            resumo['retomadas'] += self.metricas_execucao['retomadas']
+            resumo['blocos'] += 1
+            triagem = self.metricas_execucao['triagem']
+            for chave in ('chamadas_llm', 'chamadas_evitadas', 'tempo_economizado_estimado'):
+                resumo[chave] += triagem[chave]
+            for prioridade, quantidade in df_resultados['prioridade_gemini'].value_counts().items():
+                resumo['distribuicao_prioridades'][prioridade] = resumo['distribuicao_prioridades'].get(prioridade, 0) + int(quantidade)
+            
+            destino = 'no diário' if self.diario is not None else f"em {arquivo_saida}"
+            print(f"Bloco {resumo['blocos']}: {resumo['processadas']}/{resumo['linhas']} internações gravadas {destino}")
+        
+        if self.diario is not None:
+            self.exportar_diario(arquivo_saida)
+        
+        tempo_total = time.perf_counter() - inicio
+        resumo['tempo_total'] = round(tempo_total, 3)
+        resumo['tempo_economizado_estimado'] = round(resumo['tempo_economizado_estimado'], 3)
+        resumo['linhas_por_segundo'] = round(resumo['linhas'] / tempo_total, 2) if tempo_total > 0 else 0.0
+        logger.info(f"Streaming concluído: {resumo}")
+        return resumo
+    
     def preparar_dados_internacao(self, linha: pd.Series) -> Dict[str, Any]:
         """Prepara dados de uma internação para análise do LLM"""
         return {
@@ -53,99 +193,312 @@ class BatchProcessor:
         except:
             return []
     
-    def analisar_lote(self, df: pd.DataFrame, limite: int = 10) -> pd.DataFrame:
+    def analisar_lote(self, df: pd.DataFrame, limite: int = 10, max_workers: int = 1,
+                      tamanho_pacote: int = 1) -> pd.DataFrame:
         """
         Analisa um lote de internações com Gemini 
+
+        Com max_workers > 1 as chamadas ao Gemini são feitas em paralelo por um
+        pool de threads limitado, mantendo a ordem original das linhas.
+        Com a triagem ativa, os casos claros pela knowledge base não vão ao Gemini.
+        Com tamanho_pacote > 1 cada chamada leva vários casos em um só prompt
+        (limitado pelo orçamento de max_output_tokens); casos sem resposta
+        válida no pacote são reenviados individualmente, exceto quando o
+        pacote falhou por cota/indisponibilidade (ficam como FALLBACK).
+        Com diário, as internações já concluídas são puladas e o DataFrame
+        retornado traz só as processadas nesta chamada.
         """
         if limite:
             df = df.head(limite)
         
-        resultados = []
+        retomadas = 0
+        if self.diario is not None and len(df) and 'internacao_id' in df.columns:
+            # Só os IDs deste lote/bloco: o custo não cresce com o diário
+            concluidos = self.diario.concluidos(df['internacao_id'])
+            if concluidos:
+                pular = df['internacao_id'].map(lambda valor: chave_internacao(valor) in concluidos).to_numpy(dtype=bool)
+                retomadas = int(pular.sum())
+                df = df[~pular]
+                print(f"Retomada: {retomadas} internações já concluídas no diário")
         
-        print(f"\nANALISANDO {len(df)} INTERNAÇÕES COM GEMINI...")
+        total = len(df)
+        max_workers = max(1, int(max_workers or 1))
+        
+        print(f"\nANALISANDO {total} INTERNAÇÕES COM GEMINI...")
         print("=" * 60)
         
-        for idx, linha in df.iterrows():
-            try:
-                print(f"\nProcessando {idx+1}/{len(df)}: {linha.get('paciente_nome', 'N/A')} - {linha.get('patologia', 'N/A')}")
-                
-                # Preparar dados
-                dados_internacao = self.preparar_dados_internacao(linha)
-                
-                # Análise da Knowledge Base
-                analise_kb = medical_kb.assess_discharge_readiness(dados_internacao)
+        inicio = time.perf_counter()
+        self._tempos_llm = []
+        pacote = self.llm_service.gemini.tamanho_pacote(tamanho_pacote) if tamanho_pacote > 1 else 1
+        self._metricas_pacotes = {'tamanho_pacote': pacote, 'pacotes': 0, 'casos_agrupados': 0,
+                                  'casos_reenviados': 0, 'casos_fallback': 0}
+        decisoes = self.triagem.classificar(df)
+        linhas = [(posicao, idx, linha) for posicao, (idx, linha) in enumerate(df.iterrows())]
+        processados = []
+        
+        # executor.map devolve os resultados na ordem de submissão
+        executor = ThreadPoolExecutor(max_workers=max_workers) if max_workers > 1 else None
+        try:
+            for inicio_bloco in range(0, total, TAMANHO_BLOCO_CONTEXTO):
+                bloco = linhas[inicio_bloco:inicio_bloco + TAMANHO_BLOCO_CONTEXTO]
+                regras = decisoes[inicio_bloco:inicio_bloco + TAMANHO_BLOCO_CONTEXTO]
+                # Contexto do bloco inteiro em uma consulta, antes das chamadas ao Gemini
+                # (só para as linhas que a triagem mandou ao LLM)
+                para_llm = [item for item, regra in zip(bloco, regras) if regra is None]
+                contextos = self._prebuscar_contextos(para_llm)
+                if pacote > 1:
+                    recomendacoes = self._analisar_pacotes(para_llm, contextos, pacote, executor)
+                else:
+                    recomendacoes = [None] * len(para_llm)
+                pendentes = iter(zip(contextos, recomendacoes))
+                tarefas = [
+                    (*item, total, *((None, None) if regra else next(pendentes)), regra)
+                    for item, regra in zip(bloco, regras)
+                ]
                 
+                if executor is None:
+                    resultados_bloco = [self._processar_linha(*tarefa) for tarefa in tarefas]
+                else:
+                    resultados_bloco = list(executor.map(lambda tarefa: self._processar_linha(*tarefa), tarefas))
+                processados.extend(resultados_bloco)
+                if self.diario is not None:
+                    # Uma transação por bloco: uma interrupção perde no máximo o bloco em curso
+                    self.diario.registrar(resultado for resultado in resultados_bloco if resultado is not None)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        
+        resultados = [resultado for resultado in processados if resultado is not None]
+        tempo_total = time.perf_counter() - inicio
+        
+        self.metricas_execucao = {
+            'linhas': total,
+            'processadas': len(resultados),
+            'retomadas': retomadas,
+            'max_workers': max_workers,
+            'tempo_total': round(tempo_total, 3),
+            'linhas_por_segundo': round(total / tempo_total, 2) if tempo_total > 0 else 0.0,
+            'gemini': self.llm_service.gemini.estatisticas(),
+            'triagem': self._metricas_triagem(decisoes, max_workers),
+            'pacotes': self._metricas_pacotes
+        }
+        if self.llm_service.gemini.cache is not None:
+            self.metricas_execucao['cache'] = self.llm_service.gemini.cache.estatisticas()
+        
+        # Converter para DataFrame
+        if resultados:
+            df_resultados = pd.DataFrame(resultados)
+        else:
+            # DataFrame vazio com colunas esperadas
+            df_resultados = pd.DataFrame(columns=COLUNAS_RESULTADO)
+        
+        print(f"\nANÁLISE CONCLUÍDA: {len(df_resultados)}/{total} processadas com sucesso")
+        print(f"Tempo: {self.metricas_execucao['tempo_total']}s "
+              f"({self.metricas_execucao['linhas_por_segundo']} linhas/s, {max_workers} worker(s))")
+        estatisticas_gemini = self.metricas_execucao['gemini']
+        if isinstance(estatisticas_gemini, dict):
+            print(f"Gemini: {estatisticas_gemini.get('retentativas', 0)} retentativas, "
+                  f"{estatisticas_gemini.get('erros_limite', 0)} erros 429, "
+                  f"{estatisticas_gemini.get('tempo_backoff_total', 0)}s em backoff")
+        if self.triagem.ativa:
+            triagem = self.metricas_execucao['triagem']
+            print(f"Triagem KB: {triagem['chamadas_evitadas']} chamadas ao LLM evitadas, "
+                  f"{triagem['chamadas_llm']} enviadas (~{triagem['tempo_economizado_estimado']}s economizados)")
+        if pacote > 1:
+            pacotes = self._metricas_pacotes
+            print(f"Pacotes: {pacotes['pacotes']} chamadas com até {pacote} casos, "
+                  f"{pacotes['casos_agrupados']} casos respondidos, {pacotes['casos_reenviados']} reenviados individualmente, "
+                  f"{pacotes['casos_fallback']} em fallback")
+        if 'cache' in self.metricas_execucao:
+            estatisticas_cache = self.metricas_execucao['cache']
+            print(f"Cache: {estatisticas_cache['hits']} hits / {estatisticas_cache['misses']} misses "
+                  f"(taxa de acerto {estatisticas_cache['taxa_acerto']:.0%})")
+        
+        return df_resultados
+    
+    def _metricas_triagem(self, decisoes: List[Optional[str]], max_workers: int) -> Dict[str, Any]:
+        """
+        Chamadas evitadas pela triagem e tempo economizado estimado: chamadas
+        evitadas x tempo médio medido das chamadas ao LLM desta execução,
+        dividido pelo número de workers (tempo de relógio, não de CPU).
+        """
+        evitadas = sum(1 for decisao in decisoes if decisao is not None)
+        tempos = list(self._tempos_llm)
+        tempo_medio = sum(tempos) / len(tempos) if tempos else 0.0
+        return {
+            'chamadas_llm': len(tempos),
+            'chamadas_evitadas': evitadas,
+            'tempo_medio_llm': round(tempo_medio, 3),
+            'tempo_economizado_estimado': round(evitadas * tempo_medio / max_workers, 3)
+        }
+    
+    def _prebuscar_contextos(self, bloco: List[tuple]) -> List[Optional[Dict[str, Any]]]:
+        """Busca o contexto RAG de um bloco de linhas; None faz a linha buscar sozinha"""
+        contextos: List[Optional[Dict[str, Any]]] = [None] * len(bloco)
+        validas, dados_validos = [], []
+        
+        for posicao_bloco, (_, idx, linha) in enumerate(bloco):
+            try:
+                dados_validos.append(self.preparar_dados_internacao(linha))
+                validas.append(posicao_bloco)
+            except Exception as e:
+                logger.warning(f"Internação {idx} sem pré-busca de contexto: {e}")
+        
+        if dados_validos:
+            try:
+                for posicao_bloco, contexto in zip(validas, self.llm_service.rag.buscar_contexto_lote(dados_validos)):
+                    contextos[posicao_bloco] = contexto
+            except Exception as e:
+                logger.error(f"Erro na pré-busca de contexto do bloco: {e}")
+        
+        return contextos
+    
+    def _analisar_pacotes(self, itens: List[tuple], contextos: List[Optional[Dict[str, Any]]],
+                          pacote: int, executor: Optional[ThreadPoolExecutor]) -> List[Optional[Dict[str, Any]]]:
+        """
+        Resultados do Gemini para as linhas `itens`, `pacote` casos por chamada.
+        None = sem resposta válida no pacote (a linha segue pelo caminho individual).
+        Se o pacote falhar por erro retentável (429/5xx após as retentativas), os
+        casos recebem o fallback marcado com erro_analise: reenviar um a um
+        multiplicaria as chamadas justamente quando a cota/serviço não aguenta.
+        """
+        dados: List[Optional[Dict[str, Any]]] = []
+        for _, idx, linha in itens:
+            try:
+                dados.append(self.preparar_dados_internacao(linha))
+            except Exception as e:
+                logger.warning(f"Internação {idx} fora do pacote: {e}")
+                dados.append(None)
+        
+        def analisar(posicoes: range) -> Optional[Dict[int, Optional[Dict[str, Any]]]]:
+            """Resultados por posição; None se o pacote não chegou a ser enviado"""
+            validas = [posicao for posicao in posicoes if dados[posicao] is not None]
+            if len(validas) < 2:
+                return None
+            inicio_llm = time.perf_counter()
+            try:
+                resultados = self.llm_service.analisar_pacientes_alta_agrupados(
+                    [dados[posicao] for posicao in validas], [contextos[posicao] for posicao in validas]
+                )
+            except Exception as e:
+                print(f"Erro no pacote do Gemini: {e}")
+                if erro_retentavel(e):
+                    resultados = [{**self._estrutura_fallback(dados[posicao]), 'erro_analise': True}
+                                  for posicao in validas]
+                else:
+                    resultados = [None] * len(validas)
+            self._tempos_llm.append(time.perf_counter() - inicio_llm)
+            return dict(zip(validas, resultados))
+        
+        pacotes = [range(inicio, min(inicio + pacote, len(itens))) for inicio in range(0, len(itens), pacote)]
+        respostas: Dict[int, Optional[Dict[str, Any]]] = {}
+        for parcial in (executor.map(analisar, pacotes) if executor is not None else map(analisar, pacotes)):
+            if parcial is not None:
+                self._metricas_pacotes['pacotes'] += 1
+                respostas.update(parcial)
+        
+        recomendacoes = [respostas.get(posicao) for posicao in range(len(itens))]
+        fallback = sum(1 for recomendacao in recomendacoes if recomendacao is not None and recomendacao.get('erro_analise'))
+        agrupados = sum(1 for recomendacao in recomendacoes if recomendacao is not None) - fallback
+        self._metricas_pacotes['casos_agrupados'] += agrupados
+        self._metricas_pacotes['casos_fallback'] += fallback
+        # Sem resposta no pacote, ou em pacote de um caso só (resto da divisão): caminho individual
+        self._metricas_pacotes['casos_reenviados'] += sum(
+            1 for posicao, recomendacao in enumerate(recomendacoes) if recomendacao is None and dados[posicao] is not None
+        )
+        return recomendacoes
+    
+    def _processar_linha(self, posicao: int, idx: Any, linha: pd.Series, total: int,
+                         contexto: Optional[Dict[str, Any]] = None,
+                         recomendacao_pacote: Optional[Dict[str, Any]] = None,
+                         prioridade_regra: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        Processa uma internação: KB + Gemini (ou regra da triagem). Retorna None se a linha falhar.
+
+        `recomendacao_pacote` é o resultado já obtido num prompt agrupado (sem nova chamada).
+        """
+        try:
+            print(f"\nProcessando {posicao+1}/{total}: {linha.get('paciente_nome', 'N/A')} - {linha.get('patologia', 'N/A')}")
+            
+            # Preparar dados
+            dados_internacao = self.preparar_dados_internacao(linha)
+            
+            # Análise da Knowledge Base
+            analise_kb = medical_kb.assess_discharge_readiness(dados_internacao)
+            
+            origem = ORIGEM_LLM
+            if prioridade_regra is not None:
+                # Caso claro pela knowledge base: sem chamada ao Gemini
+                recomendacao_gemini = self._estrutura_regra_kb(prioridade_regra, analise_kb)
+                origem = ORIGEM_REGRA_KB
+            elif recomendacao_pacote is not None:
+                recomendacao_gemini = recomendacao_pacote
+                if recomendacao_pacote.get('erro_analise'):
+                    # Pacote falhou por cota/indisponibilidade
+                    origem = ORIGEM_FALLBACK
+            else:
                 # Análise do Gemini LLM - COM TRY/EXCEPT ESPECÍFICO
+                inicio_llm = time.perf_counter()
                 try:
-                    recomendacao_gemini = self.llm_service.analisar_paciente_alta(dados_internacao)
+                    recomendacao_gemini = self.llm_service.analisar_paciente_alta(dados_internacao, contexto=contexto)
                     
                     # VERIFICAR SE A ESTRUTURA ESTÁ CORRETA
                     if not isinstance(recomendacao_gemini, dict) or 'prioridade' not in recomendacao_gemini:
                         print(f"Estrutura inválida da resposta, usando fallback")
                         recomendacao_gemini = self._estrutura_fallback(dados_internacao)
+                        origem = ORIGEM_FALLBACK
+                    elif recomendacao_gemini.get('erro_analise'):
+                        # Resposta de erro do LLMService: não é análise do Gemini
+                        origem = ORIGEM_FALLBACK
                     
                 except Exception as e:
+                    # Inclui cota excedida (429) e erros 5xx após as retentativas
                     print(f"Erro no Gemini: {e}")
                     recomendacao_gemini = self._estrutura_fallback(dados_internacao)
+                    origem = ORIGEM_FALLBACK
+                self._tempos_llm.append(time.perf_counter() - inicio_llm)
+            
+            # Combinar resultados - COM VALIDAÇÃO
+            resultado = {
+                'internacao_id': dados_internacao['internacao_id'],
+                'paciente_id': dados_internacao['paciente_id'],
+                'paciente_nome': linha.get('paciente_nome', 'N/A'),
+                'patologia': dados_internacao['patologia'],
+                'idade': dados_internacao['idade'],
+                'tempo_permanencia': dados_internacao['tempo_permanencia'],
+                'tempo_ideal': dados_internacao['tempo_ideal_patologia'],
+                'setor': dados_internacao['setor'],
+                'comorbidades': dados_internacao['comorbidades'],
+                'alerta_tempo_dataset': dados_internacao['alerta_tempo'],
+                'dias_excesso_dataset': dados_internacao['dias_excesso'],
                 
-                # Combinar resultados - COM VALIDAÇÃO
-                resultado = {
-                    'internacao_id': dados_internacao['internacao_id'],
-                    'paciente_id': dados_internacao['paciente_id'],
-                    'paciente_nome': linha.get('paciente_nome', 'N/A'),
-                    'patologia': dados_internacao['patologia'],
-                    'idade': dados_internacao['idade'],
-                    'tempo_permanencia': dados_internacao['tempo_permanencia'],
-                    'tempo_ideal': dados_internacao['tempo_ideal_patologia'],
-                    'setor': dados_internacao['setor'],
-                    'comorbidades': dados_internacao['comorbidades'],
-                    'alerta_tempo_dataset': dados_internacao['alerta_tempo'],
-                    'dias_excesso_dataset': dados_internacao['dias_excesso'],
-                    
-                    # Resultados da Knowledge Base
-                    'score_prontidao_kb': analise_kb['readiness_score'],
-                    'nivel_prontidao_kb': analise_kb['readiness_level'],
-                    'fatores_kb': analise_kb['factors'],
-                    
-                    # Resultados do Gemini - COM VALIDAÇÃO
-                    'prioridade_gemini': recomendacao_gemini.get('prioridade', 'MEDIA'),
-                    'razoes_alta_gemini': recomendacao_gemini.get('razoes_alta', ['Análise realizada']),
-                    'pendencias_gemini': recomendacao_gemini.get('pendencias', ['Validação necessária']),
-                    'fontes_gemini': recomendacao_gemini.get('fontes_informacao', ['Sistema']),
-                    'confianca_gemini': recomendacao_gemini.get('confianca', 0.5),
-                    'analise_inicial_gemini': recomendacao_gemini.get('analise_inicial', ''),
-                    
-                    # Metadados
-                    'documentos_contexto': recomendacao_gemini.get('contexto_utilizado', {}).get('documentos_encontrados', 0)
-                }
-                
-                resultados.append(resultado)
+                # Resultados da Knowledge Base
+                'score_prontidao_kb': analise_kb['readiness_score'],
+                'nivel_prontidao_kb': analise_kb['readiness_level'],
+                'fatores_kb': analise_kb['factors'],
                 
-                print(f"KB Score: {analise_kb['readiness_score']}/100 - {analise_kb['readiness_level']}")
-                print(f"Gemini: {resultado['prioridade_gemini']} (conf: {resultado['confianca_gemini']})")
-                print(f"Razões: {len(resultado['razoes_alta_gemini'])} | Pendências: {len(resultado['pendencias_gemini'])}")
+                # Resultados do Gemini - COM VALIDAÇÃO
+                'prioridade_gemini': recomendacao_gemini.get('prioridade', 'MEDIA'),
+                'razoes_alta_gemini': recomendacao_gemini.get('razoes_alta', ['Análise realizada']),
+                'pendencias_gemini': recomendacao_gemini.get('pendencias', ['Validação necessária']),
+                'fontes_gemini': recomendacao_gemini.get('fontes_informacao', ['Sistema']),
+                'confianca_gemini': recomendacao_gemini.get('confianca', 0.5),
+                'analise_inicial_gemini': recomendacao_gemini.get('analise_inicial', ''),
                 
-            except Exception as e:
-                logger.error(f"Erro ao processar internação {idx}: {e}")
-                continue
-        
-        # Converter para DataFrame
-        if resultados:
-            df_resultados = pd.DataFrame(resultados)
-        else:
-            # DataFrame vazio com colunas esperadas
-            df_resultados = pd.DataFrame(columns=[
-                'internacao_id', 'paciente_id', 'paciente_nome', 'patologia', 'idade',
-                'tempo_permanencia', 'tempo_ideal', 'setor', 'comorbidades',
-                'alerta_tempo_dataset', 'dias_excesso_dataset', 'score_prontidao_kb',
-                'nivel_prontidao_kb', 'fatores_kb', 'prioridade_gemini', 'razoes_alta_gemini',
-                'pendencias_gemini', 'fontes_gemini', 'confianca_gemini', 'analise_inicial_gemini',
-                'documentos_contexto'
-            ])
-        
-        print(f"\nANÁLISE CONCLUÍDA: {len(df_resultados)}/{len(df)} processadas com sucesso")
-        
-        return df_resultados
+                # Metadados
+                'documentos_contexto': recomendacao_gemini.get('contexto_utilizado', {}).get('documentos_encontrados', 0),
+                'origem_analise': origem
+            }
+            
+            print(f"KB Score: {analise_kb['readiness_score']}/100 - {analise_kb['readiness_level']}")
+            print(f"Gemini: {resultado['prioridade_gemini']} (conf: {resultado['confianca_gemini']})")
+            print(f"Razões: {len(resultado['razoes_alta_gemini'])} | Pendências: {len(resultado['pendencias_gemini'])}")
+            
+            return resultado
+            
+        except Exception as e:
+            logger.error(f"Erro ao processar internação {idx}: {e}")
+            return None
 
     def _estrutura_fallback(self, dados_internacao: Dict) -> Dict:
         """Estrutura fallback quando o Gemini falha"""
@@ -159,6 +512,22 @@ class BatchProcessor:
             'recomendacao_original': 'MANTER_INTERNACAO'
         }
         
+    def _estrutura_regra_kb(self, prioridade: str, analise_kb: Dict) -> Dict:
+        """Resultado por regra da triagem, no mesmo formato da resposta do Gemini"""
+        if prioridade == 'ALTA':
+            pendencias = ['Confirmar critérios de alta com a equipe assistente']
+        else:
+            pendencias = ['Reavaliar após evolução clínica']
+        return {
+            'prioridade': prioridade,
+            'razoes_alta': analise_kb['factors'] or ['Score da knowledge base'],
+            'pendencias': pendencias,
+            'fontes_informacao': ['Knowledge Base (triagem por regras)'],
+            'confianca': 0.9,
+            'analise_inicial': analise_kb['recommendation'],
+            'recomendacao_original': analise_kb['readiness_level']
+        }
+    
     def gerar_relatorio_estatistico(self, df_resultados: pd.DataFrame) -> Dict[str, Any]:
         """Gera relatório estatístico das análises"""
         
@@ -216,18 +585,62 @@ class BatchProcessor:
         
         return (concordantes / len(df)) * 100
     
-    def salvar_resultados(self, df_resultados: pd.DataFrame, arquivo_saida: str):
-        """Salva resultados em CSV"""
+    def _formatar_exportacao(self, df_resultados: pd.DataFrame) -> pd.DataFrame:
+        """Converte listas para string para salvar em CSV"""
+        df_export = df_resultados.copy()
+        
+        for col in ['comorbidades', 'razoes_alta_gemini', 'pendencias_gemini', 'fontes_gemini', 'fatores_kb']:
+            if col in df_export.columns:
+                df_export[col] = df_export[col].apply(lambda x: '; '.join(x) if isinstance(x, list) else str(x))
+        return df_export
+    
+    def salvar_resultados(self, df_resultados: pd.DataFrame, arquivo_saida: str, anexar: bool = False):
+        """
+        Salva resultados em CSV (com anexar=True acrescenta as linhas sem repetir o cabeçalho).
+        Sem anexar, grava num arquivo temporário e troca com os.replace: uma
+        interrupção no meio nunca deixa um CSV pela metade no lugar do anterior.
+        """
         try:
-            # Converter listas para string para salvar em CSV
-            df_export = df_resultados.copy()
-            
-            for col in ['comorbidades', 'razoes_alta_gemini', 'pendencias_gemini', 'fontes_gemini', 'fatores_kb']:
-                if col in df_export.columns:
-                    df_export[col] = df_export[col].apply(lambda x: '; '.join(x) if isinstance(x, list) else str(x))
+            df_export = self._formatar_exportacao(df_resultados)
             
-            df_export.to_csv(arquivo_saida, index=False, encoding='utf-8')
+            if anexar:
+                # Mesma ordem de colunas do cabeçalho já gravado
+                df_export = df_export.reindex(columns=COLUNAS_RESULTADO)
+                df_export.to_csv(arquivo_saida, mode='a', header=False, index=False, encoding='utf-8')
+            else:
+                temporario = f"{arquivo_saida}.tmp"
+                df_export.to_csv(temporario, index=False, encoding='utf-8')
+                os.replace(temporario, arquivo_saida)
             logger.info(f"Resultados salvos em: {arquivo_saida}")
             
         except Exception as e:
-            logger.error(f"Erro ao salvar resultados: {e}")
\ No newline at end of file
+            logger.error(f"Erro ao salvar resultados: {e}")
+    
+    def resultados_diario(self) -> pd.DataFrame:
+        """Todos os resultados do diário (execução atual + retomadas), para o relatório final"""
+        resultados = [resultado for bloco in self.diario.resultados() for resultado in bloco]
+        return pd.DataFrame(resultados).reindex(columns=COLUNAS_RESULTADO)
+    
+    def exportar_diario(self, arquivo_saida: str, tamanho_bloco: int = 5000) -> int:
+        """
+        Exporta o diário para CSV, lendo `tamanho_bloco` resultados por vez.
+        O arquivo só substitui o anterior (os.replace) depois de completo.
+        Retorna o número de linhas exportadas.
+        """
+        temporario = f"{arquivo_saida}.tmp"
+        total = 0
+        try:
+            for bloco in self.diario.resultados(tamanho_bloco):
+                df_export = self._formatar_exportacao(pd.DataFrame(bloco).reindex(columns=COLUNAS_RESULTADO))
+                df_export.to_csv(temporario, mode='a' if total else 'w', header=not total,
+                                 index=False, encoding='utf-8')
+                total += len(df_export)
+            if not total:
+                pd.DataFrame(columns=COLUNAS_RESULTADO).to_csv(temporario, index=False, encoding='utf-8')
+            os.replace(temporario, arquivo_saida)
+        except Exception:
+            if os.path.exists(temporario):
+                os.remove(temporario)
+            raise
+        logger.info(f"Diário exportado: {total} resultados em {arquivo_saida}")
+        return total
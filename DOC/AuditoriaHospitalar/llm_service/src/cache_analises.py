@@ -0,0 +1,128 @@
+"""
+Cache persistente (SQLite) das respostas do Gemini
+
+A chave é o hash do texto do prompt + nome do modelo + configuração de
+geração, então internações cujos dados não mudaram reaproveitam a resposta
+anterior sem nova chamada à API.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CacheAnalises:
+    """Cache chave-valor em SQLite com TTL, despejo LRU e contadores de acerto"""
+
+    def __init__(self,
+                 caminho: str = "./cache/analises_llm.sqlite3",
+                 ttl_segundos: float = 7 * 24 * 3600,
+                 max_entradas: int = 50000,
+                 bypass: bool = False,
+                 relogio: Callable[[], float] = time.time):
+        self.caminho = caminho
+        self.ttl_segundos = ttl_segundos
+        self.max_entradas = max_entradas
+        # Com bypass a leitura é ignorada, mas respostas novas continuam sendo gravadas
+        self.bypass = bypass
+        self._relogio = relogio
+        self._lock = threading.Lock()
+        self._contadores = {'hits': 0, 'misses': 0, 'ignoradas': 0, 'gravacoes': 0, 'expiradas': 0, 'despejadas': 0}
+
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS analises (
+                chave TEXT PRIMARY KEY,
+                resposta TEXT NOT NULL,
+                criado_em REAL NOT NULL,
+                acessado_em REAL NOT NULL
+            )
+        """)
+        self._conexao.execute("CREATE INDEX IF NOT EXISTS idx_analises_acessado_em ON analises (acessado_em)")
+        self._conexao.commit()
+
+    @staticmethod
+    def gerar_chave(prompt: str, modelo: str, configuracao: Dict[str, Any]) -> str:
+        """Hash SHA-256 do prompt + modelo + configuração de geração"""
+        conteudo = json.dumps(
+            {'modelo': modelo, 'configuracao': configuracao, 'prompt': prompt},
+            sort_keys=True, ensure_ascii=False, default=str
+        )
+        return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+    def obter(self, chave: str) -> Optional[str]:
+        """Retorna a resposta em cache ou None (miss, expirada ou bypass)"""
+        with self._lock:
+            if self.bypass:
+                self._contadores['ignoradas'] += 1
+                return None
+
+            agora = self._relogio()
+            linha = self._conexao.execute(
+                "SELECT resposta, criado_em FROM analises WHERE chave = ?", (chave,)
+            ).fetchone()
+
+            if linha is None:
+                self._contadores['misses'] += 1
+                return None
+
+            resposta, criado_em = linha
+            if self.ttl_segundos is not None and agora - criado_em > self.ttl_segundos:
+                self._conexao.execute("DELETE FROM analises WHERE chave = ?", (chave,))
+                self._conexao.commit()
+                self._contadores['expiradas'] += 1
+                self._contadores['misses'] += 1
+                return None
+
+            self._conexao.execute("UPDATE analises SET acessado_em = ? WHERE chave = ?", (agora, chave))
+            self._conexao.commit()
+            self._contadores['hits'] += 1
+            return resposta
+
+    def salvar(self, chave: str, resposta: str):
+        """Grava (ou substitui) a resposta e despeja as entradas menos usadas além do limite"""
+        with self._lock:
+            agora = self._relogio()
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO analises (chave, resposta, criado_em, acessado_em) VALUES (?, ?, ?, ?)",
+                (chave, resposta, agora, agora)
+            )
+            cursor = self._conexao.execute("""
+                DELETE FROM analises WHERE chave IN (
+                    SELECT chave FROM analises ORDER BY acessado_em ASC
+                    LIMIT max(0, (SELECT COUNT(*) FROM analises) - ?)
+                )
+            """, (self.max_entradas,))
+            self._conexao.commit()
+            self._contadores['gravacoes'] += 1
+            self._contadores['despejadas'] += max(0, cursor.rowcount)
+
+    def limpar(self):
+        """Remove todas as entradas"""
+        with self._lock:
+            self._conexao.execute("DELETE FROM analises")
+            self._conexao.commit()
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Contadores de acerto/erro e tamanho atual do cache"""
+        with self._lock:
+            estatisticas = dict(self._contadores)
+            estatisticas['entradas'] = self._conexao.execute("SELECT COUNT(*) FROM analises").fetchone()[0]
+        consultas = estatisticas['hits'] + estatisticas['misses']
+        estatisticas['taxa_acerto'] = round(estatisticas['hits'] / consultas, 3) if consultas else 0.0
+        return estatisticas
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
@@ -0,0 +1,179 @@
+"""
+Diário (SQLite) das execuções em lote, para retomar uma execução interrompida
+
+Cada resultado concluído é gravado pela chave internacao_id assim que sai do
+BatchProcessor; uma nova execução com retomada pula as internações já
+gravadas. Resultados de fallback (cota excedida, Gemini indisponível) ficam no
+diário, mas não contam como concluídos: são refeitos na retomada e
+substituídos no lugar.
+A exportação final lê o diário em blocos, na ordem de gravação.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Não conta como concluído na retomada (mesmo valor de batch_processor.ORIGEM_FALLBACK)
+ORIGEM_REFAZER = 'FALLBACK'
+
+# IDs por consulta IN (abaixo do limite de variáveis do SQLite)
+TAMANHO_FATIA_CONSULTA = 500
+
+
+def _serializar(valor: Any) -> Any:
+    """Tipos do numpy/pandas (np.int64, np.bool_) para o JSON do diário"""
+    if hasattr(valor, 'item'):
+        return valor.item()
+    return str(valor)
+
+
+def chave_internacao(internacao_id: Any) -> Optional[str]:
+    """internacao_id como texto; None se vazio (linha sem ID não é registrada)"""
+    if internacao_id is None or internacao_id != internacao_id:  # None ou NaN
+        return None
+    chave = str(internacao_id).strip()
+    return chave or None
+
+
+class DiarioExecucao:
+    """Resultados concluídos por internacao_id, gravados em lote por transação"""
+
+    def __init__(self, caminho: str = "./cache/diario_execucao.sqlite3"):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+
+        self._conexao = sqlite3.connect(caminho, check_same_thread=False)
+        self._conexao.execute("PRAGMA journal_mode=WAL")
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS resultados (
+                ordem INTEGER PRIMARY KEY AUTOINCREMENT,
+                internacao_id TEXT NOT NULL UNIQUE,
+                origem TEXT,
+                resultado TEXT NOT NULL,
+                gravado_em REAL NOT NULL
+            )
+        """)
+        self._conexao.execute("""
+            CREATE TABLE IF NOT EXISTS execucao (
+                chave TEXT PRIMARY KEY,
+                valor TEXT NOT NULL
+            )
+        """)
+        self._conexao.commit()
+
+    def iniciar(self, identificacao: str, retomar: bool = False) -> int:
+        """
+        Prepara o diário para a execução `identificacao` (ex.: arquivo de entrada).
+        Sem retomada, ou se o diário for de outra entrada, começa vazio.
+        Retorna quantas internações já estão concluídas.
+        """
+        with self._lock:
+            linha = self._conexao.execute(
+                "SELECT valor FROM execucao WHERE chave = 'identificacao'"
+            ).fetchone()
+            anterior = linha[0] if linha else None
+        if retomar and anterior is not None and anterior != identificacao:
+            logger.warning(f"Diário de outra execução ({anterior}); recomeçando do zero")
+            retomar = False
+        if not retomar:
+            self.limpar()
+        with self._lock:
+            self._conexao.execute(
+                "INSERT OR REPLACE INTO execucao (chave, valor) VALUES ('identificacao', ?)", (identificacao,)
+            )
+            self._conexao.commit()
+        return self.total_concluidos()
+
+    def total_concluidos(self) -> int:
+        with self._lock:
+            return self._conexao.execute(
+                "SELECT COUNT(*) FROM resultados WHERE origem IS NOT ?", (ORIGEM_REFAZER,)
+            ).fetchone()[0]
+
+    def concluidos(self, ids: Optional[Iterable[Any]] = None) -> Set[str]:
+        """
+        IDs das internações que a retomada pode pular. Com `ids` (ex.: as linhas
+        de um bloco) só esses são consultados, em fatias, sem carregar o diário inteiro.
+        """
+        if ids is None:
+            with self._lock:
+                linhas = self._conexao.execute(
+                    "SELECT internacao_id FROM resultados WHERE origem IS NOT ?", (ORIGEM_REFAZER,)
+                ).fetchall()
+            return {linha[0] for linha in linhas}
+
+        chaves = list({chave for chave in map(chave_internacao, ids) if chave is not None})
+        concluidos = set()
+        for inicio in range(0, len(chaves), TAMANHO_FATIA_CONSULTA):
+            fatia = chaves[inicio:inicio + TAMANHO_FATIA_CONSULTA]
+            marcadores = ", ".join("?" * len(fatia))
+            with self._lock:
+                linhas = self._conexao.execute(
+                    f"SELECT internacao_id FROM resultados WHERE origem IS NOT ? AND internacao_id IN ({marcadores})",
+                    (ORIGEM_REFAZER, *fatia)
+                ).fetchall()
+            concluidos.update(linha[0] for linha in linhas)
+        return concluidos
+
+    def registrar(self, resultados: Iterable[Dict[str, Any]]) -> int:
+        """
+        Grava os resultados numa transação. Um ID já gravado (fallback refeito)
+        é substituído mantendo a posição original. Retorna quantos foram gravados.
+        """
+        agora = time.time()
+        linhas = []
+        for resultado in resultados:
+            chave = chave_internacao(resultado.get('internacao_id'))
+            if chave is None:
+                continue
+            linhas.append((
+                chave, resultado.get('origem_analise'),
+                json.dumps(resultado, ensure_ascii=False, default=_serializar), agora
+            ))
+        if not linhas:
+            return 0
+        with self._lock:
+            self._conexao.executemany("""
+                INSERT INTO resultados (internacao_id, origem, resultado, gravado_em) VALUES (?, ?, ?, ?)
+                ON CONFLICT(internacao_id) DO UPDATE SET
+                    origem = excluded.origem, resultado = excluded.resultado, gravado_em = excluded.gravado_em
+            """, linhas)
+            self._conexao.commit()
+        return len(linhas)
+
+    def resultados(self, tamanho_bloco: int = 5000) -> Iterator[List[Dict[str, Any]]]:
+        """Resultados gravados, em blocos de `tamanho_bloco`, na ordem de gravação"""
+        ultima = 0
+        while True:
+            with self._lock:
+                linhas = self._conexao.execute(
+                    "SELECT ordem, resultado FROM resultados WHERE ordem > ? ORDER BY ordem LIMIT ?",
+                    (ultima, tamanho_bloco)
+                ).fetchall()
+            if not linhas:
+                return
+            ultima = linhas[-1][0]
+            yield [json.loads(resultado) for _, resultado in linhas]
+
+    def total(self) -> int:
+        with self._lock:
+            return self._conexao.execute("SELECT COUNT(*) FROM resultados").fetchone()[0]
+
+    def limpar(self):
+        """Remove todos os resultados"""
+        with self._lock:
+            self._conexao.execute("DELETE FROM resultados")
+            self._conexao.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conexao.close()
@@ -3,32 +3,80 @@ Integração com Google Gemini para análise de pacientes
 """
 
 import os
+import threading
 
 # Adicionado type: ignore para silenciar o erro "PrivateImportUsage" do Pylance
 import google.generativeai as genai  # type: ignore
 from google.generativeai.types import HarmCategory, HarmBlockThreshold, GenerationConfig
 from typing import Dict, Any, Optional, List
 import logging
-import re
+
+from .rate_limiter import RateLimiter, gemini_rate_limiter, erro_retentavel
+from .cache_analises import CacheAnalises
+from .gemini_simulado import criar_backend
+from .parser_respostas import ESQUEMA_RESPOSTA, ESQUEMA_RESPOSTA_LOTE, parser_respostas
 
 logger = logging.getLogger(__name__)
 
 
+
+class RespostaVaziaGemini(Exception):
+    """Gemini respondeu sem conteúdo (bloqueio de segurança, recitação etc.)"""
+
+
+# Fração de max_output_tokens usada no cálculo do tamanho do pacote (folga para variação)
+FRACAO_ORCAMENTO_PACOTE = 0.8
+
+
 class GeminiIntegration:
-    def __init__(self, api_key: Optional[str] = None):
+    def __init__(self,
+                 api_key: Optional[str] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 cache: Optional[CacheAnalises] = None,
+                 modo_json: Optional[bool] = None,
+                 backend: Optional[Any] = None):
         self.api_key = api_key or os.getenv("GEMINI_API_KEY")
         self.model = None
-
-        if self.api_key:
+        self.max_output_tokens = 2048
+        # Limitador compartilhado por padrão: todas as instâncias dividem a mesma cota
+        self.rate_limiter = rate_limiter or gemini_rate_limiter
+        # Cache opcional de respostas (desligado quando None)
+        self.cache = cache
+
+        # --- MUDANÇA: USANDO A VERSÃO 2.0 (MAIS ESTÁVEL) ---
+        self.model_name = "gemini-2.0-flash"
+        self.configuracao_geracao = {
+            "temperature": 0.1,
+            "top_p": 0.8,
+            "top_k": 40,
+            "max_output_tokens": self.max_output_tokens,  # Aumentado para garantir
+        }
+        # Saída estruturada: o Gemini devolve JSON no ESQUEMA_RESPOSTA
+        if modo_json is None:
+            modo_json = os.getenv("GEMINI_MODO_JSON", "0") == "1"
+        self.modo_json = modo_json
+        self.respostas_fora_do_json = 0
+        # Contador incrementado pelos workers do BatchProcessor (max_workers > 1)
+        self._lock_contadores = threading.Lock()
+        # Tokens de saída estimados por caso num prompt agrupado
+        self.tokens_saida_por_caso = int(os.getenv("GEMINI_TOKENS_POR_CASO", "300"))
+        if self.modo_json:
+            self.configuracao_geracao["response_mime_type"] = "application/json"
+            self.configuracao_geracao["response_schema"] = ESQUEMA_RESPOSTA
+
+        # Backend alternativo (ex.: gemini_simulado): objeto com generate_content
+        if backend is None and os.getenv("GEMINI_BACKEND"):
+            backend = criar_backend(os.getenv("GEMINI_BACKEND"), self.model_name)
+        if backend is not None:
+            if hasattr(backend, "configurar_geracao"):
+                backend.configurar_geracao(self.configuracao_geracao)
+            self.model = backend
+            logger.info(f"Gemini usando backend {type(backend).__name__}")
+        elif self.api_key:
             try:
                 genai.configure(api_key=self.api_key)  # type: ignore
 
-                generation_config = GenerationConfig(
-                    temperature=0.1,
-                    top_p=0.8,
-                    top_k=40,
-                    max_output_tokens=2048,  # Aumentado para garantir
-                )
+                generation_config = GenerationConfig(**self.configuracao_geracao)
 
                 # Configurações de segurança no mínimo para evitar bloqueios médicos
                 safety_settings = [
@@ -50,16 +98,13 @@ class GeminiIntegration:
                     },
                 ]
 
-                # --- MUDANÇA: USANDO A VERSÃO 2.0 (MAIS ESTÁVEL) ---
-                model_name = "gemini-2.0-flash"
-
                 self.model = genai.GenerativeModel(  # type: ignore
-                    model_name=model_name,
+                    model_name=self.model_name,
                     generation_config=generation_config,
                     safety_settings=safety_settings,
                 )
 
-                logger.info(f"Gemini ({model_name}) inicializado com sucesso")
+                logger.info(f"Gemini ({self.model_name}) inicializado com sucesso")
 
             except Exception as e:
                 logger.error(f"Erro ao inicializar Gemini: {e}")
@@ -67,29 +112,103 @@ class GeminiIntegration:
         else:
             logger.warning("API key do Gemini não encontrada. Usando modo mock.")
 
-    def analisar_paciente(self, prompt: str) -> str:
-        """Analisa paciente usando Gemini"""
+    def analisar_paciente(self, prompt: str, configuracao: Optional[Dict[str, Any]] = None) -> str:
+        """
+        Analisa paciente usando Gemini (consultando o cache antes da API)
+
+        `configuracao` substitui a configuração de geração só nesta chamada.
+        """
         if not self.model:
             return self._resposta_mock(prompt)
 
-        try:
-            # Chamada REAL para Gemini
-            response = self.model.generate_content(prompt)
+        chave_cache = None
+        if self.cache is not None:
+            chave_cache = CacheAnalises.gerar_chave(prompt, self.model_name, configuracao or self.configuracao_geracao)
+            resposta_cache = self.cache.obter(chave_cache)
+            if resposta_cache is not None:
+                return resposta_cache
 
-            # Verifica se há conteúdo válido
-            if response.candidates and response.candidates[0].content.parts:
-                return response.text
+        # Erros propagam (nunca o mock com um modelo real): o chamador marca a
+        # análise como falha (FALLBACK) em vez de tomá-la por resposta do Gemini
+        try:
+            # Chamada REAL para Gemini, sob o limitador de taxa (com retentativas)
+            response = self.rate_limiter.executar(
+                lambda: self._gerar_conteudo(prompt, configuracao),
+                tokens_estimados=self._estimar_tokens(prompt),
+                tokens_reais=self._tokens_consumidos,
+            )
+        except Exception as e:
+            if erro_retentavel(e):
+                logger.error(f"Gemini indisponível após retentativas: {e}")
             else:
-                motivo = "Desconhecido"
-                if response.candidates:
-                    motivo = response.candidates[0].finish_reason
-
-                logger.warning(f"Gemini retornou resposta vazia. Motivo: {motivo}")
-                return self._resposta_mock(prompt)
-
+                logger.error(f"ERRO ao chamar Gemini: {e}")
+            raise
+
+        # Verifica se há conteúdo válido
+        if response.candidates and response.candidates[0].content.parts:
+            # Só respostas completas vão para o cache (nunca uma resposta
+            # cortada em MAX_TOKENS/SAFETY, que deve ser refeita)
+            if chave_cache is not None and self._resposta_completa(response):
+                self.cache.salvar(chave_cache, response.text)
+            return response.text
+
+        motivo = "Desconhecido"
+        if response.candidates:
+            motivo = response.candidates[0].finish_reason
+        logger.warning(f"Gemini retornou resposta vazia. Motivo: {motivo}")
+        raise RespostaVaziaGemini(f"Resposta vazia do Gemini (motivo: {motivo})")
+
+    @staticmethod
+    def _resposta_completa(response) -> bool:
+        """finish_reason STOP (enum do SDK, seu valor inteiro ou o texto do backend simulado)"""
+        motivo = response.candidates[0].finish_reason
+        return getattr(motivo, "name", motivo) in ("STOP", 1)
+
+    def _gerar_conteudo(self, prompt: str, configuracao: Optional[Dict[str, Any]]):
+        if configuracao is None:
+            return self.model.generate_content(prompt)
+        return self.model.generate_content(prompt, generation_config=GenerationConfig(**configuracao))
+
+    def tamanho_pacote(self, solicitado: int) -> int:
+        """Casos por prompt agrupado: o solicitado, limitado pelo orçamento de max_output_tokens"""
+        cabem = int(self.max_output_tokens * FRACAO_ORCAMENTO_PACOTE) // max(self.tokens_saida_por_caso, 1)
+        return max(1, min(int(solicitado), cabem))
+
+    def analisar_pacientes_agrupados(self, prompt: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Analisa um prompt agrupado (PromptTemplates.criar_prompt_analise_lote) e
+        devolve o resultado estruturado por caso_id. IDs ausentes ou com bloco
+        incompleto não aparecem no retorno: o chamador os envia individualmente.
+        """
+        configuracao = None
+        if self.modo_json:
+            configuracao = dict(self.configuracao_geracao, response_schema=ESQUEMA_RESPOSTA_LOTE)
+        resposta = self.analisar_paciente(prompt, configuracao)
+        try:
+            resultados = parser_respostas.dividir_por_caso(resposta, ids)
         except Exception as e:
-            logger.error(f"ERRO ao chamar Gemini: {e}")
-            return self._resposta_mock(prompt)
+            print(f"PARSER: Erro no parse do pacote: {e}")
+            resultados = {}
+        if len(resultados) < len(ids):
+            logger.warning(f"Pacote com {len(ids) - len(resultados)}/{len(ids)} casos sem resposta válida")
+        return resultados
+
+    def _estimar_tokens(self, prompt: str) -> int:
+        """Estimativa grosseira (~4 caracteres por token) + reserva para a saída"""
+        return len(prompt) // 4 + self.max_output_tokens
+
+    def _tokens_consumidos(self, response) -> Optional[int]:
+        """Total de tokens informado pela API, quando disponível"""
+        total = getattr(getattr(response, "usage_metadata", None), "total_token_count", None)
+        return total if isinstance(total, int) else None
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Contadores de vazão/retentativas/backoff do limitador de taxa"""
+        estatisticas = self.rate_limiter.estatisticas()
+        if self.modo_json:
+            with self._lock_contadores:
+                estatisticas["respostas_fora_do_json"] = self.respostas_fora_do_json
+        return estatisticas
 
     def analisar_paciente_estruturado(self, prompt: str) -> Dict[str, Any]:
         """Analisa paciente e retorna dados estruturados"""
@@ -97,122 +216,21 @@ class GeminiIntegration:
         return self._parse_resposta_llm_corrigido(resposta_bruta)
 
     def _parse_resposta_llm_corrigido(self, resposta: str) -> Dict[str, Any]:
-        """Parse da resposta do LLM"""
+        """Parse da resposta do LLM (texto CHAVE: valor ou JSON), ver parser_respostas"""
         try:
-            print("PARSER: Iniciando parse...")
-            resposta_limpa = resposta.strip()
-            resposta_normalizada = self._normalizar_chaves_maiusculas(resposta_limpa)
-
-            analise_inicial = self._extrair_secao_flexivel(
-                resposta_normalizada, "analise_inicial"
-            )
-            razoes_alta = self._extrair_lista_flexivel(
-                resposta_normalizada, "razoes_alta"
-            )
-            pendencias = self._extrair_lista_flexivel(
-                resposta_normalizada, "pendencias"
-            )
-            recomendacao = self._extrair_secao_flexivel(
-                resposta_normalizada, "recomendacao"
-            )
-            fontes = self._extrair_lista_flexivel(resposta_normalizada, "fontes")
-            if not fontes:
-                fontes = self._extrair_lista_flexivel(
-                    resposta_normalizada, "fontes_informacao"
-                )
-            confianca = self._extrair_confianca_flexivel(resposta_normalizada)
-
-            prioridade = self._mapear_recomendacao_para_prioridade(recomendacao)
-
-            resultado = {
-                "prioridade": prioridade,
-                "razoes_alta": razoes_alta,
-                "pendencias": pendencias,
-                "fontes_informacao": fontes,
-                "confianca": confianca,
-                "resposta_bruta_llm": resposta_limpa,
-                "analise_inicial": analise_inicial,
-                "recomendacao_original": recomendacao,
-            }
-            return resultado
-
+            if self.modo_json:
+                resultado = parser_respostas.parse_json(resposta)
+                if resultado is not None:
+                    return resultado
+                # Resposta truncada/fora do esquema (ou mock): parser de texto
+                with self._lock_contadores:
+                    self.respostas_fora_do_json += 1
+                logger.warning("Resposta fora do JSON esperado, usando parser de texto")
+            return parser_respostas.parse(resposta)
         except Exception as e:
             print(f"PARSER: Erro no parse: {e}")
             return self._estrutura_erro(resposta)
 
-    def _normalizar_chaves_maiusculas(self, texto: str) -> str:
-        mapeamento = {
-            "ANALISE_INICIAL": "analise_inicial",
-            "RAZÕES_ALTA": "razoes_alta",
-            "RAZOES_ALTA": "razoes_alta",
-            "PENDENCIAS": "pendencias",
-            "RECOMENDACAO": "recomendacao",
-            "RECOMENDAÇÃO": "recomendacao",
-            "FONTES": "fontes",
-            "FONTES_INFORMACAO": "fontes_informacao",
-            "CONFIANCA": "confianca",
-            "CONFIANÇA": "confianca",
-        }
-        texto_normalizado = texto
-        for maiuscula, minuscula in mapeamento.items():
-            texto_normalizado = texto_normalizado.replace(
-                f"{maiuscula}:", f"{minuscula}:"
-            )
-        return texto_normalizado
-
-    def _extrair_secao_flexivel(self, texto: str, secao: str) -> str:
-        padrao = rf"{secao}:\s*(.*?)(?=\n[a-z_]+:|\n*$)"
-        match = re.search(padrao, texto, re.IGNORECASE | re.DOTALL)
-        if match:
-            conteudo = match.group(1).strip()
-            conteudo = re.sub(r"^\s*[\*\-\+]\s*", "", conteudo, flags=re.MULTILINE)
-            return conteudo
-        return ""
-
-    def _extrair_lista_flexivel(self, texto: str, secao: str) -> list:
-        conteudo = self._extrair_secao_flexivel(texto, secao)
-        if not conteudo:
-            return []
-        linhas = [linha.strip() for linha in conteudo.split("\n") if linha.strip()]
-        itens_limpos = []
-        for linha in linhas:
-            linha_limpa = re.sub(r"^\s*[\*\-\+•]\s*", "", linha).strip()
-            if linha_limpa:
-                itens_limpos.append(linha_limpa)
-        return itens_limpos
-
-    def _extrair_confianca_flexivel(self, texto: str) -> float:
-        padrao = r"confianca:\s*([0-9.]+)"
-        match = re.search(padrao, texto, re.IGNORECASE)
-        if match:
-            try:
-                return float(match.group(1))
-            except ValueError:
-                pass
-        return 0.75
-
-    def _mapear_recomendacao_para_prioridade(self, recomendacao: str) -> str:
-        if not recomendacao:
-            return "MEDIA"
-        recomendacao = recomendacao.upper().strip()
-        if "ALTA_PRIORIDADE_ALTA" in recomendacao:
-            return "ALTA"
-        elif "ALTA_PRIORIDADE_MEDIA" in recomendacao:
-            return "MEDIA"
-        elif "ALTA_PRIORIDADE_BAIXA" in recomendacao:
-            return "BAIXA"
-        elif "MANTER_INTERNACAO" in recomendacao:
-            return "MANTER"
-        else:
-            if "ALTA" in recomendacao and "PRIORIDADE" not in recomendacao:
-                return "ALTA"
-            elif any(
-                word in recomendacao for word in ["CONTINUAR", "MANTER", "PERMANECER"]
-            ):
-                return "MANTER"
-            else:
-                return "MEDIA"
-
     def _resposta_mock(self, prompt: str) -> str:
         return """
         ANALISE_INICIAL: Paciente em avaliação para possível alta.
@@ -0,0 +1,435 @@
+"""
+Backend simulado do Gemini para testes de carga sem rede
+
+ModeloGeminiSimulado tem a mesma interface usada de genai.GenerativeModel
+(generate_content -> resposta com text/candidates/usage_metadata) e simula:
+latência log-normal (mais um custo por token de saída), erros 429/500 por
+taxa, janelas de cota de requisições/tokens, respostas truncadas e respostas
+determinísticas por prompt (inclusive prompts agrupados e modo JSON).
+
+ServidorGeminiSimulado expõe o mesmo modelo via HTTP no formato REST do
+Gemini (POST /v1beta/models/<modelo>:generateContent) e ClienteGeminiHTTP é
+o backend que fala com ele. Uso:
+
+    python -m src.gemini_simulado --porta 8765 --taxa-429 0.05
+    GEMINI_BACKEND=http://127.0.0.1:8765 python execute_batch.py
+    GEMINI_BACKEND=simulado python execute_batch.py
+"""
+import argparse
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+from google.api_core import exceptions as google_exceptions  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+PADRAO_CASO_PROMPT = re.compile(r"^[ \t]*CASO (\S+):[ \t]*$", re.MULTILINE)
+PADRAO_PATOLOGIA = re.compile(r"Motivo Principal:[ \t]*(\S+)")
+PADRAO_PERMANENCIA = re.compile(r"Duração da Permanência:[ \t]*(\d+)")
+PADRAO_REFERENCIA = re.compile(r"Tempo de Referência:[ \t]*(\d+)")
+
+# Recomendações por razão permanência / tempo de referência
+FAIXAS_RECOMENDACAO = (
+    (1.2, "ALTA_PRIORIDADE_ALTA", "ALTA"),
+    (1.0, "ALTA_PRIORIDADE_MEDIA", "MEDIA"),
+    (0.7, "ALTA_PRIORIDADE_BAIXA", "BAIXA"),
+    (0.0, "MANTER_INTERNACAO", "MANTER"),
+)
+
+# camelCase da API REST <-> snake_case da configuração de geração
+CAMPOS_REST = {
+    "temperature": "temperature",
+    "topP": "top_p",
+    "topK": "top_k",
+    "maxOutputTokens": "max_output_tokens",
+    "responseMimeType": "response_mime_type",
+    "responseSchema": "response_schema",
+}
+
+
+class ConfiguracaoSimulacao:
+    """Parâmetros do backend simulado (taxas entre 0 e 1; 0 desliga a cota)"""
+
+    def __init__(self, latencia_mediana: float = 0.8, latencia_sigma: float = 0.35,
+                 latencia_por_token: float = 0.002, taxa_429: float = 0.0, taxa_500: float = 0.0,
+                 taxa_truncamento: float = 0.0, requisicoes_por_janela: int = 0,
+                 tokens_por_janela: int = 0, janela_cota: float = 60.0, semente: int = 42):
+        self.latencia_mediana = latencia_mediana
+        # Desvio do log da latência (0 = latência fixa)
+        self.latencia_sigma = latencia_sigma
+        self.latencia_por_token = latencia_por_token
+        self.taxa_429 = taxa_429
+        self.taxa_500 = taxa_500
+        self.taxa_truncamento = taxa_truncamento
+        self.requisicoes_por_janela = requisicoes_por_janela
+        self.tokens_por_janela = tokens_por_janela
+        self.janela_cota = janela_cota
+        self.semente = semente
+
+    @classmethod
+    def a_partir_do_ambiente(cls) -> 'ConfiguracaoSimulacao':
+        """SIMULADOR_LATENCIA, SIMULADOR_SIGMA, SIMULADOR_TAXA_429/500, SIMULADOR_TRUNCAMENTO, SIMULADOR_RPM/TPM, SIMULADOR_SEMENTE"""
+        return cls(
+            latencia_mediana=float(os.getenv('SIMULADOR_LATENCIA', '0.8')),
+            latencia_sigma=float(os.getenv('SIMULADOR_SIGMA', '0.35')),
+            taxa_429=float(os.getenv('SIMULADOR_TAXA_429', '0')),
+            taxa_500=float(os.getenv('SIMULADOR_TAXA_500', '0')),
+            taxa_truncamento=float(os.getenv('SIMULADOR_TRUNCAMENTO', '0')),
+            requisicoes_por_janela=int(os.getenv('SIMULADOR_RPM', '0')),
+            tokens_por_janela=int(os.getenv('SIMULADOR_TPM', '0')),
+            semente=int(os.getenv('SIMULADOR_SEMENTE', '42')),
+        )
+
+
+class RespostaSimulada:
+    """Imita o objeto de resposta do google-generativeai"""
+
+    def __init__(self, texto: str, finish_reason: str = "STOP", tokens_prompt: int = 0, tokens_saida: int = 0):
+        self.text = texto
+        self.candidates = [self]
+        self.content = self
+        self.parts = [texto] if texto else []
+        self.finish_reason = finish_reason
+        self.usage_metadata = _UsoTokens(tokens_prompt, tokens_saida)
+
+
+class _UsoTokens:
+    def __init__(self, tokens_prompt: int, tokens_saida: int):
+        self.prompt_token_count = tokens_prompt
+        self.candidates_token_count = tokens_saida
+        self.total_token_count = tokens_prompt + tokens_saida
+
+
+def estimar_tokens(texto: str) -> int:
+    """~4 caracteres por token, a mesma estimativa do GeminiIntegration"""
+    return max(1, len(texto) // 4)
+
+
+def _configuracao_como_dict(configuracao: Any) -> Dict[str, Any]:
+    if configuracao is None:
+        return {}
+    if isinstance(configuracao, dict):
+        return dict(configuracao)
+    return {campo: getattr(configuracao, campo) for campo in CAMPOS_REST.values()
+            if getattr(configuracao, campo, None) is not None}
+
+
+class ModeloGeminiSimulado:
+    """Substituto local de genai.GenerativeModel para benchmarks reprodutíveis"""
+
+    def __init__(self, configuracao: Optional[ConfiguracaoSimulacao] = None,
+                 generation_config: Optional[Dict[str, Any]] = None,
+                 relogio: Callable[[], float] = time.monotonic,
+                 dormir: Callable[[float], None] = time.sleep):
+        self.configuracao = configuracao or ConfiguracaoSimulacao()
+        self.generation_config = _configuracao_como_dict(generation_config)
+        self._relogio = relogio
+        self._dormir = dormir
+        self._rng = random.Random(self.configuracao.semente)
+        self._lock = threading.Lock()
+        self._inicio_janela = relogio()
+        self._requisicoes_janela = 0
+        self._tokens_janela = 0
+        self._contadores = {
+            'chamadas': 0, 'sucessos': 0, 'erros_429': 0, 'erros_500': 0,
+            'truncadas': 0, 'tokens_prompt': 0, 'tokens_saida': 0, 'tempo_simulado': 0.0,
+        }
+
+    def configurar_geracao(self, configuracao: Dict[str, Any]):
+        """Configuração padrão (GeminiIntegration chama ao injetar o backend)"""
+        self.generation_config = _configuracao_como_dict(configuracao)
+
+    def generate_content(self, prompt: str, generation_config: Any = None, **kwargs) -> RespostaSimulada:
+        configuracao = dict(self.generation_config, **_configuracao_como_dict(generation_config))
+        modo_json = configuracao.get('response_mime_type') == 'application/json'
+        texto = self.responder(prompt, modo_json)
+        tokens_prompt = estimar_tokens(prompt)
+        tokens_saida = estimar_tokens(texto)
+        limite_saida = configuracao.get('max_output_tokens')
+
+        with self._lock:
+            self._contadores['chamadas'] += 1
+            erro = self._sortear_erro(tokens_prompt + tokens_saida)
+            truncar = self._rng.random() < self.configuracao.taxa_truncamento
+            corte = self._rng.uniform(0.3, 0.9)
+            latencia = self._sortear_latencia()
+
+        if erro is not None:
+            # Erros chegam rápido, como um 429/500 real
+            self._esperar(min(latencia, self.configuracao.latencia_mediana / 4))
+            raise erro
+
+        finish_reason = "STOP"
+        if limite_saida and tokens_saida > limite_saida:
+            texto, tokens_saida, finish_reason = texto[:limite_saida * 4], limite_saida, "MAX_TOKENS"
+        elif truncar:
+            texto = texto[:int(len(texto) * corte)]
+            tokens_saida, finish_reason = estimar_tokens(texto), "MAX_TOKENS"
+
+        self._esperar(latencia + tokens_saida * self.configuracao.latencia_por_token)
+        with self._lock:
+            self._contadores['sucessos'] += 1
+            self._contadores['truncadas'] += finish_reason == "MAX_TOKENS"
+            self._contadores['tokens_prompt'] += tokens_prompt
+            self._contadores['tokens_saida'] += tokens_saida
+        return RespostaSimulada(texto, finish_reason, tokens_prompt, tokens_saida)
+
+    def _sortear_erro(self, tokens: int) -> Optional[Exception]:
+        """Cota da janela atual e erros aleatórios (chamado sob o lock)"""
+        agora = self._relogio()
+        if agora - self._inicio_janela >= self.configuracao.janela_cota:
+            self._inicio_janela = agora
+            self._requisicoes_janela = self._tokens_janela = 0
+
+        cota = self.configuracao
+        if ((cota.requisicoes_por_janela and self._requisicoes_janela >= cota.requisicoes_por_janela)
+                or (cota.tokens_por_janela and self._tokens_janela + tokens > cota.tokens_por_janela)):
+            self._contadores['erros_429'] += 1
+            return google_exceptions.ResourceExhausted("Quota exceeded (simulado)")
+
+        sorteio = self._rng.random()
+        if sorteio < cota.taxa_429:
+            self._contadores['erros_429'] += 1
+            return google_exceptions.ResourceExhausted("Resource has been exhausted (simulado)")
+        if sorteio < cota.taxa_429 + cota.taxa_500:
+            self._contadores['erros_500'] += 1
+            return google_exceptions.InternalServerError("Internal error (simulado)")
+
+        self._requisicoes_janela += 1
+        self._tokens_janela += tokens
+        return None
+
+    def _sortear_latencia(self) -> float:
+        mediana = self.configuracao.latencia_mediana
+        if mediana <= 0:
+            return 0.0
+        return mediana * math.exp(self._rng.gauss(0, self.configuracao.latencia_sigma))
+
+    def _esperar(self, segundos: float):
+        with self._lock:
+            self._contadores['tempo_simulado'] += segundos
+        if segundos > 0:
+            self._dormir(segundos)
+
+    def responder(self, prompt: str, modo_json: bool = False) -> str:
+        """Resposta determinística para o prompt (um bloco por caso em prompts agrupados)"""
+        marcas = list(PADRAO_CASO_PROMPT.finditer(prompt))
+        if not marcas:
+            caso = self._analisar_caso(prompt)
+            return json.dumps(caso, ensure_ascii=False) if modo_json else self._texto_caso(caso)
+
+        casos = []
+        for posicao, marca in enumerate(marcas):
+            fim = marcas[posicao + 1].start() if posicao + 1 < len(marcas) else len(prompt)
+            casos.append(dict(caso_id=marca.group(1), **self._analisar_caso(prompt[marca.end():fim])))
+        if modo_json:
+            return json.dumps({"casos": casos}, ensure_ascii=False)
+        return "\n\n".join(f"CASO {caso['caso_id']}\n{self._texto_caso(caso)}" for caso in casos)
+
+    def _analisar_caso(self, trecho: str) -> Dict[str, Any]:
+        patologia = PADRAO_PATOLOGIA.search(trecho)
+        permanencia = PADRAO_PERMANENCIA.search(trecho)
+        referencia = PADRAO_REFERENCIA.search(trecho)
+        patologia = patologia.group(1) if patologia else "DESCONHECIDA"
+        permanencia = int(permanencia.group(1)) if permanencia else 0
+        referencia = int(referencia.group(1)) if referencia else 0
+
+        razao = permanencia / referencia if referencia else 1.0
+        recomendacao, prioridade = next((r, p) for limite, r, p in FAIXAS_RECOMENDACAO if razao >= limite)
+        resumo = int(hashlib.sha256(trecho.encode("utf-8")).hexdigest()[:8], 16)
+        return {
+            "prioridade": prioridade,
+            "recomendacao": recomendacao,
+            "razoes_alta": [f"Permanência de {permanencia} dias para referência de {referencia} dias"],
+            "pendencias": ["Confirmar documentação de encerramento"] if resumo % 2 else [],
+            "fontes_informacao": ["DADOS DA INTERNAÇÃO", "INFORMAÇÕES DE REFERÊNCIA"],
+            "confianca": round(0.6 + (resumo % 35) / 100, 2),
+            "analise_inicial": f"Caso de {patologia} com {permanencia} dias de permanência (simulado).",
+        }
+
+    @staticmethod
+    def _texto_caso(caso: Dict[str, Any]) -> str:
+        return "\n".join([
+            f"ANALISE_INICIAL: {caso['analise_inicial']}",
+            "RAZÕES_ALTA:", *[f"- {razao}" for razao in caso['razoes_alta']],
+            "PENDENCIAS:", *[f"- {pendencia}" for pendencia in caso['pendencias']],
+            f"RECOMENDACAO: {caso['recomendacao']}",
+            f"FONTES: {', '.join(caso['fontes_informacao'])}",
+            f"CONFIANCA: {caso['confianca']}",
+        ])
+
+    def estatisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            estatisticas = dict(self._contadores)
+        estatisticas['tempo_simulado'] = round(estatisticas['tempo_simulado'], 3)
+        return estatisticas
+
+
+class ServidorGeminiSimulado:
+    """Servidor HTTP local com a rota generateContent da API REST do Gemini"""
+
+    def __init__(self, modelo: Optional[ModeloGeminiSimulado] = None, host: str = "127.0.0.1", porta: int = 0):
+        self.modelo = modelo or ModeloGeminiSimulado()
+        self._servidor = ThreadingHTTPServer((host, porta), self._criar_handler())
+        self._servidor.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, porta = self._servidor.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def _criar_handler(self):
+        modelo = self.modelo
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                if not self.path.split("?")[0].endswith(":generateContent"):
+                    return self._responder(404, {"error": {"code": 404, "message": "Rota inexistente", "status": "NOT_FOUND"}})
+                try:
+                    corpo = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                    prompt = "".join(parte.get("text", "") for conteudo in corpo.get("contents", [])
+                                     for parte in conteudo.get("parts", []))
+                    configuracao = {CAMPOS_REST[campo]: valor for campo, valor in corpo.get("generationConfig", {}).items()
+                                    if campo in CAMPOS_REST}
+                    resposta = modelo.generate_content(prompt, generation_config=configuracao)
+                except google_exceptions.GoogleAPICallError as erro:
+                    codigo = erro.code or 500
+                    return self._responder(codigo, {"error": {"code": codigo, "message": erro.message,
+                                                              "status": erro.grpc_status_code.name if erro.grpc_status_code else ""}})
+                except (ValueError, AttributeError) as erro:
+                    return self._responder(400, {"error": {"code": 400, "message": str(erro), "status": "INVALID_ARGUMENT"}})
+
+                uso = resposta.usage_metadata
+                self._responder(200, {
+                    "candidates": [{"content": {"parts": [{"text": resposta.text}], "role": "model"},
+                                    "finishReason": resposta.finish_reason}],
+                    "usageMetadata": {"promptTokenCount": uso.prompt_token_count,
+                                      "candidatesTokenCount": uso.candidates_token_count,
+                                      "totalTokenCount": uso.total_token_count},
+                })
+
+            def _responder(self, codigo: int, dados: Dict[str, Any]):
+                corpo = json.dumps(dados, ensure_ascii=False).encode("utf-8")
+                self.send_response(codigo)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, formato, *args):
+                logger.debug(formato, *args)
+
+        return Handler
+
+    def servir(self):
+        """Atende na thread atual até parar() ou Ctrl+C"""
+        self._servidor.serve_forever()
+
+    def iniciar(self) -> 'ServidorGeminiSimulado':
+        """Atende em uma thread de fundo"""
+        self._thread = threading.Thread(target=self._servidor.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
+
+
+class ClienteGeminiHTTP:
+    """Backend que chama o ServidorGeminiSimulado (ou outra API REST compatível)"""
+
+    def __init__(self, url_base: str, modelo: str = "gemini-2.0-flash", timeout: float = 60.0):
+        self.url = f"{url_base.rstrip('/')}/v1beta/models/{modelo}:generateContent"
+        self.timeout = timeout
+        self.generation_config: Dict[str, Any] = {}
+
+    def configurar_geracao(self, configuracao: Dict[str, Any]):
+        self.generation_config = _configuracao_como_dict(configuracao)
+
+    def generate_content(self, prompt: str, generation_config: Any = None, **kwargs) -> RespostaSimulada:
+        configuracao = dict(self.generation_config, **_configuracao_como_dict(generation_config))
+        rest = {campo: configuracao[nome] for campo, nome in CAMPOS_REST.items() if nome in configuracao}
+        corpo = json.dumps({"contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                            "generationConfig": rest}, ensure_ascii=False).encode("utf-8")
+        requisicao = urllib.request.Request(self.url, data=corpo, method="POST",
+                                            headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(requisicao, timeout=self.timeout) as resposta:
+                dados = json.loads(resposta.read())
+        except urllib.error.HTTPError as erro:
+            try:
+                mensagem = json.loads(erro.read()).get("error", {}).get("message", erro.reason)
+            except ValueError:
+                mensagem = str(erro.reason)
+            # Mesmas exceções do SDK: o RateLimiter decide o que repetir
+            raise google_exceptions.from_http_status(erro.code, mensagem) from erro
+        except (urllib.error.URLError, TimeoutError) as erro:
+            raise google_exceptions.ServiceUnavailable(f"Backend HTTP indisponível: {erro}") from erro
+
+        candidato = (dados.get("candidates") or [{}])[0]
+        texto = "".join(parte.get("text", "") for parte in candidato.get("content", {}).get("parts", []))
+        uso = dados.get("usageMetadata", {})
+        return RespostaSimulada(texto, candidato.get("finishReason", "STOP"),
+                                uso.get("promptTokenCount", 0), uso.get("candidatesTokenCount", 0))
+
+
+def criar_backend(nome: str, modelo: str = "gemini-2.0-flash"):
+    """GEMINI_BACKEND: 'simulado' (em processo) ou URL do servidor simulado"""
+    if nome == "simulado":
+        return ModeloGeminiSimulado(ConfiguracaoSimulacao.a_partir_do_ambiente())
+    if nome.startswith(("http://", "https://")):
+        return ClienteGeminiHTTP(nome, modelo)
+    raise ValueError(f"GEMINI_BACKEND desconhecido: {nome}")
+
+
+def main(argumentos: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Servidor local que simula a API do Gemini")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8765)
+    parser.add_argument("--latencia", type=float, default=0.8, help="Mediana da latência (s)")
+    parser.add_argument("--sigma", type=float, default=0.35, help="Desvio do log da latência")
+    parser.add_argument("--taxa-429", type=float, default=0.0)
+    parser.add_argument("--taxa-500", type=float, default=0.0)
+    parser.add_argument("--truncamento", type=float, default=0.0)
+    parser.add_argument("--rpm", type=int, default=0, help="Cota de requisições por minuto (0 = sem cota)")
+    parser.add_argument("--tpm", type=int, default=0, help="Cota de tokens por minuto (0 = sem cota)")
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args(argumentos)
+
+    configuracao = ConfiguracaoSimulacao(
+        latencia_mediana=args.latencia, latencia_sigma=args.sigma, taxa_429=args.taxa_429,
+        taxa_500=args.taxa_500, taxa_truncamento=args.truncamento,
+        requisicoes_por_janela=args.rpm, tokens_por_janela=args.tpm, semente=args.semente,
+    )
+    servidor = ServidorGeminiSimulado(ModeloGeminiSimulado(configuracao), args.host, args.porta)
+    print(f"Gemini simulado em {servidor.url} (Ctrl+C para parar)")
+    try:
+        servidor.servir()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.parar()
+        print(f"Estatísticas: {servidor.modelo.estatisticas()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,8 @@ Contém protocolos, regras e critérios médicos para TODAS as patologias
 """
 import json
 from typing import Dict, Any, List
+import numpy as np  #type: ignore
+import pandas as pd  #type: ignore
 from .data_knowledge_base import data_protocols, data_discharge_criteria, data_load_player_rules
 
 class MedicalKnowledgeBase:
@@ -102,6 +104,79 @@ class MedicalKnowledgeBase:
             'recommendation': self._generate_recommendation(readiness_score, pathology)
         }
     
+    def assess_discharge_readiness_df(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Versão colunar de assess_discharge_readiness para um DataFrame inteiro
+        (colunas do dataset de internações). Mesmo score, nível e conformidade
+        com o pagador do caminho escalar, sem laço Python por linha.
+        """
+        total = len(df)
+        
+        def coluna(nome, padrao):
+            if nome in df.columns:
+                return df[nome].reset_index(drop=True)
+            return pd.Series([padrao] * total, dtype=object)
+        
+        pathology = coluna('patologia', 'DESCONHECIDA').astype(object)
+        current_stay = pd.to_numeric(coluna('tempo_permanencia', 0), errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        age = pd.to_numeric(coluna('idade', 0), errors='coerce').fillna(0).to_numpy(dtype=np.int64)
+        setor = coluna('setor', 'ENFERMARIA').astype(object)
+        
+        # Lookups mapeados: uma passada por coluna em vez de dict.get por linha
+        avg_stay_map = {p: proto.get('avg_length_of_stay', 5) for p, proto in self.protocols.items()}
+        max_stay_map = self.payer_rules['max_length_of_stay']
+        avg_stay = pathology.map(avg_stay_map).fillna(5).to_numpy(dtype=np.int64)
+        max_stay = pathology.map(max_stay_map).fillna(max_stay_map['DEFAULT']).to_numpy(dtype=np.int64)
+        
+        is_compliant = current_stay <= max_stay
+        quantidade_comorbidades, sem_comorbidades = self._contar_comorbidades(coluna('comorbidades', '[]'))
+        
+        readiness_score = (
+            np.where(current_stay >= avg_stay, 25, 0)
+            + np.where(is_compliant, 25, 0)
+            + np.select([age < 65, age > 80], [20, -10], default=0)
+            + np.select([sem_comorbidades, quantidade_comorbidades >= 3], [20, -15], default=0)
+            + np.where(setor.to_numpy() != 'UTI', 10, 0)
+        )
+        readiness_score = np.clip(readiness_score, 0, 100)
+        
+        readiness_level = np.select(
+            [readiness_score >= 80, readiness_score >= 60, readiness_score >= 40],
+            ['ALTA_PRIORIDADE_ALTA', 'ALTA_PRIORIDADE_MEDIA', 'ALTA_PRIORIDADE_BAIXA'],
+            default='MANTER_INTERNACAO'
+        )
+        
+        return pd.DataFrame({
+            'readiness_score': readiness_score,
+            'readiness_level': readiness_level,
+            'avg_length_of_stay': avg_stay,
+            'max_allowed_stay': max_stay,
+            'excess_days': np.maximum(0, current_stay - max_stay),
+            'is_compliant': is_compliant,
+            'compliance_level': np.where(is_compliant, 'COMPLIANT', 'NON_COMPLIANT'),
+        }, index=df.index)
+    
+    def _contar_comorbidades(self, comorbidades: pd.Series):
+        """Quantidade de comorbidades por linha e se a lista é vazia ou só ['NENHUMA']"""
+        # O censo repete poucas combinações: o parse é feito só nos valores distintos
+        try:
+            codigos, distintos = pd.factorize(comorbidades)
+        except TypeError:
+            # Listas não são hasheáveis: viram texto no mesmo formato do CSV
+            codigos, distintos = pd.factorize(comorbidades.map(lambda x: ','.join(x) if isinstance(x, list) else x))
+        
+        quantidade_distintos = np.zeros(len(distintos) + 1, dtype=np.int64)
+        sem_distintos = np.ones(len(distintos) + 1, dtype=bool)  # último = vazio/NaN
+        for posicao, valor in enumerate(distintos):
+            if not isinstance(valor, str):
+                continue
+            itens = [c.strip() for c in valor.strip('[]').replace("'", "").replace('"', '').split(',') if c.strip()]
+            quantidade_distintos[posicao] = len(itens)
+            sem_distintos[posicao] = not itens or itens == ['NENHUMA']
+        
+        # factorize marca NaN com -1, que aponta para a posição extra
+        return quantidade_distintos[codigos], sem_distintos[codigos]
+    
     def _get_readiness_level(self, score: int) -> str:
         """Converte score em nível de prontidão"""
         if score >= 80:
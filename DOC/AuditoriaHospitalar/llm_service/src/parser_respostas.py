@@ -0,0 +1,277 @@
+"""
+Parser das respostas do Gemini em uma única passada
+
+Aceita o formato pedido no prompt (CHAVE: valor, em maiúsculas, com ou sem
+acento, indentado, com marcadores markdown) e também JSON. Todos os padrões
+são compilados uma vez na importação; o texto é varrido uma vez para achar os
+cabeçalhos de seção e cada seção é limpa só uma vez.
+
+No modo JSON do Gemini (ESQUEMA_RESPOSTA) a resposta é decodificada direto,
+com orjson quando instalado. Respostas de prompts agrupados (um bloco
+"CASO <id>" por internação) são separadas por dividir_por_caso.
+"""
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+
+    _decodificar_json = orjson.loads
+except ImportError:  # orjson é opcional
+    _decodificar_json = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Cabeçalho no início da linha: "RAZÕES_ALTA:", "  **Recomendação:**", "- FONTES:"
+PADRAO_CHAVE = re.compile(
+    r"^[ \t]*(?:[-*+•#>]+[ \t]*)?\**[ \t]*([^\W\d][\w \t]{2,40}?)[ \t]*\**[ \t]*:[ \t]*\**[ \t]*",
+    re.MULTILINE,
+)
+PADRAO_MARCADOR = re.compile(r"^\s*[\*\-\+•]\s*")
+PADRAO_NUMERO = re.compile(r"[0-9]+(?:[.,][0-9]+)?")
+PADRAO_BLOCO_JSON = re.compile(r"\{.*\}", re.DOTALL)
+# Início de bloco de um prompt agrupado: "CASO I00001", "### Caso C2:", "**CASO C3**"
+PADRAO_CASO = re.compile(
+    r"^[ \t]*(?:[-*#>]+[ \t]*)?\**[ \t]*CASO[ \t]*[:#]?[ \t]*([\w\-]+)[ \t]*\**[ \t]*:?[ \t]*\**[ \t]*$",
+    re.MULTILINE | re.IGNORECASE,
+)
+
+# Sem acento e minúsculo: 'RAZÕES ALTA' -> 'razoes_alta'
+_TABELA_CHAVES = str.maketrans("ÁÀÂÃÉÊÍÓÔÕÚÇáàâãéêíóôõúç \t", "AAAAEEIOOOUCaaaaeeiooouc__")
+
+# Nome normalizado -> campo do resultado
+CAMPOS = {
+    "analise_inicial": "analise_inicial",
+    "analise": "analise_inicial",
+    "razoes_alta": "razoes_alta",
+    "razoes": "razoes_alta",
+    "pendencias": "pendencias",
+    "recomendacao": "recomendacao",
+    "prioridade": "prioridade",
+    "fontes": "fontes_informacao",
+    "fontes_informacao": "fontes_informacao",
+    "confianca": "confianca",
+}
+CAMPOS_LISTA = ("razoes_alta", "pendencias", "fontes_informacao")
+PRIORIDADES = ("ALTA", "MEDIA", "BAIXA", "MANTER")
+CONFIANCA_PADRAO = 0.75
+
+# Esquema da saída estruturada (response_schema), com os campos validados
+# por LLMService._validar_estrutura_resposta
+ESQUEMA_RESPOSTA = {
+    "type": "object",
+    "properties": {
+        "prioridade": {"type": "string", "enum": list(PRIORIDADES)},
+        "razoes_alta": {"type": "array", "items": {"type": "string"}},
+        "pendencias": {"type": "array", "items": {"type": "string"}},
+        "fontes_informacao": {"type": "array", "items": {"type": "string"}},
+        "confianca": {"type": "number"},
+        "analise_inicial": {"type": "string"},
+    },
+    "required": ["prioridade", "razoes_alta", "pendencias", "fontes_informacao", "confianca", "analise_inicial"],
+}
+# Prompt agrupado: um item por caso, identificado por caso_id
+ESQUEMA_RESPOSTA_LOTE = {
+    "type": "object",
+    "properties": {
+        "casos": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {"caso_id": {"type": "string"}, **ESQUEMA_RESPOSTA["properties"]},
+                "required": ["caso_id"] + ESQUEMA_RESPOSTA["required"],
+            },
+        },
+    },
+    "required": ["casos"],
+}
+
+
+def normalizar_chave(chave: str) -> str:
+    return chave.strip().translate(_TABELA_CHAVES).lower()
+
+
+def mapear_recomendacao_para_prioridade(recomendacao: str) -> str:
+    if not recomendacao:
+        return "MEDIA"
+    recomendacao = recomendacao.upper().strip()
+    if "ALTA_PRIORIDADE_ALTA" in recomendacao:
+        return "ALTA"
+    elif "ALTA_PRIORIDADE_MEDIA" in recomendacao:
+        return "MEDIA"
+    elif "ALTA_PRIORIDADE_BAIXA" in recomendacao:
+        return "BAIXA"
+    elif "MANTER_INTERNACAO" in recomendacao:
+        return "MANTER"
+    else:
+        if "ALTA" in recomendacao and "PRIORIDADE" not in recomendacao:
+            return "ALTA"
+        elif any(
+            word in recomendacao for word in ["CONTINUAR", "MANTER", "PERMANECER"]
+        ):
+            return "MANTER"
+        else:
+            return "MEDIA"
+
+
+class ParserRespostaLLM:
+    """Converte a resposta bruta do LLM no dicionário usado pelo BatchProcessor"""
+
+    def parse(self, resposta: str) -> Dict[str, Any]:
+        resposta_limpa = resposta.strip()
+        secoes = None
+        if "{" in resposta_limpa:
+            secoes = self._secoes_json(resposta_limpa)
+        if secoes is None:
+            secoes = self._secoes_texto(resposta_limpa)
+        return self._montar(secoes, resposta_limpa)
+
+    def parse_json(self, resposta: str) -> Optional[Dict[str, Any]]:
+        """Caminho rápido do modo JSON: None se a resposta não for um objeto JSON"""
+        resposta_limpa = resposta.strip()
+        try:
+            dados = _decodificar_json(resposta_limpa)
+        except ValueError:
+            return None
+        if not isinstance(dados, dict):
+            return None
+        return self._montar(self._campos_json(dados), resposta_limpa)
+
+    def dividir_por_caso(self, resposta: str, ids: List[str]) -> Dict[str, Dict[str, Any]]:
+        """
+        Resultado por caso_id de uma resposta agrupada. Blocos de IDs fora de
+        `ids`, repetidos ou incompletos (sem recomendação/prioridade ou sem
+        confiança, o último campo, como numa resposta truncada) ficam de fora.
+        """
+        esperados = {normalizar_chave(caso_id): caso_id for caso_id in ids}
+        blocos = self._blocos_json(resposta)
+        if blocos is None:
+            blocos = self._blocos_texto(resposta)
+
+        resultados: Dict[str, Dict[str, Any]] = {}
+        repetidos = set()
+        for caso_id, secoes, bruto in blocos:
+            caso_id = esperados.get(normalizar_chave(caso_id))
+            if caso_id is None or not self._bloco_completo(secoes):
+                continue
+            if caso_id in resultados:
+                repetidos.add(caso_id)
+                continue
+            resultados[caso_id] = self._montar(secoes, bruto)
+        for caso_id in repetidos:
+            # Dois blocos para o mesmo caso: nenhum dos dois é confiável
+            del resultados[caso_id]
+        return resultados
+
+    @staticmethod
+    def _bloco_completo(secoes: Dict[str, Any]) -> bool:
+        return "confianca" in secoes and ("recomendacao" in secoes or "prioridade" in secoes)
+
+    def _blocos_texto(self, texto: str) -> List[tuple]:
+        marcas = list(PADRAO_CASO.finditer(texto))
+        blocos = []
+        for posicao, marca in enumerate(marcas):
+            fim = marcas[posicao + 1].start() if posicao + 1 < len(marcas) else len(texto)
+            bruto = texto[marca.end():fim].strip()
+            blocos.append((marca.group(1), self._secoes_texto(bruto), bruto))
+        return blocos
+
+    def _blocos_json(self, texto: str) -> Optional[List[tuple]]:
+        bloco = PADRAO_BLOCO_JSON.search(texto) if "{" in texto else None
+        if not bloco:
+            return None
+        try:
+            dados = _decodificar_json(bloco.group(0))
+        except ValueError:
+            return None
+        casos = dados.get("casos") if isinstance(dados, dict) else None
+        if not isinstance(casos, list):
+            return None
+        return [
+            (str(caso.get("caso_id", "")), self._campos_json(caso), json.dumps(caso, ensure_ascii=False))
+            for caso in casos if isinstance(caso, dict)
+        ]
+
+    def _secoes_texto(self, texto: str) -> Dict[str, Any]:
+        """Uma varredura: cada cabeçalho conhecido abre uma seção que vai até o próximo"""
+        secoes: Dict[str, Any] = {}
+        campo_atual = None
+        inicio = 0
+        for match in PADRAO_CHAVE.finditer(texto):
+            campo = CAMPOS.get(normalizar_chave(match.group(1)))
+            if campo is None:
+                # "Observação: ..." dentro do conteúdo não encerra a seção
+                continue
+            if campo_atual is not None:
+                secoes.setdefault(campo_atual, texto[inicio:match.start()])
+            campo_atual = campo
+            inicio = match.end()
+        if campo_atual is not None:
+            secoes.setdefault(campo_atual, texto[inicio:])
+
+        for campo, conteudo in secoes.items():
+            linhas = [PADRAO_MARCADOR.sub("", linha).strip() for linha in conteudo.splitlines()]
+            linhas = [linha for linha in linhas if linha]
+            secoes[campo] = linhas if campo in CAMPOS_LISTA else "\n".join(linhas)
+        return secoes
+
+    def _secoes_json(self, texto: str) -> Optional[Dict[str, Any]]:
+        """Objeto JSON (também dentro de ```json ... ```); None se não houver JSON válido"""
+        bloco = PADRAO_BLOCO_JSON.search(texto)
+        if not bloco:
+            return None
+        try:
+            dados = _decodificar_json(bloco.group(0))
+        except ValueError:
+            return None
+        if not isinstance(dados, dict):
+            return None
+        return self._campos_json(dados)
+
+    def _campos_json(self, dados: Dict[str, Any]) -> Dict[str, Any]:
+        secoes: Dict[str, Any] = {}
+        for chave, valor in dados.items():
+            campo = CAMPOS.get(normalizar_chave(str(chave)))
+            if campo is None or campo in secoes:
+                continue
+            if campo in CAMPOS_LISTA:
+                if isinstance(valor, (list, tuple)):
+                    valor = [str(item).strip() for item in valor if str(item).strip()]
+                else:
+                    valor = [str(valor).strip()] if valor not in (None, "") else []
+            elif valor is None:
+                valor = ""
+            secoes[campo] = valor
+        return secoes
+
+    def _montar(self, secoes: Dict[str, Any], resposta_limpa: str) -> Dict[str, Any]:
+        recomendacao = str(secoes.get("recomendacao", ""))
+        prioridade = str(secoes.get("prioridade", "")).upper().strip()
+        if prioridade not in PRIORIDADES:
+            prioridade = mapear_recomendacao_para_prioridade(recomendacao or prioridade)
+
+        return {
+            "prioridade": prioridade,
+            "razoes_alta": secoes.get("razoes_alta", []),
+            "pendencias": secoes.get("pendencias", []),
+            "fontes_informacao": secoes.get("fontes_informacao", []),
+            "confianca": self._confianca(secoes.get("confianca")),
+            "resposta_bruta_llm": resposta_limpa,
+            "analise_inicial": str(secoes.get("analise_inicial", "")),
+            "recomendacao_original": recomendacao,
+        }
+
+    @staticmethod
+    def _confianca(valor: Any) -> float:
+        if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+            return float(valor)
+        match = PADRAO_NUMERO.search(str(valor or ""))
+        if match:
+            return float(match.group(0).replace(",", "."))
+        return CONFIANCA_PADRAO
+
+
+# Instância global para uso
+parser_respostas = ParserRespostaLLM()
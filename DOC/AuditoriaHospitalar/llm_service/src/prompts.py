@@ -1,7 +1,11 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 import json
+import re
 from datetime import datetime
 
+# Caracteres aceitos no ID de caso dos prompts agrupados
+PADRAO_ID_INVALIDO = re.compile(r"[^\w\-]+")
+
 class PromptTemplates:
     """Templates de prompts para o Thinking Model"""
     
@@ -34,8 +38,9 @@ class PromptTemplates:
         CONFIANCA: [0.0-1.0]
         """
     
-    def criar_prompt_analise_alta(self, internacao_data: Dict[str, Any], contexto: Dict[str, Any]) -> str:
-        """Cria prompt SEGURO para análise de alta"""
+    def criar_prompt_analise_alta(self, internacao_data: Dict[str, Any], contexto: Dict[str, Any],
+                                  formato_json: bool = False) -> str:
+        """Cria prompt SEGURO para análise de alta (formato_json: saída no ESQUEMA_RESPOSTA)"""
         
         # Dados básicos apenas
         patologia = internacao_data.get('patologia', 'Desconhecida')
@@ -63,16 +68,77 @@ class PromptTemplates:
         ANÁLISE REQUERIDA:
         Baseado apenas nos dados acima, avalie a prioridade para avaliação de alta (encerramento logístico/financeiro).
 
-        RESPOSTA (formato exato):
+        {self._formato_resposta_json() if formato_json else self._formato_resposta_texto()}
+        """
+        
+        return prompt
+
+    def ids_casos(self, lista_internacoes: List[Dict[str, Any]]) -> List[str]:
+        """IDs estáveis dos casos de um prompt agrupado: internacao_id, ou a posição se faltar/repetir"""
+        ids = [PADRAO_ID_INVALIDO.sub('', str(dados.get('internacao_id') or '')) for dados in lista_internacoes]
+        if all(ids) and len(set(ids)) == len(ids):
+            return ids
+        return [f"C{posicao + 1}" for posicao in range(len(lista_internacoes))]
+
+    def criar_prompt_analise_lote(self, casos: List[Tuple[str, Dict[str, Any], Dict[str, Any]]],
+                                  formato_json: bool = False) -> str:
+        """
+        Um prompt para várias internações (caso_id, internacao_data, contexto):
+        o prompt do sistema vai uma vez só e a resposta traz um bloco por caso
+        """
+        blocos = []
+        for caso_id, internacao_data, contexto in casos:
+            conformidade = (contexto or {}).get('knowledge_base', {}).get('conformidade_pagador', {})
+            blocos.append(f"""CASO {caso_id}:
+        - Motivo Principal: {internacao_data.get('patologia', 'Desconhecida')}
+        - Duração da Permanência: {internacao_data.get('tempo_permanencia', 0)} dias
+        - Tempo de Referência: {internacao_data.get('tempo_ideal_patologia', 0)} dias
+        - Setor: {internacao_data.get('setor', '')}
+        - Tempo máximo permitido: {conformidade.get('max_allowed_stay', 'N/A')} dias
+        - Status conformidade: {'DENTRO DO LIMITE' if conformidade.get('is_compliant') else 'FORA DO LIMITE'}""")
+        dados_casos = "\n\n        ".join(blocos)
+        formato = self._formato_resposta_lote_json() if formato_json else self._formato_resposta_lote_texto()
+
+        return f"""
+        {self._get_system_prompt()}
+
+        DADOS DOS CASOS ({len(casos)}):
+        {dados_casos}
+
+        ANÁLISE REQUERIDA:
+        Avalie cada caso de forma independente, apenas com os dados dele, a prioridade para avaliação de alta (encerramento logístico/financeiro).
+
+        {formato}
+        """
+
+    def _formato_resposta_lote_texto(self) -> str:
+        return """RESPOSTA: um bloco por caso, na mesma ordem, cada um iniciado pela linha "CASO <id>" e no formato exato:
+        CASO <id>
         ANALISE_INICIAL: [resumo administrativo]
         RAZÕES_ALTA: [lista de razões administrativas/logísticas]
         PENDENCIAS: [lista de informações faltantes]
         RECOMENDACAO: [ALTA_PRIORIDADE_ALTA | ALTA_PRIORIDADE_MEDIA | ALTA_PRIORIDADE_BAIXA | MANTER_INTERNACAO]
         FONTES: [DADOS DA INTERNAÇÃO, INFORMAÇÕES DE REFERÊNCIA]
-        CONFIANCA: [0.0-1.0]
-        """
-        
-        return prompt
+        CONFIANCA: [0.0-1.0]"""
+
+    def _formato_resposta_lote_json(self) -> str:
+        return """RESPOSTA: objeto JSON {"casos": [...]} (ignore o formato de texto acima) com um item
+        por caso: caso_id, prioridade (ALTA | MEDIA | BAIXA | MANTER), razoes_alta, pendencias,
+        fontes_informacao (listas curtas), confianca (0.0-1.0) e analise_inicial."""
+
+    def _formato_resposta_texto(self) -> str:
+        return """RESPOSTA (formato exato):
+        ANALISE_INICIAL: [resumo administrativo]
+        RAZÕES_ALTA: [lista de razões administrativas/logísticas]
+        PENDENCIAS: [lista de informações faltantes]
+        RECOMENDACAO: [ALTA_PRIORIDADE_ALTA | ALTA_PRIORIDADE_MEDIA | ALTA_PRIORIDADE_BAIXA | MANTER_INTERNACAO]
+        FONTES: [DADOS DA INTERNAÇÃO, INFORMAÇÕES DE REFERÊNCIA]
+        CONFIANCA: [0.0-1.0]"""
+
+    def _formato_resposta_json(self) -> str:
+        return """RESPOSTA: objeto JSON (ignore o formato de texto acima) com
+        prioridade (ALTA | MEDIA | BAIXA | MANTER), razoes_alta, pendencias,
+        fontes_informacao (listas curtas), confianca (0.0-1.0) e analise_inicial."""
     
     def _formatar_contexto_clinico(self, protocolo: Dict, conformidade: Dict, contexto_vector: List) -> str:
         """Formata o contexto para o prompt - VERSÃO SEM TERMOS CLÍNICOS"""
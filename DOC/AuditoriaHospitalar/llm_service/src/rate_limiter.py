@@ -0,0 +1,232 @@
+"""
+Limitador de taxa compartilhado para as chamadas ao Gemini
+
+Combina dois token buckets (requisições/min e tokens/min), uma janela de
+concorrência ajustada no estilo AIMD e retentativas com backoff exponencial
+com jitter para erros transitórios (429, 500, 503, timeout).
+"""
+import os
+import random
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from google.api_core import exceptions as google_exceptions  # type: ignore
+
+logger = logging.getLogger(__name__)
+
+# Falta de orçamento menor que isso conta como zero (erro de ponto flutuante)
+FOLGA_ARREDONDAMENTO = 1e-9
+
+# Erros que indicam cota/limite de taxa do provedor
+ERROS_LIMITE = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests)
+
+# Erros transitórios do servidor que valem nova tentativa
+ERROS_TRANSITORIOS = (
+    google_exceptions.InternalServerError,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    google_exceptions.GatewayTimeout,
+)
+
+
+def erro_de_limite(erro: Exception) -> bool:
+    """Verifica se o erro é de cota excedida (HTTP 429)"""
+    return isinstance(erro, ERROS_LIMITE) or getattr(erro, 'code', None) == 429
+
+
+def erro_retentavel(erro: Exception) -> bool:
+    """Verifica se vale a pena repetir a chamada que gerou o erro"""
+    return erro_de_limite(erro) or isinstance(erro, ERROS_TRANSITORIOS) or getattr(erro, 'code', None) in (500, 503, 504)
+
+
+class RateLimiter:
+    """Token bucket de requisições e tokens por minuto com concorrência AIMD"""
+
+    def __init__(self,
+                 requisicoes_por_minuto: float = 15,
+                 tokens_por_minuto: float = 1_000_000,
+                 max_concorrencia: int = 8,
+                 max_tentativas: int = 5,
+                 backoff_base: float = 1.0,
+                 backoff_maximo: float = 60.0,
+                 relogio: Callable[[], float] = time.monotonic,
+                 dormir: Callable[[float], None] = time.sleep):
+        # `not > 0` também recusa NaN; 0 dividiria por zero no cálculo da espera
+        if not float(requisicoes_por_minuto) > 0:
+            raise ValueError(f"requisicoes_por_minuto deve ser positivo: {requisicoes_por_minuto}")
+        if not float(tokens_por_minuto) > 0:
+            raise ValueError(f"tokens_por_minuto deve ser positivo: {tokens_por_minuto}")
+        self.requisicoes_por_minuto = float(requisicoes_por_minuto)
+        self.tokens_por_minuto = float(tokens_por_minuto)
+        # Com menos de 1 RPM o bucket nunca juntaria uma requisição inteira:
+        # a capacidade é no mínimo 1 e a taxa de recarga continua a configurada
+        self._capacidade_requisicoes = max(1.0, self.requisicoes_por_minuto)
+        self.max_concorrencia = max(1, int(max_concorrencia))
+        self.max_tentativas = max(1, int(max_tentativas))
+        self.backoff_base = backoff_base
+        self.backoff_maximo = backoff_maximo
+        self._relogio = relogio
+        self._dormir = dormir
+
+        self._condicao = threading.Condition()
+        self._requisicoes_disponiveis = self._capacidade_requisicoes
+        self._tokens_disponiveis = self.tokens_por_minuto
+        self._ultima_recarga = relogio()
+        self._em_andamento = 0
+        self.limite_concorrencia = float(self.max_concorrencia)
+
+        self._inicio = relogio()
+        self._contadores = {
+            'requisicoes': 0,
+            'sucessos': 0,
+            'falhas': 0,
+            'retentativas': 0,
+            'erros_limite': 0,
+            'tokens_consumidos': 0,
+            'tempo_backoff_total': 0.0,
+            'tempo_espera_bucket': 0.0,
+        }
+
+    @classmethod
+    def a_partir_do_ambiente(cls) -> 'RateLimiter':
+        """Cria o limitador com os orçamentos definidos no .env"""
+        return cls(
+            requisicoes_por_minuto=float(os.getenv('GEMINI_RPM', '15')),
+            tokens_por_minuto=float(os.getenv('GEMINI_TPM', '1000000')),
+            max_concorrencia=int(os.getenv('GEMINI_MAX_CONCORRENCIA', '8')),
+        )
+
+    def _recarregar(self):
+        """Repõe os buckets proporcionalmente ao tempo decorrido (chamar com lock)"""
+        agora = self._relogio()
+        decorrido = max(0.0, agora - self._ultima_recarga)
+        self._ultima_recarga = agora
+        self._requisicoes_disponiveis = min(
+            self._capacidade_requisicoes,
+            self._requisicoes_disponiveis + decorrido * self.requisicoes_por_minuto / 60.0
+        )
+        self._tokens_disponiveis = min(
+            self.tokens_por_minuto,
+            self._tokens_disponiveis + decorrido * self.tokens_por_minuto / 60.0
+        )
+
+    def adquirir(self, tokens_estimados: int = 0):
+        """Bloqueia até existir vaga de concorrência e orçamento nos dois buckets"""
+        # Um pedido maior que o bucket inteiro nunca seria atendido
+        tokens = min(float(tokens_estimados), self.tokens_por_minuto)
+
+        with self._condicao:
+            while self._em_andamento >= int(self.limite_concorrencia):
+                self._condicao.wait()
+            self._em_andamento += 1
+
+        while True:
+            with self._condicao:
+                self._recarregar()
+                falta_requisicoes = 1.0 - self._requisicoes_disponiveis
+                falta_tokens = tokens - self._tokens_disponiveis
+
+                # Tolerância de arredondamento: a recarga de uma espera exata pode
+                # parar em 0.9999999999999999 e a espera restante não avançar o relógio
+                if falta_requisicoes <= FOLGA_ARREDONDAMENTO and falta_tokens <= FOLGA_ARREDONDAMENTO:
+                    self._requisicoes_disponiveis -= 1.0
+                    self._tokens_disponiveis -= tokens
+                    self._contadores['requisicoes'] += 1
+                    return
+
+                espera = max(
+                    falta_requisicoes * 60.0 / self.requisicoes_por_minuto,
+                    falta_tokens * 60.0 / self.tokens_por_minuto,
+                )
+                self._contadores['tempo_espera_bucket'] += espera
+
+            self._dormir(espera)
+
+    def liberar(self, tokens_estimados: int = 0, tokens_reais: Optional[int] = None):
+        """Devolve a vaga de concorrência e acerta o bucket de tokens com o consumo real"""
+        with self._condicao:
+            consumidos = tokens_reais if tokens_reais is not None else tokens_estimados
+            if tokens_reais is not None:
+                self._tokens_disponiveis += min(float(tokens_estimados), self.tokens_por_minuto) - tokens_reais
+            self._contadores['tokens_consumidos'] += int(consumidos)
+            self._em_andamento -= 1
+            self._condicao.notify_all()
+
+    def registrar_sucesso(self):
+        """Aumento aditivo: cerca de +1 vaga a cada janela completa de sucessos"""
+        with self._condicao:
+            self._contadores['sucessos'] += 1
+            self.limite_concorrencia = min(
+                float(self.max_concorrencia),
+                self.limite_concorrencia + 1.0 / self.limite_concorrencia
+            )
+            self._condicao.notify_all()
+
+    def registrar_limite_excedido(self):
+        """Redução multiplicativa da concorrência após um 429"""
+        with self._condicao:
+            self._contadores['erros_limite'] += 1
+            self.limite_concorrencia = max(1.0, self.limite_concorrencia / 2.0)
+            # O provedor já recusou: não gastar o restante do bucket em rajada
+            self._requisicoes_disponiveis = min(self._requisicoes_disponiveis, 0.0)
+
+    def calcular_backoff(self, tentativa: int) -> float:
+        """Backoff exponencial com jitter completo"""
+        teto = min(self.backoff_maximo, self.backoff_base * (2 ** tentativa))
+        return random.uniform(0, teto)
+
+    def executar(self,
+                 chamada: Callable[[], Any],
+                 tokens_estimados: int = 0,
+                 tokens_reais: Optional[Callable[[Any], Optional[int]]] = None) -> Any:
+        """
+        Executa `chamada` respeitando os orçamentos e repetindo erros retentáveis.
+        Erros não retentáveis, ou a última falha após max_tentativas, são relançados.
+        """
+        for tentativa in range(self.max_tentativas):
+            self.adquirir(tokens_estimados)
+            resultado = None
+            try:
+                resultado = chamada()
+            except Exception as e:
+                # Chamada recusada: os tokens reservados voltam ao bucket
+                self.liberar(tokens_estimados, 0)
+
+                if erro_de_limite(e):
+                    self.registrar_limite_excedido()
+
+                if not erro_retentavel(e) or tentativa == self.max_tentativas - 1:
+                    with self._condicao:
+                        self._contadores['falhas'] += 1
+                    raise
+
+                espera = self.calcular_backoff(tentativa)
+                logger.warning(f"Gemini: erro retentável ({type(e).__name__}), "
+                               f"tentativa {tentativa + 1}/{self.max_tentativas}, aguardando {espera:.2f}s")
+                with self._condicao:
+                    self._contadores['retentativas'] += 1
+                    self._contadores['tempo_backoff_total'] += espera
+                self._dormir(espera)
+                continue
+
+            self.liberar(tokens_estimados, tokens_reais(resultado) if tokens_reais else None)
+            self.registrar_sucesso()
+            return resultado
+
+    def estatisticas(self) -> Dict[str, Any]:
+        """Contadores de vazão, retentativas e tempo de espera"""
+        with self._condicao:
+            estatisticas = dict(self._contadores)
+            decorrido = max(self._relogio() - self._inicio, 1e-9)
+            estatisticas['tempo_backoff_total'] = round(estatisticas['tempo_backoff_total'], 3)
+            estatisticas['tempo_espera_bucket'] = round(estatisticas['tempo_espera_bucket'], 3)
+            estatisticas['limite_concorrencia'] = round(self.limite_concorrencia, 2)
+            estatisticas['em_andamento'] = self._em_andamento
+            estatisticas['vazao_req_por_min'] = round(estatisticas['sucessos'] * 60.0 / decorrido, 2)
+            return estatisticas
+
+
+# Instância global compartilhada por todas as GeminiIntegration do processo
+gemini_rate_limiter = RateLimiter.a_partir_do_ambiente()
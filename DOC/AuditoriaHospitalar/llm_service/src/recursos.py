@@ -0,0 +1,70 @@
+"""
+Registro de recursos pesados compartilhados pelo processo
+
+Modelos de embeddings, clientes/coleções do ChromaDB e a indexação inicial
+são criados uma única vez (sob demanda e de forma thread-safe) e reutilizados
+por todos os RAGSystem/LLMService/BatchProcessor do mesmo processo.
+"""
+import threading
+import time
+import logging
+from typing import Any, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+_AUSENTE = object()
+
+
+class RegistroRecursos:
+    """Cache de recursos por chave com inicialização preguiçosa e única"""
+
+    def __init__(self):
+        self._recursos: Dict[Hashable, Any] = {}
+        self._locks: Dict[Hashable, threading.Lock] = {}
+        self._lock = threading.Lock()
+        self.tempos_carga: Dict[Hashable, float] = {}
+
+    def obter(self, chave: Hashable, fabrica: Callable[[], Any]) -> Any:
+        """Retorna o recurso da chave, criando-o com `fabrica` na primeira vez"""
+        recurso = self._recursos.get(chave, _AUSENTE)
+        if recurso is not _AUSENTE:
+            return recurso
+
+        # Um lock por chave: cargas de recursos diferentes não se bloqueiam
+        with self._lock:
+            lock_chave = self._locks.setdefault(chave, threading.Lock())
+
+        with lock_chave:
+            recurso = self._recursos.get(chave, _AUSENTE)
+            if recurso is not _AUSENTE:
+                return recurso
+
+            inicio = time.perf_counter()
+            recurso = fabrica()
+            self.tempos_carga[chave] = time.perf_counter() - inicio
+            self._recursos[chave] = recurso
+            logger.info(f"Recurso {chave} carregado em {self.tempos_carga[chave]:.2f}s")
+            return recurso
+
+    def definir(self, chave: Hashable, recurso: Any):
+        """Substitui o recurso da chave (ex.: coleção recriada na reindexação)"""
+        with self._lock:
+            self._recursos[chave] = recurso
+
+    def contem(self, chave: Hashable) -> bool:
+        return chave in self._recursos
+
+    def remover(self, chave: Hashable):
+        """Descarta um recurso para que a próxima chamada a obter() o recrie"""
+        with self._lock:
+            self._recursos.pop(chave, None)
+            self.tempos_carga.pop(chave, None)
+
+    def limpar(self):
+        with self._lock:
+            self._recursos.clear()
+            self.tempos_carga.clear()
+
+
+# Instância global para uso
+registro_recursos = RegistroRecursos()
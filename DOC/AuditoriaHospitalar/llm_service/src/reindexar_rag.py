@@ -1,23 +1,34 @@
 """
-Força reindexação completa do RAG
+Atualiza o RAG com a knowledge base
+
+Por padrão faz a sincronização incremental (só documentos novos, alterados
+ou removidos); use --completo para apagar e reindexar toda a coleção.
 """
+import argparse
 import os
 from dotenv import load_dotenv
 from src.rag import RAGSystem
 
 load_dotenv()
 
-def reindexar_tudo():
-    print("REINDEXAÇÃO COMPLETA DO RAG")
+def reindexar_tudo(completo: bool = False):
+    print("REINDEXAÇÃO COMPLETA DO RAG" if completo else "SINCRONIZAÇÃO INCREMENTAL DO RAG")
     print("=" * 50)
     
     rag = RAGSystem()
-    rag.reindexar_conhecimento()
+    if completo:
+        rag.reindexar_conhecimento()
+    else:
+        relatorio = rag.sincronizar_conhecimento()
     
     # Verificar resultado
     count = rag.collection.count()
     print(f"\nREINDEXAÇÃO CONCLUÍDA:")
     print(f"   • Documentos indexados: {count}")
+    if not completo:
+        print(f"   • Novos: {relatorio['novos']} | Alterados: {relatorio['alterados']} | "
+              f"Removidos: {relatorio['removidos']} | Inalterados: {relatorio['inalterados']}")
+        print(f"   • Tempo de sincronização: {relatorio['tempo']}s")
     
     # Listar patologias indexadas
     results = rag.collection.get()
@@ -30,4 +41,8 @@ def reindexar_tudo():
     print(f"   • Total de patologias: {len(patologias)}")
 
 if __name__ == "__main__":
-    reindexar_tudo()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Atualiza o vector store com a knowledge base")
+    parser.add_argument("--completo", action="store_true",
+                        help="Apaga a coleção e reindexa tudo (re-embed completo)")
+    args = parser.parse_args()
+    reindexar_tudo(completo=args.completo)
\ No newline at end of file
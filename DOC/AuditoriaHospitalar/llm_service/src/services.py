@@ -4,26 +4,36 @@ from typing import Dict, List, Optional
 from .rag import RAGSystem
 from .prompts import PromptTemplates
 from .gemini_integration import GeminiIntegration
+from .rate_limiter import erro_retentavel
+from .cache_analises import CacheAnalises
 
 logger = logging.getLogger(__name__)
 
 class LLMService:
-    def __init__(self, api_key: str = None):
+    def __init__(self, api_key: str = None, cache: Optional[CacheAnalises] = None):
         self.rag = RAGSystem()
         self.prompts = PromptTemplates()
-        self.gemini = GeminiIntegration(api_key)
+        self.gemini = GeminiIntegration(api_key, cache=cache)
     
-    def analisar_paciente_alta(self, internacao_data: Dict) -> Dict:
+    def analisar_paciente_alta(self, internacao_data: Dict, contexto: Optional[Dict] = None) -> Dict:
         """
         Analisa se paciente tem potencial para alta usando Thinking + RAG + Gemini
         Versão corrigida com tratamento robusto de erros
+
+        `contexto` permite reaproveitar o contexto já buscado em lote (RAGSystem.buscar_contexto_lote)
+        Cota excedida/Gemini indisponível após as retentativas propaga, para o
+        chamador não tomar a falha por uma análise real; demais erros retornam
+        _resposta_erro_estruturada (marcada com erro_analise).
         """
         try:
-            # 1. Buscar contexto relevante com RAG
-            contexto = self.rag.buscar_contexto_relevante(internacao_data)
+            # 1. Buscar contexto relevante com RAG (se não veio pré-carregado)
+            if contexto is None:
+                contexto = self.rag.buscar_contexto_relevante(internacao_data)
             
             # 2. Construir prompt estruturado
-            prompt = self.prompts.criar_prompt_analise_alta(internacao_data, contexto)
+            prompt = self.prompts.criar_prompt_analise_alta(
+                internacao_data, contexto, formato_json=self.gemini.modo_json
+            )
             
             # 3. Chamar Gemini com thinking model
             resposta_estruturada = self.gemini.analisar_paciente_estruturado(prompt)
@@ -32,17 +42,54 @@ class LLMService:
             resposta_validada = self._validar_estrutura_resposta(resposta_estruturada)
             
             # 5. Adicionar metadados do contexto
-            resposta_validada['contexto_utilizado'] = {
-                'protocolo': contexto.get('knowledge_base', {}).get('protocolo_patologia', {}),
-                'conformidade_pagador': contexto.get('knowledge_base', {}).get('conformidade_pagador', {}),
-                'documentos_encontrados': len(contexto.get('vector_store', []))
-            }
+            resposta_validada['contexto_utilizado'] = self._contexto_utilizado(contexto)
             
             return resposta_validada
             
         except Exception as e:
+            if erro_retentavel(e):
+                raise
             logger.error(f"Erro na análise de alta: {e}")
             return self._resposta_erro_estruturada()
+
+    def analisar_pacientes_alta_agrupados(self, lista_internacoes: List[Dict],
+                                          contextos: Optional[List[Optional[Dict]]] = None) -> List[Optional[Dict]]:
+        """
+        Analisa várias internações em uma única chamada ao Gemini (prompt agrupado
+        com um ID por caso). Retorna um resultado por internação, na mesma ordem;
+        None indica caso sem resposta válida no pacote, que deve ser reenviado
+        individualmente com analisar_paciente_alta. Erros da chamada propagam.
+        """
+        if contextos is None:
+            contextos = self.rag.buscar_contexto_lote(lista_internacoes)
+        contextos = [
+            contexto if contexto is not None else self.rag.buscar_contexto_relevante(dados)
+            for dados, contexto in zip(lista_internacoes, contextos)
+        ]
+
+        ids = self.prompts.ids_casos(lista_internacoes)
+        prompt = self.prompts.criar_prompt_analise_lote(
+            list(zip(ids, lista_internacoes, contextos)), formato_json=self.gemini.modo_json
+        )
+        respostas = self.gemini.analisar_pacientes_agrupados(prompt, ids)
+
+        resultados = []
+        for caso_id, contexto in zip(ids, contextos):
+            resposta = respostas.get(caso_id)
+            if resposta is None:
+                resultados.append(None)
+                continue
+            resposta_validada = self._validar_estrutura_resposta(resposta)
+            resposta_validada['contexto_utilizado'] = self._contexto_utilizado(contexto)
+            resultados.append(resposta_validada)
+        return resultados
+
+    def _contexto_utilizado(self, contexto: Dict) -> Dict:
+        return {
+            'protocolo': contexto.get('knowledge_base', {}).get('protocolo_patologia', {}),
+            'conformidade_pagador': contexto.get('knowledge_base', {}).get('conformidade_pagador', {}),
+            'documentos_encontrados': len(contexto.get('vector_store', []))
+        }
     
     def _validar_estrutura_resposta(self, resposta: Dict) -> Dict:
         """
@@ -105,5 +152,6 @@ class LLMService:
             'resposta_bruta_llm': '',
             'analise_inicial': 'Erro na análise automatizada',
             'recomendacao_original': 'MANTER_INTERNACAO',
-            'contexto_utilizado': {}
+            'contexto_utilizado': {},
+            'erro_analise': True
         }
\ No newline at end of file